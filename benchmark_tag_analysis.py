@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+タグ解析のベンチマーク
+tag_img のテンプレートを背景に貼り付けた合成の募集画面を、解像度・DPI 倍率・マッチングモードごとに解析し、
+工程ごとの処理時間（p50 / p95）を JSON に書き出す（コミット間の比較用）
+--corpus を指定すると、正解ラベル付きの実際のキャプチャ（labels.json）の正解率と処理時間も計測する
+
+使い方:
+    python benchmark_tag_analysis.py --output benchmark_results.json
+    python benchmark_tag_analysis.py --modes simple,fft --resolutions 800x450,1280x720 --dpi 1.0,1.5 --runs 10
+    python benchmark_tag_analysis.py --corpus tag_img --modes simple,cascade
+    python benchmark_tag_analysis.py --corpus tag_img --check-pyramid
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import tag_analysis
+
+# 計測条件の既定値
+DEFAULT_MODES = ("simple", "high_quality", "fft", "pyramid", "eigen", "cascade")
+DEFAULT_RESOLUTIONS = ((800, 450), (1280, 720), (1920, 1080))  # 論理解像度（DPI 倍率を掛ける前、small / medium / good）
+DEFAULT_DPI_SCALES = (1.0, 1.25, 1.5)
+DEFAULT_RUNS = 5
+DEFAULT_WARMUP_RUNS = 1
+
+# 計測する工程と、その工程として時間を数える関数（モジュール関数名 / クラス名.メソッド名）
+STAGES = {
+    "capture_conversion": ["bgrx_buffer_to_bgr", "image_to_bgr"],
+    "slot_detection": ["detect_tag_slots", "crop_tag_slot", "register_frame"],
+    "preprocessing": [
+        "prepare_frames_for_matching", "FrameContext.gray", "FrameContext.processed", "FrameContext.pyramid",
+        "FrameContext.quality_metrics", "preprocess_template_simple", "preprocess_template_for_small_windows"
+    ],
+    "matching": [
+        "match_template_on_frames", "HighQualityProcessBackend.score_frames", "EigenTagClassifier.classify_frames",
+        "refine_cascade"
+    ],
+    "thresholding": ["assign_tags_to_slots"],
+    "result_writing": ["save_results"],
+}
+PER_TEMPLATE_FUNCTION = "match_template_on_frames"  # テンプレートごとの時間も記録する関数
+
+
+class StageTimer:
+    """工程ごとの処理時間を集計する（入れ子の呼び出しは内側の工程だけに数える）
+
+    照合中に遅延計算される前処理なども二重に数えないように、スレッドごとの呼び出しスタックで
+    内側の関数の時間を外側の工程から差し引く。
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.stages = {stage: 0.0 for stage in STAGES}
+        self.templates = {}
+
+    def wrap(self, stage, function, per_template=False):
+        timer = self
+
+        def timed(*args, **kwargs):
+            stack = getattr(timer.local, "stack", None)
+            if stack is None:
+                stack = timer.local.stack = []
+            stack.append(0.0)  # 内側の呼び出しにかかった時間
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                own = elapsed - stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+                with timer.lock:
+                    timer.stages[stage] += own
+                    if per_template:
+                        tag_name = args[1] if len(args) > 1 else kwargs.get("tag_name")
+                        timer.templates[tag_name] = timer.templates.get(tag_name, 0.0) + own
+
+        timed.__wrapped__ = function
+        return timed
+
+    def install(self):
+        """tag_analysis の関数・メソッドを計測用に置き換える（analyze_image は実行時に名前で参照する）"""
+        for stage, names in STAGES.items():
+            for name in names:
+                owner_name, _, attribute = name.rpartition(".")
+                owner = getattr(tag_analysis, owner_name) if owner_name else tag_analysis
+                original = owner.__dict__[attribute] if owner_name else getattr(owner, attribute)
+                if isinstance(original, property):
+                    setattr(owner, attribute, property(self.wrap(stage, original.fget)))
+                else:
+                    setattr(owner, attribute, self.wrap(stage, original, name == PER_TEMPLATE_FUNCTION))
+
+
+def percentiles(values):
+    """ミリ秒単位の p50 / p95 / 平均"""
+    values = np.asarray(values, dtype=np.float64) * 1000
+    return {
+        "p50": round(float(np.percentile(values, 50)), 3),
+        "p95": round(float(np.percentile(values, 95)), 3),
+        "mean": round(float(values.mean()), 3),
+    }
+
+
+def get_git_commit():
+    """計測したコミット（git が使えない場合は None）"""
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        return result.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def load_corpus(corpus_dir, labels_path=None):
+    """labels.json の正解ラベルと画像を読み込む [(名前, 画像, 正解タグ), ...]"""
+    labels_path = labels_path or os.path.join(corpus_dir, "labels.json")
+    with open(labels_path, "r", encoding="utf-8") as labels_file:
+        labels = json.load(labels_file)
+    corpus = []
+    for file_name, truth in sorted(labels.items()):
+        image = tag_analysis.read_image(os.path.join(corpus_dir, file_name))
+        if image is None:
+            print(f"⚠️ 画像を読み込めないため省略します: {file_name}")
+            continue
+        corpus.append((file_name, image, list(truth)))
+    return corpus
+
+
+class CorpusCaptureSource:
+    """正解ラベル付きのキャプチャを順に返す（SyntheticCaptureSource と同じく last_tags に正解のタグを持つ）"""
+
+    def __init__(self, corpus):
+        self.corpus = corpus
+        self.index = 0
+        self.last_tags = []
+
+    def capture(self):
+        _, image, truth = self.corpus[self.index % len(self.corpus)]
+        self.index += 1
+        self.last_tags = truth
+        return image
+
+
+def make_capture(source):
+    """合成画面をウィンドウキャプチャと同じ BGRX のバイト列で作る"""
+    frame = source.capture()
+    height, width = frame.shape[:2]
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2BGRA).tobytes(), width, height
+
+
+def run_once(timer, source):
+    """1画面分のキャプチャ変換・解析・結果の保存を計測し、(工程ごとの時間, テンプレートごとの時間, 正解数) を返す"""
+    buffer, width, height = make_capture(source)
+    timer.reset()
+    started = time.perf_counter()
+    tag_analysis.screenshot = tag_analysis.bgrx_buffer_to_bgr(buffer, width, height)
+    result = tag_analysis.analyze_image()
+    tag_analysis.save_results(result)
+    total = time.perf_counter() - started
+    tag_analysis.flush_artifacts()  # 画像の書き出しを次の計測に重ねない
+    stages = dict(timer.stages)
+    stages["other"] = max(0.0, total - sum(stages.values()))
+    stages["total"] = total
+    correct = len(set(result.text.split("\n")) & set(source.last_tags))
+    return stages, dict(timer.templates), correct
+
+
+def measure(timer, source, runs, warmup_runs):
+    """source の画面を runs 回計測し、工程ごと・テンプレートごとの p50 / p95 と正解率を返す"""
+    for _ in range(warmup_runs):
+        run_once(timer, source)
+
+    stage_samples = {}
+    template_samples = {}
+    correct = 0
+    expected = 0
+    for _ in range(runs):
+        stages, templates, run_correct = run_once(timer, source)
+        correct += run_correct
+        expected += len(source.last_tags)
+        for stage, elapsed in stages.items():
+            stage_samples.setdefault(stage, []).append(elapsed)
+        for tag_name, elapsed in templates.items():
+            template_samples.setdefault(tag_name, []).append(elapsed)
+
+    return {
+        "accuracy": round(correct / max(expected, 1), 3),
+        "stages_ms": {stage: percentiles(samples) for stage, samples in stage_samples.items()},
+        "templates_ms": {tag_name: percentiles(samples) for tag_name, samples in sorted(template_samples.items())},
+    }
+
+
+def benchmark_case(timer, mode, resolution, dpi, runs, warmup_runs):
+    """1条件（モード × 解像度 × DPI 倍率）を計測"""
+    width, height = (int(round(value * dpi)) for value in resolution)
+    tag_analysis.MATCHING_MODE = mode
+    source = tag_analysis.SyntheticCaptureSource((width, height), seed=0)
+    size_status = tag_analysis.check_window_size(np.zeros((height, width), dtype=np.uint8))[1]
+    case = {
+        "mode": mode,
+        "resolution": f"{resolution[0]}x{resolution[1]}",
+        "dpi": dpi,
+        "size": f"{width}x{height}",
+        "size_status": size_status,
+        "runs": runs,
+    }
+    case.update(measure(timer, source, runs, warmup_runs))
+    return case
+
+
+def benchmark_corpus_case(timer, mode, corpus, corpus_name, runs, warmup_runs):
+    """実際のキャプチャ（正解ラベル付き）を1モードで計測（runs 回ずつ全画像を解析）"""
+    tag_analysis.MATCHING_MODE = mode
+    source = CorpusCaptureSource(corpus)
+    case = {
+        "mode": mode,
+        "corpus": corpus_name,
+        "images": len(corpus),
+        "runs": runs,
+    }
+    case.update(measure(timer, source, runs * len(corpus), warmup_runs))
+    return case
+
+
+def check_pyramid(corpus):
+    """正解ラベル付きのキャプチャで、画面内のタグのピラミッド探索のスコアを網羅探索と比べる
+
+    網羅探索は同じバリエーション（pyramid_search_space）を原寸で全て照合したスコア。
+    戻り値は [(画像名, タグ名, ピラミッド探索, 網羅探索), ...]（タグごとに全タグ枠の最高スコア）。
+    """
+    original = tag_analysis.find_template_in_image_pyramid
+    truth = set()
+    scores = {}
+
+    def checked(template_path, image, tag_name):
+        result = original(template_path, image, tag_name)
+        if tag_name in truth:
+            frame = tag_analysis.get_frame_context(image)
+            entry = tag_analysis.get_template_bank().get(template_path, tag_name)
+            processed_image = frame.pyramid("high_quality", tag_analysis.PYRAMID_LEVELS)[0]
+            variants, angle_order = tag_analysis.pyramid_search_space(entry, frame, processed_image)
+            exhaustive = tag_analysis.search_high_quality_variants(processed_image, variants, angle_order)[0]
+            pyramid_score, exhaustive_score = scores.get(tag_name, (0.0, 0.0))
+            scores[tag_name] = (max(pyramid_score, result[1]), max(exhaustive_score, exhaustive))
+        return result
+
+    tag_analysis.MATCHING_MODE = "pyramid"
+    tag_analysis.find_template_in_image_pyramid = checked
+    rows = []
+    try:
+        for name, image, tags in corpus:
+            truth.clear()
+            truth.update(tags)
+            scores.clear()
+            tag_analysis.screenshot = image
+            tag_analysis.analyze_image()
+            rows += [(name, tag_name, pyramid_score, exhaustive_score)
+                     for tag_name, (pyramid_score, exhaustive_score) in sorted(scores.items())]
+    finally:
+        tag_analysis.find_template_in_image_pyramid = original
+    return rows
+
+
+def prepare_script_dir(source_dir, output_dir):
+    """テンプレート・タグ頻度・固有テンプレートを計測用のディレクトリに複製"""
+    shutil.copytree(os.path.join(source_dir, "tag_img"), os.path.join(output_dir, "tag_img"))
+    for file_name in (tag_analysis.TAG_FREQUENCY_FILE, tag_analysis.EIGEN_MODEL_FILE):
+        if os.path.exists(os.path.join(source_dir, file_name)):
+            shutil.copy2(os.path.join(source_dir, file_name), output_dir)
+
+
+def parse_resolutions(text):
+    return [tuple(int(value) for value in item.lower().split("x")) for item in text.split(",")]
+
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="タグ解析の工程別ベンチマーク")
+    parser.add_argument("--modes", default=",".join(DEFAULT_MODES), help="マッチングモード（カンマ区切り）")
+    parser.add_argument("--resolutions", help="論理解像度（例: 800x450,1280x720、既定は " +
+                        ",".join(f"{w}x{h}" for w, h in DEFAULT_RESOLUTIONS) + "。--corpus の指定時は省略すると合成画面を計測しない）")
+    parser.add_argument("--dpi", default=",".join(str(scale) for scale in DEFAULT_DPI_SCALES), help="DPI 倍率（例: 1.0,1.5）")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="条件ごとの計測回数")
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP_RUNS, help="計測前に捨てる実行回数")
+    parser.add_argument("--corpus", help="正解ラベル付きのキャプチャのディレクトリ（例: tag_img）")
+    parser.add_argument("--labels", help="正解ラベルの JSON（既定は <corpus>/labels.json）")
+    parser.add_argument("--check-pyramid", action="store_true",
+                        help="計測の代わりに、--corpus の画面内のタグのピラミッド探索のスコアが網羅探索から "
+                             "PYRAMID_SCORE_TOLERANCE を超えて下がらないことを確認する（超えた場合は終了コード 1）")
+    parser.add_argument("--output", default="benchmark_results.json", help="結果の JSON ファイル")
+    args = parser.parse_args()
+    if args.check_pyramid and not args.corpus:
+        parser.error("--check-pyramid には --corpus を指定してください")
+
+    tag_analysis.configure_console_encoding()
+    tag_analysis.configure_logging("ERROR")  # 解析中のログは出力しない
+    modes = args.modes.split(",")
+    if args.resolutions:
+        resolutions = parse_resolutions(args.resolutions)
+    else:
+        resolutions = [] if args.corpus else list(DEFAULT_RESOLUTIONS)
+    dpi_scales = [float(scale) for scale in args.dpi.split(",")]
+    corpus = load_corpus(args.corpus, args.labels) if args.corpus else []
+    if args.corpus and not corpus:
+        print(f"❌ 正解ラベル付きの画像がありません: {args.corpus}")
+        return 1
+
+    if args.check_pyramid:
+        with tempfile.TemporaryDirectory() as output_dir:
+            prepare_script_dir(tag_analysis.get_script_dir(), output_dir)
+            os.environ["SCRIPT_DIR"] = output_dir
+            rows = check_pyramid(corpus)
+        failures = [row for row in rows if row[3] - row[2] > tag_analysis.PYRAMID_SCORE_TOLERANCE]
+        worst = max((exhaustive - pyramid for _, _, pyramid, exhaustive in rows), default=0.0)
+        for name, tag_name, pyramid, exhaustive in failures:
+            print(f"❌ {name} {tag_name}: ピラミッド探索 {pyramid:.3f} / 網羅探索 {exhaustive:.3f}")
+        print(f"{'✅' if not failures else '❌'} ピラミッド探索: {len(rows)} タグ中 {len(failures)} 件が許容値 "
+              f"{tag_analysis.PYRAMID_SCORE_TOLERANCE} を超過（最大の低下 {worst:.3f}）")
+        return 1 if failures else 0
+
+    timer = StageTimer()
+    timer.install()
+
+    results = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        # report.txt・キャリブレーションなどの書き出しで実際の SCRIPT_DIR を書き換えないよう、入力ファイルを複製して使う
+        prepare_script_dir(tag_analysis.get_script_dir(), output_dir)
+        os.environ["SCRIPT_DIR"] = output_dir
+        tag_analysis.get_template_bank()
+        tag_analysis.get_tag_frequencies()
+        if "eigen" in modes:
+            tag_analysis.get_eigen_classifier()
+
+        for mode in modes:
+            if corpus:
+                case = benchmark_corpus_case(timer, mode, corpus, args.corpus, args.runs, args.warmup)
+                results.append(case)
+                total = case["stages_ms"]["total"]
+                print(f"⏱️ {mode:<12} {'実画像':>9} ({case['images']} 枚)               "
+                      f"p50 {total['p50']:8.1f}ms  p95 {total['p95']:8.1f}ms  正解率 {case['accuracy']:.2f}")
+            for resolution in resolutions:
+                for dpi in dpi_scales:
+                    case = benchmark_case(timer, mode, resolution, dpi, args.runs, args.warmup)
+                    results.append(case)
+                    total = case["stages_ms"]["total"]
+                    print(f"⏱️ {mode:<12} {case['size']:>9} (DPI {dpi:.2f}, {case['size_status']:<6}) "
+                          f"p50 {total['p50']:8.1f}ms  p95 {total['p95']:8.1f}ms  正解率 {case['accuracy']:.2f}")
+
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": get_git_commit(),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "cpu_count": os.cpu_count(),
+        "settings": {
+            "runs": args.runs,
+            "warmup": args.warmup,
+            "use_parallel_matching": tag_analysis.USE_PARALLEL_MATCHING,
+            "use_early_exit": tag_analysis.USE_EARLY_EXIT,
+            "use_scale_registration": tag_analysis.USE_SCALE_REGISTRATION,
+            "high_quality_backend": tag_analysis.HIGH_QUALITY_BACKEND,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, ensure_ascii=False, indent=2)
+    print(f"✅ ベンチマーク結果を保存しました: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
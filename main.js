@@ -128,37 +128,23 @@ app.on('activate', () => {
   }
 });
 
-ipcMain.on('capture-screen', (event) => {
-  writeLog('capture-screen event received');
-  
+// Python 実行環境（実行ファイル・環境変数・スクリプトのパス）を取得
+function getPythonLaunchConfig() {
   // ビルドされたアプリでの正しいパスを取得
   let pythonScriptPath;
   let tagImgPath;
+  let reportPath;
   
   if (app.isPackaged) {
     // ビルドされたアプリの場合
     pythonScriptPath = path.join(process.resourcesPath, 'app.asar.unpacked', 'tag_analysis.py');
     tagImgPath = path.join(process.resourcesPath, 'app.asar.unpacked', 'tag_img');
+    reportPath = path.join(process.resourcesPath, 'app.asar.unpacked', 'report.txt');
   } else {
     // 開発モードの場合
     pythonScriptPath = path.join(__dirname, 'tag_analysis.py');
     tagImgPath = path.join(__dirname, 'tag_img');
-  }
-  
-  writeLog(`Python script path: ${pythonScriptPath}`);
-  writeLog(`Tag img path: ${tagImgPath}`);
-  
-  // ファイルの存在確認
-  if (!require('fs').existsSync(pythonScriptPath)) {
-    writeLog(`Python script not found: ${pythonScriptPath}`, 'ERROR');
-    event.reply('capture-error', 'Pythonスクリプトが見つかりません');
-    return;
-  }
-  
-  if (!require('fs').existsSync(tagImgPath)) {
-    writeLog(`Tag img folder not found: ${tagImgPath}`, 'ERROR');
-    event.reply('capture-error', 'タグ画像フォルダが見つかりません');
-    return;
+    reportPath = path.join(__dirname, 'report.txt');
   }
   
   // 埋め込みPython環境を使用してPythonを実行
@@ -211,7 +197,232 @@ ipcMain.on('capture-screen', (event) => {
     };
   }
   
-  writeLog(`Using Python executable: ${pythonExecutable}`);
+  return { pythonExecutable, pythonEnv, pythonScriptPath, tagImgPath, reportPath };
+}
+
+// 常駐解析ワーカー（tag_analysis.py --worker と JSON Lines でやり取りする）
+const WORKER_REQUEST_TIMEOUT_MS = 120000;
+const WORKER_SHUTDOWN_GRACE_MS = 3000;  // shutdown を送ってから終了しない場合に強制終了するまでの猶予
+let analysisWorker = null;
+
+function startAnalysisWorker(config) {
+  writeLog(`解析ワーカーを起動: ${config.pythonExecutable} ${config.pythonScriptPath} --worker`);
+  
+  const workerProcess = spawn(config.pythonExecutable, [config.pythonScriptPath, '--worker'], {
+      cwd: path.dirname(config.pythonScriptPath),
+      stdio: ['pipe', 'pipe', 'pipe'],
+      env: config.pythonEnv
+  });
+  
+  const worker = {
+    process: workerProcess,
+    pending: new Map(),
+    nextId: 1,
+    buffer: ''
+  };
+  worker.ready = new Promise((resolve, reject) => {
+    worker.resolveReady = resolve;
+    worker.rejectReady = reject;
+  });
+  worker.ready.catch(() => {});
+  
+  workerProcess.stdout.setEncoding('utf-8');
+  workerProcess.stderr.setEncoding('utf-8');
+  
+  // 標準出力は1行1件の応答
+  workerProcess.stdout.on('data', (data) => {
+    worker.buffer += data;
+    let newlineIndex;
+    while ((newlineIndex = worker.buffer.indexOf('\n')) >= 0) {
+      const line = worker.buffer.slice(0, newlineIndex).trim();
+      worker.buffer = worker.buffer.slice(newlineIndex + 1);
+      if (!line) {
+        continue;
+      }
+      let message;
+      try {
+        message = JSON.parse(line);
+      } catch (error) {
+        writeLog(`解析ワーカーの応答を解析できません: ${line}`, 'ERROR');
+        continue;
+      }
+      if (message.type === 'ready') {
+        writeLog(`解析ワーカー準備完了: pid=${message.pid}, mode=${message.mode}, templates=${message.templates}`);
+        worker.resolveReady(message);
+        continue;
+      }
+      const request = worker.pending.get(message.id);
+      if (request) {
+        worker.pending.delete(message.id);
+        clearTimeout(request.timer);
+        if (message.ok) {
+          request.resolve(message);
+        } else {
+          // ワーカーは正常で、解析側のエラー（キャプチャ失敗など）
+          const error = new Error(message.error);
+          error.analysisError = true;
+          request.reject(error);
+        }
+      }
+    }
+  });
+  
+  // 標準エラーはログ出力
+  workerProcess.stderr.on('data', (data) => {
+    writeLog(`Python worker: ${data.toString()}`);
+  });
+  
+  // 終了済みのワーカーへの書き込みエラーは close / error で処理する
+  workerProcess.stdin.on('error', (error) => {
+    writeLog(`解析ワーカーへの書き込みエラー: ${error.message}`, 'ERROR');
+  });
+  
+  const failWorker = (error) => {
+    if (analysisWorker === worker) {
+      analysisWorker = null;
+    }
+    worker.rejectReady(error);
+    for (const request of worker.pending.values()) {
+      clearTimeout(request.timer);
+      request.reject(error);
+    }
+    worker.pending.clear();
+  };
+  
+  workerProcess.on('close', (code) => {
+    writeLog(`解析ワーカーが終了しました (code ${code})`);
+    failWorker(new Error(`解析ワーカーが終了しました (code ${code})`));
+  });
+  
+  workerProcess.on('error', (error) => {
+    writeLog(`解析ワーカーのエラー: ${error.message}`, 'ERROR');
+    failWorker(error);
+  });
+  
+  return worker;
+}
+
+function getAnalysisWorker(config) {
+  if (!analysisWorker) {
+    analysisWorker = startAnalysisWorker(config);
+  }
+  return analysisWorker;
+}
+
+// 解析ワーカーに要求を送り、応答を待つ（起動待ちも含めて timeoutMs で打ち切る）
+function sendWorkerRequest(worker, request, timeoutMs = WORKER_REQUEST_TIMEOUT_MS) {
+  return new Promise((resolve, reject) => {
+    const id = worker.nextId++;
+    const timer = setTimeout(() => {
+      worker.pending.delete(id);
+      reject(new Error('解析ワーカーが応答しません'));
+    }, timeoutMs);
+    worker.pending.set(id, { resolve, reject, timer });
+    // 起動に失敗した場合は failWorker が保留中の要求をまとめて reject する
+    worker.ready.then(() => {
+      if (worker.pending.has(id)) {
+        worker.process.stdin.write(JSON.stringify({ ...request, id }) + '\n');
+      }
+    }, () => {});
+  });
+}
+
+// 解析ワーカーを停止（force の場合は応答を待たずに終了させる）
+// 解析中に止まったワーカーは現在の解析が終わるまで shutdown を読まないため、
+// 単発実行に切り替える前に強制終了し、後から report.* を上書きされないようにする
+function stopAnalysisWorker(force = false) {
+  if (!analysisWorker) {
+    return;
+  }
+  const worker = analysisWorker;
+  analysisWorker = null;
+  if (force) {
+    worker.process.kill();
+    return;
+  }
+  try {
+    worker.process.stdin.write(JSON.stringify({ type: 'shutdown', id: 0 }) + '\n');
+    worker.process.stdin.end();
+  } catch (error) {
+    worker.process.kill();
+    return;
+  }
+  const killTimer = setTimeout(() => worker.process.kill(), WORKER_SHUTDOWN_GRACE_MS);
+  worker.process.once('close', () => clearTimeout(killTimer));
+}
+
+app.on('will-quit', () => stopAnalysisWorker());
+
+// 起動時にワーカーを立ち上げておき、最初のキャプチャから待ち時間をなくす
+app.on('ready', () => {
+  try {
+    const worker = getAnalysisWorker(getPythonLaunchConfig());
+    sendWorkerRequest(worker, { type: 'ping' })
+      .then((pong) => writeLog(`解析ワーカー応答: pid=${pong.pid}, uptime=${pong.uptime}秒`))
+      .catch((error) => writeLog(`解析ワーカーの起動確認に失敗しました: ${error.message}`, 'ERROR'));
+  } catch (error) {
+    writeLog(`解析ワーカーの起動に失敗しました: ${error.message}`, 'ERROR');
+  }
+});
+
+// キャプチャ要求の処理（常駐ワーカーを優先し、失敗した場合は従来通り1回ごとにプロセスを起動）
+ipcMain.on('capture-screen', async (event) => {
+  writeLog('capture-screen event received');
+  
+  const config = getPythonLaunchConfig();
+  const { pythonScriptPath, tagImgPath } = config;
+  
+  writeLog(`Python script path: ${pythonScriptPath}`);
+  writeLog(`Tag img path: ${tagImgPath}`);
+  
+  // ファイルの存在確認
+  if (!require('fs').existsSync(pythonScriptPath)) {
+    writeLog(`Python script not found: ${pythonScriptPath}`, 'ERROR');
+    event.reply('capture-error', 'Pythonスクリプトが見つかりません');
+    return;
+  }
+  
+  if (!require('fs').existsSync(tagImgPath)) {
+    writeLog(`Tag img folder not found: ${tagImgPath}`, 'ERROR');
+    event.reply('capture-error', 'タグ画像フォルダが見つかりません');
+    return;
+  }
+  
+  writeLog(`Using Python executable: ${config.pythonExecutable}`);
+  
+  try {
+    const worker = getAnalysisWorker(config);
+    const response = await sendWorkerRequest(worker, { type: 'analyze' });
+    writeLog(`解析ワーカーの結果: tags=${response.tags.join(',')}, ${response.elapsed}秒`);
+    replyCaptureSuccess(event, config.reportPath);
+  } catch (error) {
+    if (error.analysisError) {
+      writeLog(`解析ワーカーでの解析エラー: ${error.message}`, 'ERROR');
+      event.reply('capture-error', `解析エラー: ${error.message}`);
+      return;
+    }
+    writeLog(`解析ワーカーが利用できないため、単発実行に切り替えます: ${error.message}`, 'ERROR');
+    stopAnalysisWorker(true);
+    runOneShotAnalysis(event, config);
+  }
+});
+
+// レポートファイルを確認して成功を通知
+function replyCaptureSuccess(event, reportPath) {
+  writeLog(`Report file path for renderer: ${reportPath}`);
+  
+  // レポートファイルの存在確認
+  if (require('fs').existsSync(reportPath)) {
+    event.reply('capture-success', 'キャプチャが成功しました', reportPath);
+  } else {
+    writeLog(`Report file not found after capture: ${reportPath}`, 'ERROR');
+    event.reply('capture-success', 'キャプチャが成功しましたが、レポートファイルが見つかりません');
+  }
+}
+
+// 従来の単発実行（キャプチャごとに Python プロセスを起動）
+function runOneShotAnalysis(event, config) {
+  const { pythonExecutable, pythonEnv, pythonScriptPath } = config;
   
   const pythonProcess = spawn(pythonExecutable, [pythonScriptPath], {
       cwd: path.dirname(pythonScriptPath),
@@ -238,23 +449,7 @@ ipcMain.on('capture-screen', (event) => {
   pythonProcess.on('close', (code) => {
       writeLog(`Python process exited with code ${code}`);
       if (code === 0) {
-          // レポートファイルのパスを取得
-          let reportPath;
-          if (app.isPackaged) {
-              reportPath = path.join(process.resourcesPath, 'app.asar.unpacked', 'report.txt');
-          } else {
-              reportPath = path.join(__dirname, 'report.txt');
-          }
-          
-          writeLog(`Report file path for renderer: ${reportPath}`);
-          
-          // レポートファイルの存在確認
-          if (require('fs').existsSync(reportPath)) {
-              event.reply('capture-success', 'キャプチャが成功しました', reportPath);
-          } else {
-              writeLog(`Report file not found after capture: ${reportPath}`, 'ERROR');
-              event.reply('capture-success', 'キャプチャが成功しましたが、レポートファイルが見つかりません');
-          }
+          replyCaptureSuccess(event, config.reportPath);
       } else {
           event.reply('capture-error', `Pythonスクリプトがエラーコード ${code} で終了しました`);
       }
@@ -264,7 +459,7 @@ ipcMain.on('capture-screen', (event) => {
       writeLog(`Python process error: ${error.message}`, 'ERROR');
       event.reply('capture-error', `Pythonプロセスエラー: ${error.message}`);
   });
-});
+}
 
 // ログファイルをクリアするIPCハンドラー
 ipcMain.on('clear-logs', (event) => {
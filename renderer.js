@@ -11,6 +11,9 @@ console.log(jsonFilePath);
 // 選択されたタグの数を制限
 const MAX_SELECTED_TAGS = 5;
 
+// 読み込みに対応している report.json の形式バージョン（tag_analysis.py の RESULT_FORMAT_VERSION）
+const REPORT_FORMAT_VERSION = 1;
+
 // パフォーマンス最適化のための変数
 let selectedTagsCache = new Set();
 let resultsCache = new Map();
@@ -575,7 +578,24 @@ ipcRenderer.on('capture-success', (event, message, reportPathFromMain) => {
     }
     
     console.log('report.txt content:', data);
-    const lines = data.split('\n').map(line => line.trim()).filter(line => line);
+    let lines = data.split('\n').map(line => line.trim()).filter(line => line);
+    
+    // 構造化された解析結果（report.json）があれば、タグリストと照合済みのタグ名（matched_tags）を使う
+    // 形式のバージョンが異なる・想定した形でない場合は report.txt の内容を使う
+    const resultPath = path.join(path.dirname(reportPath), 'report.json');
+    try {
+      const result = JSON.parse(fs.readFileSync(resultPath, 'utf-8'));
+      if (result.version !== REPORT_FORMAT_VERSION) {
+        throw new Error(`unsupported report.json version: ${result.version}`);
+      }
+      if (!Array.isArray(result.matched_tags) || !result.matched_tags.every(tag => typeof tag === 'string')) {
+        throw new Error('report.json has no matched_tags list');
+      }
+      lines = result.matched_tags.map(tag => tag.trim()).filter(tag => tag);
+      console.log('report.json tags:', result.matched_tags, 'timings:', result.timings_ms);
+    } catch (error) {
+      console.log('report.json not available, using report.txt:', error.message);
+    }
     console.log('Parsed lines:', lines);
     
     // 既存の選択をクリア
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+照合パラメータのスイープ
+正解ラベル付きのスクリーンショット（または合成の募集画面）を、パラメータの組み合わせごとに解析し、
+適合率・再現率・処理時間と、精度と処理時間のパレート最適な組み合わせを JSON に書き出す
+
+使い方:
+    python sweep_tag_analysis.py --corpus screenshots/ --modes high_quality --output sweep_results.json
+    python sweep_tag_analysis.py --synthetic 5 --modes simple,high_quality --grid sweep_grid.json
+
+screenshots/labels.json には {"ファイル名": ["タグ", ...], ...} の形式で正解のタグを記述する。
+--grid の JSON は {"パラメータ名": [値, ...], ...} の形式（tag_analysis のモジュール定数名）。
+"""
+
+import argparse
+import datetime
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import tag_analysis
+from benchmark_tag_analysis import get_git_commit, load_corpus, parse_resolutions, prepare_script_dir
+
+# スイープの既定のグリッド
+DEFAULT_GRID = {
+    "USE_SCALE_REGISTRATION": [True, False],
+    "SCALE_RANGE": [
+        [0.4, 0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 1.0, 1.05, 1.1, 1.15, 1.2, 1.3, 1.4, 1.5, 1.6],
+        [0.6, 0.7, 0.8, 0.9, 1.0, 1.1, 1.2, 1.3, 1.4],
+        [0.8, 0.9, 1.0, 1.1, 1.2],
+    ],
+    "ROTATION_ANGLES": [
+        [-20, -15, -10, -5, 0, 5, 10, 15, 20],
+        [-10, -5, 0, 5, 10],
+        [0],
+    ],
+    "MATCHING_THRESHOLD": [0.2, 0.25, 0.3, 0.35, 0.4, 0.5],
+    "SMALL_WINDOW_THRESHOLD_FACTOR": [0.7, 0.85, 1.0],
+    "MEDIUM_WINDOW_THRESHOLD_FACTOR": [0.85, 1.0],
+}
+DEFAULT_SYNTHETIC_RESOLUTIONS = ((800, 450), (1280, 720), (1920, 1080))
+
+# 照合結果（スコア）に影響せず、タグの採否だけを決めるパラメータ
+# 1回の照合で記録したスコアに対して、値の組み合わせごとに採否を計算し直す
+DECISION_PARAMETERS = ("MATCHING_THRESHOLD", "SMALL_WINDOW_THRESHOLD_FACTOR", "MEDIUM_WINDOW_THRESHOLD_FACTOR")
+
+# 照合の途中で閾値を使うモード（cascade は高精度で照合し直す候補を閾値で選ぶため、閾値ごとに照合し直す）
+THRESHOLD_MATCHING_MODES = ("cascade",)
+
+# テンプレートのスケール・回転バリエーションを決めるパラメータ（変更時はテンプレートバンクを作り直す）
+TEMPLATE_VARIANT_PARAMETERS = ("SCALE_RANGE", "ROTATION_ANGLES")
+
+
+def is_relevant(parameter, config):
+    """パラメータがそのモード・設定の照合結果に影響するかどうか（影響しない組み合わせは重複として省く）"""
+    mode = config["MATCHING_MODE"]
+    if parameter == "ROTATION_ANGLES":
+        return mode in ("high_quality", "pyramid", "cascade")
+    if parameter == "SCALE_RANGE":
+        registration = config.get("USE_SCALE_REGISTRATION", tag_analysis.USE_SCALE_REGISTRATION)
+        return mode in ("high_quality", "pyramid", "cascade") and not registration
+    if parameter == "USE_SCALE_REGISTRATION":
+        return mode in ("high_quality", "pyramid", "cascade")
+    if parameter.startswith("CASCADE_"):
+        return mode == "cascade"
+    return True
+
+
+def decision_parameters(mode):
+    """記録したスコアから採否を計算し直せるパラメータ（照合の途中で閾値を使うモードにはない）"""
+    return () if mode in THRESHOLD_MATCHING_MODES else DECISION_PARAMETERS
+
+
+def matching_configs(grid, modes):
+    """照合に影響するパラメータの組み合わせ（モードに関係しないパラメータの違いは除く）"""
+    configs = []
+    seen = set()
+    for mode in modes:
+        names = [name for name in grid if name not in decision_parameters(mode)]
+        for values in itertools.product(*(grid[name] for name in names)):
+            config = {"MATCHING_MODE": mode}
+            config.update(zip(names, values))
+            config = {name: value for name, value in config.items() if is_relevant(name, config)}
+            key = json.dumps(config, sort_keys=True)
+            if key not in seen:
+                seen.add(key)
+                configs.append(config)
+    return configs
+
+
+def decision_configs(grid, mode):
+    names = [name for name in grid if name in decision_parameters(mode)]
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def apply_config(config, defaults):
+    """tag_analysis のモジュール定数を設定（指定のないものは既定値に戻す）"""
+    if any(getattr(tag_analysis, name) != config.get(name, defaults[name]) for name in TEMPLATE_VARIANT_PARAMETERS):
+        tag_analysis._template_bank = None
+    for name, default in defaults.items():
+        setattr(tag_analysis, name, config.get(name, default))
+
+
+def make_synthetic_corpus(count, resolutions):
+    """合成の募集画面（貼り付けたタグが正解ラベル）"""
+    corpus = []
+    for width, height in resolutions:
+        source = tag_analysis.SyntheticCaptureSource((width, height), seed=width * height)
+        for index in range(count):
+            corpus.append((f"synthetic_{width}x{height}_{index}", source.capture(), list(source.last_tags)))
+    return corpus
+
+
+# 閾値の再適用に使う元の割り当て関数（ScoreRecorder が tag_analysis 側を置き換える前に参照）
+assign_tags_to_slots = tag_analysis.assign_tags_to_slots
+
+
+class ScoreRecorder:
+    """analyze_image の照合スコアを記録する（タグ枠ごとのスコアは assign_tags_to_slots の引数から取得）"""
+
+    def __init__(self):
+        self.slot_inputs = None
+
+    def install(self):
+        recorder = self
+
+        def recording_assign_tags_to_slots(slots, slot_scores, threshold):
+            recorder.slot_inputs = (slots, [list(scores) for scores in slot_scores])
+            return assign_tags_to_slots(slots, slot_scores, threshold)
+
+        tag_analysis.assign_tags_to_slots = recording_assign_tags_to_slots
+
+
+def score_corpus(corpus, recorder, warmup_runs):
+    """全画像を閾値 0 で解析し、画像ごとの (処理時間, ウィンドウサイズ区分, タグ枠の入力, テンプレートのスコア) を返す
+
+    照合の途中で閾値を使うモードでは、設定した閾値のまま解析する（閾値は照合の組み合わせとして変える）。
+    """
+    if tag_analysis.MATCHING_MODE not in THRESHOLD_MATCHING_MODES:
+        tag_analysis.MATCHING_THRESHOLD = 0.0  # 全スコアを記録し、閾値は後から適用する
+    for _ in range(warmup_runs):
+        tag_analysis.screenshot = corpus[0][1]
+        tag_analysis.analyze_image()
+
+    records = []
+    for name, image, truth in corpus:
+        recorder.slot_inputs = None
+        tag_analysis.screenshot = image
+        started = time.perf_counter()
+        tag_analysis.analyze_image()
+        elapsed = time.perf_counter() - started
+        size_status = tag_analysis.check_window_size(image)[1]
+        records.append({
+            "elapsed": elapsed,
+            "size_status": size_status,
+            "slot_inputs": recorder.slot_inputs,
+            "template_scores": list(tag_analysis.last_template_scores),
+        })
+    return records
+
+
+def predict_tags(record, decision, defaults):
+    """記録したスコアに閾値を適用し、analyze_image と同じ規則で認識タグを決める"""
+    threshold = decision.get("MATCHING_THRESHOLD", defaults["MATCHING_THRESHOLD"])
+    if record["size_status"] == "small":
+        threshold *= decision.get("SMALL_WINDOW_THRESHOLD_FACTOR", defaults["SMALL_WINDOW_THRESHOLD_FACTOR"])
+    elif record["size_status"] == "medium":
+        threshold *= decision.get("MEDIUM_WINDOW_THRESHOLD_FACTOR", defaults["MEDIUM_WINDOW_THRESHOLD_FACTOR"])
+
+    if record["slot_inputs"] is not None:
+        slots, slot_scores = record["slot_inputs"]
+        return [match["tag"] for match in assign_tags_to_slots(slots, slot_scores, threshold) if match["tag"]]
+    return [tag_name for tag_name, score in record["template_scores"] if score > threshold][:tag_analysis.TAG_SLOT_COUNT]
+
+
+def evaluate(corpus, records, decision, defaults):
+    """適合率・再現率・F値"""
+    true_positives = false_positives = false_negatives = 0
+    for (_, _, truth), record in zip(corpus, records):
+        predicted = set(predict_tags(record, decision, defaults))
+        true_positives += len(predicted & set(truth))
+        false_positives += len(predicted - set(truth))
+        false_negatives += len(set(truth) - predicted)
+    precision = true_positives / (true_positives + false_positives) if true_positives + false_positives else 0.0
+    recall = true_positives / (true_positives + false_negatives) if true_positives + false_negatives else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        "precision": round(precision, 4),
+        "recall": round(recall, 4),
+        "f1": round(f1, 4),
+        "true_positives": true_positives,
+        "false_positives": false_positives,
+        "false_negatives": false_negatives,
+    }
+
+
+def mark_pareto(results):
+    """処理時間（平均）が短く F 値が高い組み合わせのうち、他に支配されないものに pareto=True を付ける"""
+    for result in results:
+        result["pareto"] = not any(
+            other["mean_ms"] <= result["mean_ms"] and other["f1"] >= result["f1"] and
+            (other["mean_ms"] < result["mean_ms"] or other["f1"] > result["f1"])
+            for other in results
+        )
+
+
+def main():
+    """メイン処理"""
+    parser = argparse.ArgumentParser(description="照合パラメータの精度・処理時間スイープ")
+    parser.add_argument("--corpus", help="正解ラベル（labels.json）付きのスクリーンショットのディレクトリ")
+    parser.add_argument("--labels", help="正解ラベルの JSON（省略時は <corpus>/labels.json）")
+    parser.add_argument("--synthetic", type=int, default=0, help="コーパスの代わりに解像度ごとに生成する合成画面の数")
+    parser.add_argument("--resolutions", default=",".join(f"{w}x{h}" for w, h in DEFAULT_SYNTHETIC_RESOLUTIONS),
+                        help="合成画面の解像度（例: 800x450,1280x720）")
+    parser.add_argument("--modes", default="high_quality", help="マッチングモード（カンマ区切り）")
+    parser.add_argument("--grid", help="パラメータのグリッドの JSON（省略時は既定のグリッド）")
+    parser.add_argument("--warmup", type=int, default=1, help="組み合わせごとに計測前に捨てる実行回数")
+    parser.add_argument("--output", default="sweep_results.json", help="結果の JSON ファイル")
+    args = parser.parse_args()
+
+    if not args.corpus and not args.synthetic:
+        parser.error("--corpus または --synthetic を指定してください")
+
+    grid = DEFAULT_GRID
+    if args.grid:
+        with open(args.grid, "r", encoding="utf-8") as grid_file:
+            grid = json.load(grid_file)
+    unknown = [name for name in grid if not hasattr(tag_analysis, name)]
+    if unknown:
+        parser.error(f"tag_analysis に存在しないパラメータ: {', '.join(unknown)}")
+    modes = args.modes.split(",")
+
+    tag_analysis.configure_console_encoding()
+    tag_analysis.configure_logging("ERROR")  # 解析中のログは出力しない
+    parameters = set(grid) | set(DECISION_PARAMETERS) | set(TEMPLATE_VARIANT_PARAMETERS) | {"MATCHING_MODE"}
+    defaults = {name: getattr(tag_analysis, name) for name in parameters}
+    tag_analysis.USE_CALIBRATION_CACHE = False  # 前の組み合わせの結果で探索順序が変わらないようにする
+
+    recorder = ScoreRecorder()
+    recorder.install()
+
+    results = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        # report.txt などの書き出しで実際の SCRIPT_DIR を書き換えないよう、入力ファイルを複製して使う
+        prepare_script_dir(tag_analysis.get_script_dir(), output_dir)
+        os.environ["SCRIPT_DIR"] = output_dir
+        if args.corpus:
+            corpus = load_corpus(args.corpus, args.labels)
+        else:
+            corpus = make_synthetic_corpus(args.synthetic, parse_resolutions(args.resolutions))
+        print(f"📁 コーパス: {len(corpus)} 枚")
+
+        configs = matching_configs(grid, modes)
+        print(f"🔍 照合の組み合わせ: {len(configs)} 通り × 閾値の組み合わせ: " +
+              ", ".join(f"{mode} {len(decision_configs(grid, mode))} 通り" for mode in modes))
+        for index, config in enumerate(configs):
+            apply_config(config, defaults)
+            records = score_corpus(corpus, recorder, args.warmup)
+            elapsed = np.array([record["elapsed"] for record in records]) * 1000
+            decisions = decision_configs(grid, config["MATCHING_MODE"])
+            for decision in decisions:
+                result = {"config": dict(config, **decision)}
+                result.update(evaluate(corpus, records, result["config"], defaults))
+                result["mean_ms"] = round(float(elapsed.mean()), 3)
+                result["p95_ms"] = round(float(np.percentile(elapsed, 95)), 3)
+                results.append(result)
+            best = max(results[-len(decisions):], key=lambda result: result["f1"])
+            print(f"⏱️ ({index + 1}/{len(configs)}) {json.dumps(config, ensure_ascii=False)}: "
+                  f"平均 {best['mean_ms']:.1f}ms, 最高 F値 {best['f1']:.3f}")
+
+    mark_pareto(results)
+    pareto = sorted((result for result in results if result["pareto"]), key=lambda result: result["mean_ms"])
+    print("🏆 パレート最適な組み合わせ（処理時間 × F値）:")
+    for result in pareto:
+        print(f"  {result['mean_ms']:8.1f}ms  F値 {result['f1']:.3f} (適合率 {result['precision']:.3f}, "
+              f"再現率 {result['recall']:.3f})  {json.dumps(result['config'], ensure_ascii=False)}")
+
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": get_git_commit(),
+        "corpus": args.corpus or f"synthetic:{args.synthetic}x{args.resolutions}",
+        "images": len(corpus),
+        "grid": grid,
+        "modes": modes,
+        "results": results,
+        "pareto": pareto,
+    }
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, ensure_ascii=False, indent=2)
+    print(f"✅ スイープ結果を保存しました: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
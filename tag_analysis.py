@@ -4,22 +4,78 @@ Arknights リクルートタグ解析ツール
 テンプレートマッチングによる画像検索
 """
 
+import time
+_IMPORT_STARTED = time.perf_counter()  # モジュール読み込み時間の計測開始
+
 import cv2
 import numpy as np
-from PIL import Image, ImageGrab, ImageEnhance
 import datetime
 import os
 import sys
+import hashlib
+import json
+import atexit
+import functools
 import threading
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import time
+import logging
+
+# キャプチャ（PIL.ImageGrab）・並列処理（concurrent.futures / multiprocessing）は
+# 使用する関数の中で読み込む（解析だけの起動やワーカープロセスの起動を速くするため）
+
+# ログの設定（テンプレートごとの詳細は DEBUG、通常の実行では INFO 以上のみ出力）
+logger = logging.getLogger("tag_analysis")
+LOG_LEVEL = os.environ.get("TAG_ANALYSIS_LOG_LEVEL", "INFO")  # ログレベル（--log-level でも指定可能）
+LOG_FORMAT = "[%(levelname)s] %(message)s"
+_log_listener = None
+
+def configure_logging(level=None, stream=None):
+    """ログを stream（既定は標準出力）に出力するように設定
 
-# 文字エンコーディングを明示的に設定
-import locale
-import codecs
+    書き込みは QueueListener のスレッドで行い、解析中のスレッドをパイプへの書き込みで待たせない。
+    未出力のログは終了時にまとめて書き出す。
+    """
+    import logging.handlers
+    import queue
+    global _log_listener
+    
+    if _log_listener is not None:
+        _log_listener.stop()
+    else:
+        atexit.register(stop_logging)
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    log_queue = queue.SimpleQueue()
+    _log_listener = logging.handlers.QueueListener(log_queue, handler)
+    _log_listener.start()
+    logger.handlers = [logging.handlers.QueueHandler(log_queue)]
+    logger.setLevel((level or LOG_LEVEL).upper())
+    logger.propagate = False
+
+def stop_logging():
+    """キューに残っているログを書き出して出力スレッドを止める"""
+    global _log_listener
+    if _log_listener is not None:
+        _log_listener.stop()
+        _log_listener = None
 
-# Windows環境での文字エンコーディング問題を解決
-if sys.platform.startswith('win'):
+def configure_worker_process_logging(level="WARNING"):
+    """プールのワーカープロセスでは標準エラーに直接出力する（親から引き継いだキューは使わない）"""
+    global _log_listener
+    _log_listener = None
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    logger.handlers = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+
+# Windows環境での文字エンコーディング問題を解決（スクリプトとして実行した場合のみ）
+def configure_console_encoding():
+    """標準出力・標準エラーとロケールを UTF-8 に設定（Windows のみ）"""
+    if not sys.platform.startswith('win'):
+        return
+    
+    import locale
+    
     # 標準出力と標準エラーのエンコーディングをUTF-8に設定
     if hasattr(sys.stdout, 'reconfigure'):
         sys.stdout.reconfigure(encoding='utf-8')
@@ -46,19 +102,310 @@ tags = ["先鋒タイプ", "前衛タイプ", "狙撃タイプ", "重装タイ
 
 # グローバル変数
 screenshot = None
+last_skipped_templates = 0  # 直近の解析で早期終了により省略したテンプレート数
 
-# 高頻度タグの優先順位（実際の使用頻度に基づいて調整）
-HIGH_PRIORITY_TAGS = [
-    "前衛タイプ", "狙撃タイプ", "重装タイプ", "医療タイプ", "術師タイプ",
-    "火力", "防御", "生存", "COST回復", "範囲攻撃"
-]
+# 計測の設定（解析ごとの処理時間の内訳とカウンタを記録する）
+USE_INSTRUMENTATION = os.environ.get("TAG_ANALYSIS_TRACE") == "1"  # 環境変数 TAG_ANALYSIS_TRACE=1 または --trace で有効
+INSTRUMENTATION_FILE = "tag_timings.jsonl"  # 記録先（SCRIPT_DIR からの相対パス、1解析1行の JSON）
+
+class AnalysisTrace:
+    """1回の解析（キャプチャ〜結果の保存）の入れ子のスパンとカウンタ
+
+    スパンはスレッドごとのスタックで入れ子にする。スレッドプールのワーカーで開始したスパンは、
+    解析を開始したスレッドで実行中のスパン（match_templates など）の子として記録する。
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.started = time.perf_counter()
+        self.timestamp = datetime.datetime.now().isoformat(timespec="milliseconds")
+        self.spans = []
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.main_stack = self.local.stack = []
+        self.record = None
+
+    def open_span(self, name, attributes):
+        span = {"name": name, "start_ms": round((time.perf_counter() - self.started) * 1000, 3)}
+        span.update(attributes)
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        if stack:
+            stack[-1].setdefault("children", []).append(span)
+        else:
+            with self.lock:
+                parent = self.main_stack[-1].setdefault("children", []) if self.main_stack else self.spans
+                parent.append(span)
+        stack.append(span)
+        return span
+
+    def close_span(self, span, started):
+        span["ms"] = round((time.perf_counter() - started) * 1000, 3)
+        self.local.stack.pop()
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def finish(self):
+        """記録（JSON に変換できる辞書）を作成"""
+        self.record = {
+            "timestamp": self.timestamp,
+            "source": self.source,
+            "mode": MATCHING_MODE,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "counters": self.counters,
+            "spans": self.spans
+        }
+        return self.record
+
+class _TraceSpan:
+    def __init__(self, trace, name, attributes):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.span = self.trace.open_span(self.name, self.attributes)
+        self.started = time.perf_counter()
+        return self.span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.trace.close_span(self.span, self.started)
+        return False
+
+class _NullSpan:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NULL_SPAN = _NullSpan()
+_active_trace = None  # 計測中の解析（計測が無効・解析外の場合は None）
+
+def span(name, **attributes):
+    """処理時間のスパン（計測していない場合は何もしない共有オブジェクトを返す）"""
+    trace = _active_trace
+    if trace is None:
+        return _NULL_SPAN
+    return _TraceSpan(trace, name, attributes)
+
+def traced(function=None, tag_argument=None):
+    """関数の呼び出しをスパンとして記録するデコレータ（tag_argument 番目の引数をタグ名として記録）"""
+    def decorate(function):
+        name = function.__qualname__
+        
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            trace = _active_trace
+            if trace is None:
+                return function(*args, **kwargs)
+            attributes = {"tag": args[tag_argument]} if tag_argument is not None and len(args) > tag_argument else {}
+            with _TraceSpan(trace, name, attributes):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate if function is None else decorate(function)
+
+def count(name, amount=1):
+    """カウンタを加算（計測していない場合は何もしない）"""
+    trace = _active_trace
+    if trace is not None:
+        trace.count(name, amount)
+
+def match_template(image, template, method):
+    """cv2.matchTemplate の呼び出し回数と処理画素数（照合位置数 × テンプレート画素数）を数える"""
+    result = cv2.matchTemplate(image, template, method)
+    trace = _active_trace
+    if trace is not None:
+        trace.count("match_template_calls")
+        trace.count("match_template_pixels", result.size * template.shape[0] * template.shape[1])
+    return result
+
+class _AnalysisTraceScope:
+    def __init__(self, source, write=True):
+        self.source = source
+        self.write = write
+        self.trace = None
+
+    def discard(self):
+        """記録を書き出さない"""
+        self.write = False
+
+    def __enter__(self):
+        global _active_trace
+        if USE_INSTRUMENTATION and _active_trace is None:
+            self.trace = _active_trace = AnalysisTrace(self.source)
+        return self.trace
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _active_trace
+        if self.trace is None:
+            return False
+        _active_trace = None
+        record = self.trace.finish()
+        if self.write:
+            try:
+                with open(os.path.join(get_script_dir(), INSTRUMENTATION_FILE), "a", encoding="utf-8") as trace_file:
+                    trace_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            except Exception as e:
+                logger.warning("⚠️ 計測結果の書き込みに失敗しました: %s", e)
+        return False
+
+def analysis_trace(source, write=True):
+    """1回の解析を計測するコンテキスト（計測が無効な場合・計測中の場合は None を返すだけ）
+
+    終了時に記録を trace.record に格納し、write=True の場合は INSTRUMENTATION_FILE に1行追記する。
+    """
+    return _AnalysisTraceScope(source, write)
+
+# タグの出現頻度（照合順序の決定に使用）
+TAG_FREQUENCY_FILE = "ark_output.json"  # オペレーター一覧（SCRIPT_DIR からの相対パス）
+_tag_frequencies = None
+
+def get_tag_frequencies():
+    """ark_output.json のオペレーター一覧から各タグの出現回数を数える（一度だけ読み込み）"""
+    global _tag_frequencies
+    if _tag_frequencies is None:
+        _tag_frequencies = {}
+        try:
+            with open(os.path.join(get_script_dir(), TAG_FREQUENCY_FILE), "r", encoding="utf-8") as operator_file:
+                operators = json.load(operator_file)
+            for operator in operators:
+                for tag in operator.get("tag", []):
+                    if tag in tags:
+                        _tag_frequencies[tag] = _tag_frequencies.get(tag, 0) + 1
+        except Exception as e:
+            logger.warning("⚠️ タグの出現頻度を読み込めませんでした（タグリストの順序を使用）: %s", e)
+    return _tag_frequencies
+
+def order_templates_by_frequency(template_files):
+    """出現頻度の高いタグから照合するように並べ替える（同数・不明はタグリストの順序）"""
+    frequencies = get_tag_frequencies()
+    def priority(template):
+        tag_name = template[1]
+        return (-frequencies.get(tag_name, 0), tags.index(tag_name) if tag_name in tags else len(tags))
+    return sorted(template_files, key=priority)
 
-# 募集条件部分を切り抜き (3段中2段目を切り抜く)
-def crop_recruitment_area(image):
+# 募集条件の領域（ROI）の設定
+RECRUITMENT_ROI = (0.0, 0.3, 1.0, 0.75)  # (左, 上, 右, 下) をウィンドウの幅・高さに対する比率で指定（タグ枠の2行を含む中段、--roi で変更可能）
+
+# 募集条件部分を切り抜き
+def crop_recruitment_area(image, roi=None):
+    """正規化座標の ROI を切り抜く（NumPyのビューと切り抜き位置を返す）"""
+    height, width = image.shape[:2]
+    left, top, right, bottom = roi or RECRUITMENT_ROI
+    x0, y0 = int(width * left), int(height * top)
+    x1, y1 = max(x0 + 1, int(width * right)), max(y0 + 1, int(height * bottom))
+    return image[y0:y1, x0:x1], (x0, y0)
+
+# タグ枠検出の設定
+USE_SLOT_DETECTION = True  # 募集条件のタグ枠を検出し、枠内の小さな切り抜きだけを照合する
+TAG_SLOT_COUNT = 5  # 募集画面に表示されるタグ数
+SLOT_DARK_LEVEL = 80  # タグボタン（暗色）とみなす輝度の上限
+SLOT_CROP_MARGIN = 0.15  # 枠を切り出すときの余白（枠の高さ比）
+
+# 最後の解析で認識したタグ枠（画面上の並び順）
+last_slot_matches = []
+last_template_scores = []  # 最後の解析で閾値を超えたテンプレートのスコア（高い順）
+
+# 募集条件のタグ枠検出
+@traced
+def detect_tag_slots(image):
+    """募集条件のタグ枠を画面上の並び順（左上から行ごと）で検出する
+
+    タグボタンは 3 列 × 2 行のグリッドに並び、最後の1枠は空欄になる。
+    ROI（RECRUITMENT_ROI）から暗色の横長ボタンを輪郭抽出し、3 個並んだ行を1行目として
+    グリッドを補完する（選択中で色が変わったボタンも位置から補える）。
+    戻り値は (x, y, w, h) のリスト。グリッドが見つからない場合は空リスト。
+    """
+    try:
+        height, width = image.shape[:2]
+        band, (band_left, band_top) = crop_recruitment_area(image)
+        if band.ndim == 3:
+            band = cv2.cvtColor(band, cv2.COLOR_BGR2GRAY)
+        
+        # 暗色のボタン領域を抽出（文字の隙間は閉じる）
+        mask = (band < SLOT_DARK_LEVEL).astype(np.uint8) * 255
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (9, 5)))
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        
+        boxes = []
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            # ボタンらしい大きさ・縦横比・充填率のものだけを残す
+            if h < height * 0.03 or h > height * 0.12:
+                continue
+            if not 2.0 <= w / h <= 5.0:
+                continue
+            if cv2.contourArea(contour) / (w * h) < 0.8:
+                continue
+            boxes.append((x + band_left, y + band_top, w, h))
+        
+        # 行ごとにまとめる
+        rows = []
+        for box in sorted(boxes, key=lambda b: b[1]):
+            if rows and abs(rows[-1][0][1] - box[1]) < box[3] / 2:
+                rows[-1].append(box)
+            else:
+                rows.append([box])
+        
+        # 3 個並んだ行をタグの1行目とする（時刻調整ボタンの行は 2 個）
+        first_rows = [row for row in rows if len(row) == 3]
+        if not first_rows:
+            return []
+        first_row = sorted(first_rows[-1], key=lambda b: b[0])
+        slot_w = int(np.median([b[2] for b in first_row]))
+        slot_h = int(np.median([b[3] for b in first_row]))
+        first_y = int(np.median([b[1] for b in first_row]))
+        
+        # 2行目は検出できればその位置、なければ行間の典型値から推定
+        second_y = int(first_y + slot_h * 1.55)
+        for row in rows:
+            if slot_h * 1.2 < row[0][1] - first_y < slot_h * 2.5:
+                second_y = int(np.median([b[1] for b in row]))
+                break
+        
+        slots = [(b[0], first_y, slot_w, slot_h) for b in first_row]
+        slots += [(b[0], second_y, slot_w, slot_h) for b in first_row]
+        slots = [slot for slot in slots if slot[1] + slot[3] <= height]
+        return slots[:TAG_SLOT_COUNT]
+        
+    except Exception as e:
+        logger.error("タグ枠検出でエラー: %s", e)
+        return []
+
+def crop_tag_slot(image, slot):
+    """タグ枠を余白付きで切り抜く（NumPyのビューと切り抜き位置を返す）"""
     height, width = image.shape[:2]
-    cropped_img = image[height // 3 : 2 * height // 3, :]  # 高さの2段目部分を切り抜く
-    cv2.imwrite("cropped_image.png", cropped_img)  # 一時ファイルとして保存
-    return cropped_img
+    x, y, w, h = slot
+    margin = int(h * SLOT_CROP_MARGIN)
+    x0, y0 = max(0, x - margin), max(0, y - margin)
+    return image[y0:min(height, y + h + margin), x0:min(width, x + w + margin)], (x0, y0)
+
+def assign_tags_to_slots(slots, slot_scores, threshold):
+    """各タグ枠にスコアの高い順でタグを割り当てる（同じタグは1枠のみ）
+
+    slot_scores は枠ごとの [(tag_name, score), ...]。戻り値は枠の並び順の
+    {"slot", "box", "tag", "score"} のリスト（閾値以下の枠は tag が None）。
+    """
+    candidates = []
+    for slot_index, scores in enumerate(slot_scores):
+        for tag_name, score in scores:
+            if score > threshold:
+                candidates.append((score, slot_index, tag_name))
+    candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+    
+    assignments = [{"slot": i, "box": tuple(int(v) for v in slot), "tag": None, "score": 0.0} for i, slot in enumerate(slots)]
+    used_tags = set()
+    for score, slot_index, tag_name in candidates:
+        if assignments[slot_index]["tag"] is None and tag_name not in used_tags:
+            assignments[slot_index]["tag"] = tag_name
+            assignments[slot_index]["score"] = float(score)
+            used_tags.add(tag_name)
+    return assignments
 
 # ウィンドウサイズチェック機能
 def check_window_size(image):
@@ -71,43 +418,47 @@ def check_window_size(image):
     RECOMMENDED_WIDTH = 1024
     RECOMMENDED_HEIGHT = 768
     
-    print(f"現在のウィンドウサイズ: {width}x{height}")
+    logger.debug("現在のウィンドウサイズ: %sx%s", width, height)
     
     if width < MIN_WIDTH or height < MIN_HEIGHT:
-        print(f"⚠️  警告: ウィンドウサイズが小さすぎます")
-        print(f"   現在: {width}x{height}")
-        print(f"   最小推奨: {MIN_WIDTH}x{MIN_HEIGHT}")
-        print(f"   推奨サイズ: {RECOMMENDED_WIDTH}x{RECOMMENDED_HEIGHT}")
-        print(f"   パターンマッチングの精度が低下する可能性があります")
+        logger.warning("⚠️  警告: ウィンドウサイズが小さすぎます")
+        logger.debug("   現在: %sx%s", width, height)
+        logger.debug("   最小推奨: %sx%s", MIN_WIDTH, MIN_HEIGHT)
+        logger.debug("   推奨サイズ: %sx%s", RECOMMENDED_WIDTH, RECOMMENDED_HEIGHT)
+        logger.debug("   パターンマッチングの精度が低下する可能性があります")
         return False, "small"
     elif width < RECOMMENDED_WIDTH or height < RECOMMENDED_HEIGHT:
-        print(f"📱 注意: ウィンドウサイズがやや小さいです")
-        print(f"   現在: {width}x{height}")
-        print(f"   推奨サイズ: {RECOMMENDED_WIDTH}x{RECOMMENDED_HEIGHT}")
-        print(f"   より良い結果を得るためにウィンドウサイズを大きくすることを推奨します")
+        logger.info("📱 注意: ウィンドウサイズがやや小さいです")
+        logger.debug("   現在: %sx%s", width, height)
+        logger.debug("   推奨サイズ: %sx%s", RECOMMENDED_WIDTH, RECOMMENDED_HEIGHT)
+        logger.debug("   より良い結果を得るためにウィンドウサイズを大きくすることを推奨します")
         return True, "medium"
     else:
-        print(f"✅ ウィンドウサイズは適切です: {width}x{height}")
+        logger.debug("✅ ウィンドウサイズは適切です: %sx%s", width, height)
         return True, "good"
     
     return True, "unknown"
 
 # 小さいウィンドウ用の画像前処理関数
-def preprocess_image_for_small_windows(image):
-    """小さいウィンドウでも認識できるように画像を前処理"""
+def preprocess_image_for_small_windows(image, window_shape=None):
+    """小さいウィンドウでも認識できるように画像を前処理
+
+    window_shape を渡した場合、拡大するかどうかは画像ではなくウィンドウの大きさで判定する（ROI・タグ枠の切り抜き用）。
+    """
     try:
         # 画像のサイズを確認
         height, width = image.shape[:2]
-        print(f"前処理前の画像サイズ: {width}x{height}")
+        window_height, window_width = (window_shape or image.shape)[:2]
+        logger.debug("前処理前の画像サイズ: %sx%s", width, height)
         
         # 小さいウィンドウの場合は拡大処理
-        if width < 800 or height < 600:
+        if window_width < 800 or window_height < 600:
             # 2倍に拡大（より詳細な特徴を保持）
             scale_factor = 2.0
             new_width = int(width * scale_factor)
             new_height = int(height * scale_factor)
             enlarged_image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_CUBIC)
-            print(f"小さいウィンドウを拡大: {width}x{height} -> {new_width}x{new_height}")
+            logger.debug("小さいウィンドウを拡大: %sx%s -> %sx%s", width, height, new_width, new_height)
             image = enlarged_image
         
         # ノイズ除去（小さいウィンドウでも鮮明に）
@@ -125,11 +476,11 @@ def preprocess_image_for_small_windows(image):
         kernel = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
         sharpened = cv2.filter2D(enhanced, -1, kernel)
         
-        print(f"前処理完了: 最終サイズ {sharpened.shape[1]}x{sharpened.shape[0]}")
+        logger.debug("前処理完了: 最終サイズ %sx%s", sharpened.shape[1], sharpened.shape[0])
         return sharpened
         
     except Exception as e:
-        print(f"画像前処理でエラー: {e}")
+        logger.error("画像前処理でエラー: %s", e)
         return image
 
 def preprocess_template_for_small_windows(template):
@@ -137,7 +488,7 @@ def preprocess_template_for_small_windows(template):
     try:
         # テンプレートのサイズを確認
         height, width = template.shape[:2]
-        print(f"テンプレート前処理前のサイズ: {width}x{height}")
+        logger.debug("テンプレート前処理前のサイズ: %dx%d", width, height)
         
         # 小さいテンプレートの場合は拡大処理
         if width < 50 or height < 50:
@@ -145,7 +496,7 @@ def preprocess_template_for_small_windows(template):
             new_width = int(width * scale_factor)
             new_height = int(height * scale_factor)
             enlarged_template = cv2.resize(template, (new_width, new_height), interpolation=cv2.INTER_CUBIC)
-            print(f"小さいテンプレートを拡大: {width}x{height} -> {new_width}x{new_height}")
+            logger.debug("小さいテンプレートを拡大: %dx%d -> %dx%d", width, height, new_width, new_height)
             template = enlarged_template
         
         # ノイズ除去
@@ -159,127 +510,1231 @@ def preprocess_template_for_small_windows(template):
         enhanced = cv2.merge([l, a, b])
         enhanced = cv2.cvtColor(enhanced, cv2.COLOR_LAB2BGR)
         
-        print(f"テンプレート前処理完了: 最終サイズ {enhanced.shape[1]}x{enhanced.shape[0]}")
+        logger.debug("テンプレート前処理完了: 最終サイズ %dx%d", enhanced.shape[1], enhanced.shape[0])
         return enhanced
         
     except Exception as e:
-        print(f"テンプレート前処理でエラー: {e}")
+        logger.error("テンプレート前処理でエラー: %s", e)
         return template
 
-# 解像度調整処理
-def adjust_resolution(image, target_dpi=300):
-    scale_factor = target_dpi / 96
-    width = int(image.shape[1] * scale_factor)
-    height = int(image.shape[0] * scale_factor)
-    return cv2.resize(image, (width, height))
-
 # マッチング設定（小さいウィンドウでも認識できるように調整）
 MATCHING_THRESHOLD = 0.3  # 0.5から0.3に下げて、より柔軟な認識を可能に
+SMALL_WINDOW_THRESHOLD_FACTOR = 0.7  # 小さいウィンドウでの閾値の倍率（0.3 * 0.7 = 0.21）
+MEDIUM_WINDOW_THRESHOLD_FACTOR = 0.85  # 中程度のウィンドウでの閾値の倍率（0.3 * 0.85 = 0.255）
 SCALE_RANGE = [0.4, 0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 1.0, 1.05, 1.1, 1.15, 1.2, 1.3, 1.4, 1.5, 1.6]  # より広いスケール範囲
 ROTATION_ANGLES = [-20, -15, -10, -5, 0, 5, 10, 15, 20]  # より広い回転角度
 
+# スケール登録の設定（SCALE_RANGE の総当たりの代わりに縮尺を1つに決める）
+USE_SCALE_REGISTRATION = True  # タグ枠（なければクライアント領域の高さ）からテンプレートの縮尺を求める
+TAG_TEXT_LEVEL = 128  # タグ文字（白）とみなす輝度の下限
+TEMPLATE_SLOT_HEIGHT = 64  # テンプレートを切り出した募集画面のタグ枠の高さ（px、縮尺 = タグ枠の高さ / この値）
+TEMPLATE_SLOT_HEIGHTS = {  # 別のウィンドウサイズの画面から切り出したテンプレートのタグ枠の高さ（tag_img の募集画面で計測）
+    "kousoku.png": 48,
+    "elite.png": 48,
+    "tokusyu.png": 48,
+    "chiryou.png": 51
+}
+SLOT_HEIGHT_RATIO = 0.075  # タグ枠の高さ / クライアント領域の高さ（タグ枠が見つからない場合に使用）
+REGISTRATION_SCALE_STEPS = (1.0, 0.93, 1.07)  # 登録スケールの誤差（約±8%）を吸収する倍率（先頭から順に評価）
+REGISTRATION_DECISIVE_SCORE = 0.9  # このスコアに達したら残りの回転・スケールを打ち切る
+REGISTRATION_EXPLORE_SCORE = 0.8  # スケールごとに 0 度のスコアがこれ未満なら、そのスケールの残りの回転は照合しない（正解タグは 0.84 以上）
+
+# 再計算できるファイルの保存先（get_cache_dir() を参照）
+CACHE_DIR_NAME = "arktools"  # ユーザーのキャッシュディレクトリ内の保存先
+
+# キャリブレーションの設定（ウィンドウサイズ・モードごとの最適スケール・回転を保存）
+USE_CALIBRATION_CACHE = True  # SCRIPT_DIR にキャリブレーション結果を保存し、次回はその近傍から照合する
+CALIBRATION_FILE = "tag_calibration.json"  # 保存先（SCRIPT_DIR からの相対パス）
+CALIBRATION_MAX_ENTRIES = 8  # 保持するウィンドウサイズ×モードの組の上限（古いものから削除）
+CALIBRATION_MIN_SCORE = 0.8  # このスコア以上の照合結果だけを最適スケール・回転として記録
+CALIBRATION_SCALE_TOLERANCE = 0.08  # 近傍とみなすスケールの相対差
+CALIBRATION_ANGLE_TOLERANCE = 5  # 近傍とみなす回転角度の差（度）
+CALIBRATION_HISTOGRAM_BINS = 20  # スコア分布のヒストグラムの区間数（0〜1 を等分）
+
+# 手動でファイル名とタグ名の対応を定義
+TEMPLATE_MAPPING = {
+    "zenei.png": "前衛タイプ",
+    "jyusou.png": "重装タイプ",
+    "hojyo.png": "補助タイプ",
+    "sogeki.png": "狙撃タイプ",
+    "senpou.png": "先鋒タイプ",
+    "iryo.png": "医療タイプ",
+    "jyutushi.png": "術師タイプ",
+    "enkyori.png": "遠距離",
+    "kinkyori.png": "近距離",
+    "cost.png": "COST回復",
+    "bougyo.png": "防御",
+    "shoki.png": "初期",
+    "karyoku.png": "火力",
+    "seizon.png": "生存",
+    "hani.png": "範囲攻撃",
+    "gensoku.png": "減速",
+    "kyousei.png": "強制移動",
+    "kensei.png": "牽制",
+    "shoukan.png": "召喚",
+    "kousoku.png": "高速再配置",
+    "robot.png": "ロボット",
+    "elite.png": "エリート",
+    "tokusyu.png": "特殊タイプ",
+    "chiryou.png": "治療",
+    "shien.png": "支援",
+    "bakuhatsu.png": "爆発力",
+    "jyakuka.png": "弱化"
+}
+
+# テンプレートファイルが見つからない場合のデフォルトリスト
+DEFAULT_TEMPLATE_FILES = [
+    ("tag_img/zenei.png", "前衛タイプ"),
+    ("tag_img/jyusou.png", "重装タイプ"),
+    ("tag_img/hojyo.png", "補助タイプ"),
+    ("tag_img/sogeki.png", "狙撃タイプ"),
+    ("tag_img/senpou.png", "先鋒タイプ"),
+    ("tag_img/iryo.png", "医療タイプ"),
+    ("tag_img/jyutushi.png", "術師タイプ"),
+    ("tag_img/enkyori.png", "遠距離"),
+    ("tag_img/kinkyori.png", "近距離"),
+    ("tag_img/cost.png", "COST回復"),
+    ("tag_img/bougyo.png", "防御"),
+    ("tag_img/shoki.png", "初期"),
+    ("tag_img/karyoku.png", "火力"),
+    ("tag_img/seizon.png", "生存"),
+    ("tag_img/hani.png", "範囲攻撃"),
+    ("tag_img/gensoku.png", "減速"),
+    ("tag_img/kyousei.png", "強制移動"),
+    ("tag_img/kensei.png", "牽制"),
+    ("tag_img/shoukan.png", "召喚"),
+    ("tag_img/kousoku.png", "高速再配置"),
+    ("tag_img/robot.png", "ロボット"),
+    ("tag_img/elite.png", "エリート"),
+    ("tag_img/tokusyu.png", "特殊タイプ")
+]
+
+def get_script_dir():
+    """スクリプトのディレクトリを取得（環境変数から優先）"""
+    script_dir = os.environ.get('SCRIPT_DIR')
+    if not script_dir:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+    return script_dir
+
+def get_cache_dir():
+    """再計算できるファイルの保存先を取得（環境変数 TAG_ANALYSIS_CACHE_DIR を優先、なければユーザーのキャッシュディレクトリ）"""
+    cache_dir = os.environ.get("TAG_ANALYSIS_CACHE_DIR")
+    if not cache_dir:
+        if sys.platform == "win32":
+            base_dir = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), "AppData", "Local")
+        elif sys.platform == "darwin":
+            base_dir = os.path.join(os.path.expanduser("~"), "Library", "Caches")
+        else:
+            base_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        cache_dir = os.path.join(base_dir, CACHE_DIR_NAME)
+    return cache_dir
+
+def _scaled_rotations(processed_template, scale):
+    """テンプレートを拡大縮小し、ROTATION_ANGLES の順に回転させたものを積み重ねた連続配列を返す
+
+    戻り値の形は (len(ROTATION_ANGLES), h, w, 3)。縮小しすぎる場合は None。
+    """
+    if scale != 1.0:
+        h, w = processed_template.shape[:2]
+        new_h, new_w = int(h * scale), int(w * scale)
+        if new_h > 0 and new_w > 0:
+            scaled_template = cv2.resize(processed_template, (new_w, new_h), interpolation=cv2.INTER_CUBIC)
+        else:
+            return None
+    else:
+        scaled_template = processed_template
+
+    rotated_templates = []
+    for angle in ROTATION_ANGLES:
+        if angle != 0:
+            M = cv2.getRotationMatrix2D((scaled_template.shape[1] / 2, scaled_template.shape[0] / 2), angle, 1)
+            rotated_templates.append(cv2.warpAffine(scaled_template, M, (scaled_template.shape[1], scaled_template.shape[0])))
+        else:
+            rotated_templates.append(scaled_template)
+
+    return np.ascontiguousarray(np.stack(rotated_templates))
+
+def registered_scales(scale):
+    """登録スケールとその近傍（REGISTRATION_SCALE_STEPS 倍）のスケール列"""
+    return [round(scale, 2) * step for step in REGISTRATION_SCALE_STEPS]
+
+# テンプレート1枚分のキャッシュ
+class TemplateEntry:
+    """読み込み済みテンプレートと、その前処理済みバリエーション"""
+
+    def __init__(self, path, tag_name, bgr, content_hash=None):
+        self.path = path
+        self.tag_name = tag_name
+        self.bgr = np.ascontiguousarray(bgr)
+        self.gray = np.ascontiguousarray(cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY))
+        self.content_hash = content_hash  # ファイルの内容の SHA-1（統計量の索引のキー）
+        self._stats = None
+        self._high_quality = None
+        self._variants = None
+        self._coarse_variants = {}
+        self._registered_variants = {}
+        self._registered_grays = {}
+
+    @property
+    def high_quality(self):
+        """小さいウィンドウ用に前処理したテンプレート（初回のみ計算）"""
+        if self._high_quality is None:
+            self._high_quality = np.ascontiguousarray(preprocess_template_for_small_windows(self.bgr))
+        return self._high_quality
+
+    def high_quality_variants(self):
+        """SCALE_RANGE × ROTATION_ANGLES のバリエーションを返す（初回のみ計算）
+
+        戻り値は (scale, rotated_templates) のリストで、rotated_templates は
+        ROTATION_ANGLES の順に回転テンプレートを積み重ねた連続配列
+        (len(ROTATION_ANGLES), h, w, 3)。
+        """
+        if self._variants is None:
+            variants = []
+            for scale in SCALE_RANGE:
+                rotated_templates = _scaled_rotations(self.high_quality, scale)
+                if rotated_templates is not None:
+                    variants.append((scale, rotated_templates))
+            self._variants = variants
+        return self._variants
+
+    def registered_variants(self, scale):
+        """登録スケール付近（REGISTRATION_SCALE_STEPS 倍）のバリエーション（スケールごとに一度だけ計算）"""
+        key = round(scale, 2)
+        variants = self._registered_variants.get(key)
+        if variants is None:
+            variants = []
+            for variant_scale in registered_scales(scale):
+                rotated_templates = _scaled_rotations(self.high_quality, variant_scale)
+                if rotated_templates is not None:
+                    variants.append((variant_scale, rotated_templates))
+            self._registered_variants[key] = variants
+        return variants
+
+    def registered_gray(self, scale):
+        """登録スケールに縮小・拡大したグレースケールのテンプレート（スケールごとに一度だけ計算）"""
+        key = round(scale, 2)
+        gray = self._registered_grays.get(key)
+        if gray is None:
+            width = max(1, int(round(self.gray.shape[1] * key)))
+            height = max(1, int(round(self.gray.shape[0] * key)))
+            interpolation = cv2.INTER_AREA if key < 1.0 else cv2.INTER_LINEAR
+            gray = np.ascontiguousarray(cv2.resize(self.gray, (width, height), interpolation=interpolation))
+            self._registered_grays[key] = gray
+        return gray
+
+    @property
+    def stats(self):
+        """アダプティブ閾値用のテンプレート品質指標（索引になければ初回のみ計算）"""
+        if self._stats is None:
+            self._stats = compute_template_stats(self.gray)
+        return self._stats
+
+    @property
+    def slot_height(self):
+        """テンプレートを切り出した画面のタグ枠の高さ（スケール登録の基準）"""
+        return TEMPLATE_SLOT_HEIGHTS.get(os.path.basename(self.path), TEMPLATE_SLOT_HEIGHT)
+
+    def coarse_rotations(self, scale, rotated_templates, level):
+        """スケール scale のバリエーション（回転テンプレートの配列）を 1/2**level に縮小したもの（スケール・段数ごとに一度だけ計算）"""
+        key = (round(scale, 4), level)
+        coarse = self._coarse_variants.get(key)
+        if coarse is None:
+            reduced = []
+            for rotated_template in rotated_templates:
+                for _ in range(level):
+                    rotated_template = cv2.pyrDown(rotated_template)
+                reduced.append(rotated_template)
+            coarse = np.ascontiguousarray(np.stack(reduced))
+            self._coarse_variants[key] = coarse
+        return coarse
+
+# テンプレートバンク（tag_img を一度だけデコードして保持）
+class TemplateBank:
+    """tag_img/*.png を一度だけ読み込み、解析のたびに参照するテンプレート集"""
+
+    def __init__(self, tag_img_dir, mapping=None):
+        self.tag_img_dir = tag_img_dir
+        self.mapping = TEMPLATE_MAPPING if mapping is None else mapping
+        self.entries = {}
+        self.template_files = []
+        self._fft_engine = None
+        self._fingerprint = None
+
+    @staticmethod
+    def _key(template_path):
+        return os.path.normcase(os.path.abspath(template_path))
+
+    def load(self):
+        """マッピングに従ってテンプレートを読み込む"""
+        logger.debug("🔍 手動マッピングを使用してテンプレートを検索...")
+
+        for file_name, tag_name in self.mapping.items():
+            file_path = os.path.join(self.tag_img_dir, file_name)
+            if os.path.exists(file_path) and self._load_entry(file_path, tag_name):
+                self.template_files.append((file_path, tag_name))
+                logger.debug("✅ マッピング追加: '%s' -> '%s'", file_name, tag_name)
+            else:
+                logger.warning("❌ ファイル不存在: %s", file_path)
+
+        logger.info("🔍 照合完了: %s 個のテンプレートが見つかりました", len(self.template_files))
+        self.load_stats()
+        return self
+
+    def load_stats(self):
+        """テンプレートの品質指標を索引から読み込む（未登録のテンプレートだけ計算して保存）"""
+        index = TemplateStatsIndex(os.path.join(get_cache_dir(), TEMPLATE_STATS_FILE)).load()
+        entries = [self.entries[self._key(path)] for path, tag_name in self.template_files]
+        for entry in entries:
+            entry._stats = index.get(entry)
+        index.save([entry.content_hash for entry in entries])
+
+    def _load_entry(self, template_path, tag_name):
+        try:
+            with open(template_path, "rb") as template_file:
+                data = template_file.read()
+        except OSError:
+            return None
+        template = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if template is None:
+            return None
+        entry = TemplateEntry(template_path, tag_name, template, hashlib.sha1(data).hexdigest())
+        self.entries[self._key(template_path)] = entry
+        return entry
+
+    def get(self, template_path, tag_name=None):
+        """テンプレートを取得（未読み込みなら一度だけ読み込む）"""
+        entry = self.entries.get(self._key(template_path))
+        if entry is None:
+            entry = self._load_entry(template_path, tag_name)
+        return entry
+
+    def fingerprint(self):
+        """テンプレートの内容から計算した識別子（tag_img の変更検出用）"""
+        if self._fingerprint is None:
+            digest = hashlib.sha1()
+            for path, tag_name in self.template_files:
+                digest.update(os.path.basename(path).encode("utf-8"))
+                digest.update(tag_name.encode("utf-8"))
+                digest.update(bytes.fromhex(self.entries[self._key(path)].content_hash))
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def fft_engine(self):
+        """FFT一括相関エンジン（初回のみ構築し、テンプレートのスペクトルを保持）"""
+        if self._fft_engine is None:
+            entries = [self.entries[self._key(path)] for path, tag_name in self.template_files]
+            self._fft_engine = FFTCorrelationEngine(
+                [entry.tag_name for entry in entries],
+                [entry.gray for entry in entries]
+            )
+        return self._fft_engine
+
+    def warm_up(self, mode=None):
+        """マッチングモードで使う SCALE_RANGE × ROTATION_ANGLES のバリエーションを事前に構築
+
+        スケール登録を使う場合は画面ごとに縮尺が決まるため構築しない（プロセスプールの場合は各プロセスで構築する）。
+        """
+        mode = MATCHING_MODE if mode is None else mode
+        if mode in ("high_quality", "pyramid", "cascade") and not USE_SCALE_REGISTRATION and \
+           not (mode == "high_quality" and HIGH_QUALITY_BACKEND == "process"):
+            for entry in self.entries.values():
+                entry.high_quality_variants()
+
+# テンプレート品質指標の索引（内容のハッシュごとに保存し、テンプレートを読み込むときに参照）
+TEMPLATE_STATS_FILE = "tag_template_stats.json"  # 保存先（get_cache_dir() からの相対パス）
+
+class TemplateStatsIndex:
+    """テンプレートの内容の SHA-1 ごとに品質指標を保存する（テンプレートが変わったものだけ再計算）"""
+
+    def __init__(self, path):
+        self.path = path
+        self.stats = {}
+        self.dirty = False
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as stats_file:
+                self.stats = json.load(stats_file).get("templates", {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("⚠️ テンプレート統計の読み込みに失敗しました: %s", e)
+        return self
+
+    def get(self, entry):
+        """テンプレートの品質指標を返す（未登録なら計算して登録）"""
+        stats = self.stats.get(entry.content_hash)
+        if stats is None:
+            stats = compute_template_stats(entry.gray)
+            self.stats[entry.content_hash] = stats
+            self.dirty = True
+        return stats
+
+    def save(self, content_hashes):
+        """新しく計算した品質指標があれば、現在のテンプレートの分だけを保存（変更がなければ書き込まない）"""
+        if not self.dirty:
+            return
+        try:
+            self.stats = {key: self.stats[key] for key in content_hashes if key in self.stats}
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temp_path = f"{self.path}.{os.getpid()}.tmp"  # バッチ解析の複数プロセスから同時に保存しても壊れないように
+            with open(temp_path, "w", encoding="utf-8") as stats_file:
+                json.dump({"templates": self.stats}, stats_file, indent=1)
+            os.replace(temp_path, self.path)
+            self.dirty = False
+        except Exception as e:
+            logger.warning("⚠️ テンプレート統計の保存に失敗しました: %s", e)
+
+_template_bank = None
+
+def get_template_bank():
+    """テンプレートバンクを取得（プロセス内で一度だけ構築）"""
+    global _template_bank
+    tag_img_dir = os.path.join(get_script_dir(), "tag_img")
+    if _template_bank is None or _template_bank.tag_img_dir != tag_img_dir:
+        _template_bank = TemplateBank(tag_img_dir).load()
+    return _template_bank
+
+# キャリブレーション（ウィンドウサイズ・モードごとの最適スケール・回転とスコア分布）
+class CalibrationStore:
+    """前回までの照合結果を SCRIPT_DIR に保存し、次回の探索範囲を絞り込む
+
+    ウィンドウサイズ×マッチングモードごとに、テンプレートの最適スケール・回転と
+    スコアのヒストグラムを保持する。tag_img の内容が変わると全て破棄する。
+    """
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.sections = {}
+
+    def load(self):
+        """保存済みのキャリブレーションを読み込む（tag_img が変わっていれば破棄）"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as calibration_file:
+                data = json.load(calibration_file)
+            if data.get("fingerprint") == self.fingerprint:
+                self.sections = data.get("sections", {})
+                logger.info("📐 キャリブレーションを読み込みました: %s 件", len(self.sections))
+            else:
+                logger.warning("📐 テンプレートが変更されたため、キャリブレーションを破棄します")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("⚠️ キャリブレーションの読み込みに失敗しました: %s", e)
+        return self
+
+    def section(self, shape, mode):
+        """キャプチャサイズとモードに対応する記録を取得（なければ作成）"""
+        key = f"{shape[1]}x{shape[0]}:{mode}"
+        section = self.sections.setdefault(key, {"templates": {}})
+        section["last_used"] = time.time()
+        return section
+
+    def lookup(self, section, entry):
+        """前回の最適 (scale, angle) を返す（未記録なら None）"""
+        stats = section["templates"].get(os.path.basename(entry.path))
+        if stats is None or "scale" not in stats:
+            return None
+        return stats["scale"], stats["angle"]
+
+    def record(self, section, entry, scale, angle, score):
+        """照合結果を記録（十分なスコアなら最適スケール・回転を更新）"""
+        stats = section["templates"].setdefault(
+            os.path.basename(entry.path), {"histogram": [0] * CALIBRATION_HISTOGRAM_BINS})
+        bin_index = min(max(int(score * CALIBRATION_HISTOGRAM_BINS), 0), CALIBRATION_HISTOGRAM_BINS - 1)
+        stats["histogram"][bin_index] += 1
+        if score >= CALIBRATION_MIN_SCORE:
+            stats["scale"] = round(float(scale), 4)
+            stats["angle"] = int(angle)
+            stats["score"] = float(score)
+
+    def save(self):
+        """古い記録を CALIBRATION_MAX_ENTRIES 件まで削除して保存"""
+        try:
+            keys = sorted(self.sections, key=lambda key: self.sections[key].get("last_used", 0), reverse=True)
+            self.sections = {key: self.sections[key] for key in keys[:CALIBRATION_MAX_ENTRIES]}
+            temp_path = self.path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as calibration_file:
+                json.dump({"fingerprint": self.fingerprint, "sections": self.sections}, calibration_file)
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            logger.warning("⚠️ キャリブレーションの保存に失敗しました: %s", e)
+
+_calibration_store = None
+
+def get_calibration_store():
+    """キャリブレーションを取得（プロセス内で一度だけ読み込み、tag_img の変更時は作り直す）"""
+    global _calibration_store
+    path = os.path.join(get_script_dir(), CALIBRATION_FILE)
+    fingerprint = get_template_bank().fingerprint()
+    if _calibration_store is None or _calibration_store.path != path or \
+       _calibration_store.fingerprint != fingerprint:
+        _calibration_store = CalibrationStore(path, fingerprint).load()
+    return _calibration_store
+
+# フレーム解析コンテキスト（1枚のキャプチャにつき一度だけ計算）
+class FrameContext:
+    """キャプチャ1枚分の派生画像と品質指標を保持し、全テンプレートで共有する"""
+
+    def __init__(self, image, offset=(0, 0), slot=None, window_shape=None):
+        self.image = image
+        self.offset = offset  # 元のキャプチャ上での左上座標（切り抜きの場合）
+        self.slot = slot  # タグ枠の切り抜きの場合はキャプチャ上の枠 (x, y, w, h)
+        self.window_shape = window_shape  # ROI・タグ枠の切り抜きの場合は元のキャプチャの shape（小さいウィンドウの判定用）
+        self.registration = None  # register_frame の結果（タグ枠の切り抜きでは元のフレームと共有）
+        self.calibration = None  # CalibrationStore.section の結果（タグ枠の切り抜きでは元のフレームと共有）
+        self._gray = None
+        self._processed = {}
+        self._quality_metrics = None
+        self._pyramids = {}
+        self.engine_results = {}
+        self.match_locations = {}  # タグ名 -> 検出位置 (x, y, w, h)（max_loc から記録）
+
+    @property
+    def shape(self):
+        return self.image.shape
+
+    @property
+    def gray(self):
+        """グレースケール画像（初回のみ変換）"""
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    def processed(self, mode=None):
+        """マッチングモードごとの前処理済み画像（モードごとに一度だけ計算）"""
+        mode = MATCHING_MODE if mode is None else mode
+        if mode not in self._processed:
+            with span("FrameContext.processed", mode=mode):
+                if mode == "high_quality":
+                    self._processed[mode] = preprocess_image_for_small_windows(self.image, self.window_shape)
+                else:
+                    self._processed[mode] = self.gray
+        return self._processed[mode]
+
+    def quality_metrics(self):
+        """アダプティブ閾値用の画像品質指標（初回のみ計算）"""
+        if self._quality_metrics is None:
+            gray = self.gray
+
+            # 1. コントラスト指標
+            contrast_score = np.std(gray) / 255.0
+
+            # 2. シャープネス指標（Laplacian分散）
+            laplacian = cv2.Laplacian(gray, cv2.CV_64F)
+            sharpness_score = np.var(laplacian) / 1000.0
+            sharpness_score = min(1.0, sharpness_score)
+
+            # 3. エッジ密度指標
+            edges = cv2.Canny(gray, 50, 150)
+            edge_density = np.sum(edges > 0) / (edges.shape[0] * edges.shape[1])
+
+            # 4. ノイズ指標
+            noise_score = 1.0 - (np.std(cv2.GaussianBlur(gray, (3, 3), 0)) / np.std(gray))
+
+            self._quality_metrics = {
+                "contrast": contrast_score,
+                "sharpness": sharpness_score,
+                "edge_density": edge_density,
+                "noise": noise_score
+            }
+        return self._quality_metrics
+
+    def pyramid(self, mode=None, levels=3):
+        """前処理済み画像のガウシアンピラミッド（[0] が原寸）"""
+        mode = MATCHING_MODE if mode is None else mode
+        pyramid = self._pyramids.get(mode)
+        if pyramid is None:
+            pyramid = [self.processed(mode)]
+            self._pyramids[mode] = pyramid
+        if len(pyramid) <= levels:
+            with span("FrameContext.pyramid", mode=mode, levels=levels):
+                while len(pyramid) <= levels:
+                    pyramid.append(cv2.pyrDown(pyramid[-1]))
+        return pyramid[:levels + 1]
+
+# スケール登録（募集画面のアンカーから縮尺と位置を決める）
+@traced
+def register_frame(image, slots=None):
+    """タグ枠をアンカーとして、テンプレートの縮尺と位置の基準を求める
+
+    タグ枠が見つかればその高さと左上位置を、見つからなければクライアント領域の
+    高さから推定したタグ枠の高さを使う。
+    戻り値は {"slot_height", "offset", "source"}。
+    """
+    if slots:
+        return {
+            "slot_height": float(np.median([slot[3] for slot in slots])),
+            "offset": (int(min(slot[0] for slot in slots)), int(min(slot[1] for slot in slots))),
+            "source": "slots"
+        }
+    return {
+        "slot_height": image.shape[0] * SLOT_HEIGHT_RATIO,
+        "offset": (0, 0),
+        "source": "client"
+    }
+
+def get_frame_registration(frame):
+    """フレームのスケール登録を取得（未登録なら一度だけ計算）"""
+    if frame.registration is None:
+        if frame.slot is not None:
+            frame.registration = register_frame(frame.image, [frame.slot])
+        else:
+            frame.registration = register_frame(frame.image, detect_tag_slots(frame.image))
+    return frame.registration
+
+def registered_template_scale(entry, registration):
+    """登録結果から、元画像上でのテンプレートの縮尺を求める（テンプレートごとの切り出し元のタグ枠の高さとの比）"""
+    return registration["slot_height"] / entry.slot_height
+
+def get_frame_context(image):
+    """画像からフレームコンテキストを取得（作成済みならそのまま返す）"""
+    if isinstance(image, FrameContext):
+        return image
+    return FrameContext(image)
+
 def find_template_in_image(template_path, image):
     """テンプレート画像が画像内に存在するかチェック（スコア付き）"""
     try:
-        template = cv2.imread(template_path)
-        if template is None:
+        entry = get_template_bank().get(template_path)
+        if entry is None:
             return 0.0
+        template = entry.bgr
         
         # より柔軟なマッチング（閾値を下げる）
-        result = cv2.matchTemplate(image, template, cv2.TM_CCOEFF_NORMED)
+        result = match_template(image, template, cv2.TM_CCOEFF_NORMED)
         min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
         
         # デバッグ情報
-        print(f"テンプレート {os.path.basename(template_path)}: スコア {max_val:.3f}")
+        logger.debug("テンプレート %s: スコア %.3f", os.path.basename(template_path), max_val)
         
         return max_val
         
     except Exception as e:
-        print(f"テンプレートマッチングでエラー: {e}")
+        logger.error("テンプレートマッチングでエラー: %s", e)
         return 0.0
 
 # 改善された高精度テンプレートマッチング（小さいウィンドウ対応）
+@traced(tag_argument=2)
 def find_template_in_image_high_quality(template_path, image, tag_name):
     """改善された高精度テンプレートマッチング（小さいウィンドウ対応）"""
     try:
-        template = cv2.imread(template_path)
-        if template is None:
+        entry = get_template_bank().get(template_path, tag_name)
+        if entry is None:
             return tag_name, 0.0
         
         # 画像の前処理（小さいウィンドウでも認識できるように改善）
-        processed_image = preprocess_image_for_small_windows(image)
-        processed_template = preprocess_template_for_small_windows(template)
-        
-        # 拡張マルチスケールマッチング（より広い範囲）
-        scale_scores = []
-        
-        for scale in SCALE_RANGE:
-            if scale != 1.0:
-                h, w = processed_template.shape[:2]
-                new_h, new_w = int(h * scale), int(w * scale)
-                if new_h > 0 and new_w > 0:
-                    scaled_template = cv2.resize(processed_template, (new_w, new_h), interpolation=cv2.INTER_CUBIC)
-                else:
-                    continue
+        # 前処理はフレームコンテキストで一度だけ実行され、全テンプレートで共有される
+        frame = get_frame_context(image)
+        processed_image = frame.processed("high_quality")
+        
+        calibration_store = get_calibration_store() if frame.calibration is not None else None
+        angle_order, decisive_score, explore_score = high_quality_search_order(frame)
+        
+        # 段階照合では一部のテンプレートだけを照合し直すため、プロセスプールは使わない
+        if HIGH_QUALITY_BACKEND == "process" and MATCHING_MODE == "high_quality":
+            # プロセスプールで全テンプレートを一括照合した結果を参照（初回のみ計算）
+            results = frame.engine_results.get("high_quality")
+            if results is None:
+                get_high_quality_process_backend().score_frames([frame])
+                results = frame.engine_results["high_quality"]
+            final_score, best_scale, best_angle = results.get(tag_name, (0.0, None, None))
+        else:
+            if USE_SCALE_REGISTRATION:
+                # 登録スケールのみで照合（十分なスコアが出たら打ち切り）
+                variants = entry.registered_variants(registered_processed_scale(entry, frame, processed_image))
             else:
-                scaled_template = processed_template
+                # 拡張マルチスケールマッチング（より広い範囲）
+                # スケール・回転バリエーションはテンプレートバンクで構築済み
+                variants = entry.high_quality_variants()
+            
+            calibrated = None
+            if calibration_store is not None:
+                calibrated = calibration_store.lookup(frame.calibration, entry)
             
-            if scaled_template.shape[0] > processed_image.shape[0] or \
-               scaled_template.shape[1] > processed_image.shape[1]:
+            final_score, best_scale, best_angle = search_high_quality_variants(
+                processed_image, variants, angle_order, calibrated, decisive_score, explore_score)
+        
+        if best_scale is None:
+            return tag_name, 0.0
+        
+        if calibration_store is not None:
+            calibration_store.record(frame.calibration, entry, best_scale, best_angle, final_score)
+        
+        logger.debug("タグ '%s' の最終スコア（スケール %.2f, 回転 %s°）: %.3f", tag_name, best_scale, best_angle, final_score)
+        return tag_name, final_score
+        
+    except Exception as e:
+        logger.error("改善された高精度テンプレートマッチングでエラー: %s", e)
+        return tag_name, 0.0
+
+# 高精度モードの回転の照合順序と打ち切りスコア
+def high_quality_search_order(frame):
+    """(回転角度のインデックス順, 打ち切りスコア, 探索スコア) を返す
+
+    登録スケールでは 0 度から角度の小さい順に照合し、十分なスコアで打ち切る。0 度で探索スコアに
+    届かないスケールは残りの回転を照合しない（近傍のスケールは登録の誤差を吸収するため 0 度は必ず照合する）。
+    タグ枠から登録した場合は画面が回転していない（枠が矩形として検出できた）ため、0 度だけを照合する。
+    総当たりでは前回のキャリブレーションがある場合のみ打ち切る（近傍を先に照合するため）。
+    """
+    if USE_SCALE_REGISTRATION:
+        angle_order = sorted(range(len(ROTATION_ANGLES)), key=lambda i: abs(ROTATION_ANGLES[i]))
+        if get_frame_registration(frame)["source"] == "slots":
+            angle_order = angle_order[:1]
+        return angle_order, REGISTRATION_DECISIVE_SCORE, REGISTRATION_EXPLORE_SCORE
+    decisive_score = REGISTRATION_DECISIVE_SCORE if frame.calibration is not None else None
+    return list(range(len(ROTATION_ANGLES))), decisive_score, None
+
+# 登録スケールを前処理後の縮尺に変換
+def registered_processed_scale(entry, frame, processed_image):
+    """前処理での拡大率（画像側・テンプレート側）を考慮した登録スケール"""
+    registration = get_frame_registration(frame)
+    image_factor = processed_image.shape[1] / frame.image.shape[1]
+    template_factor = entry.high_quality.shape[1] / entry.bgr.shape[1]
+    return registered_template_scale(entry, registration) * image_factor / template_factor
+
+# スケール・回転バリエーションの照合
+def search_high_quality_variants(processed_image, variants, angle_order, calibrated=None, decisive_score=None,
+                                 explore_score=None):
+    """バリエーションを照合し、(最高スコア, スケール, 回転角度) を返す
+
+    calibrated (scale, angle) があればその近傍を先に照合する。decisive_score に達した
+    時点で残りを打ち切る（None の場合は全て照合）。explore_score を渡した場合、スケールごとに
+    最初に照合した回転がこれに届かなければ、そのスケールの残りの回転を省略する。照合できるものがなければスケールは None。
+    """
+    candidates = []
+    for variant_scale, rotated_templates in variants:
+        if rotated_templates.shape[1] > processed_image.shape[0] or \
+           rotated_templates.shape[2] > processed_image.shape[1]:
+            continue
+        for angle_index in angle_order:
+            candidates.append((variant_scale, ROTATION_ANGLES[angle_index], rotated_templates[angle_index]))
+    
+    if calibrated is not None:
+        calibrated_scale, calibrated_angle = calibrated
+        
+        def calibration_distance(candidate):
+            scale_diff = abs(candidate[0] / calibrated_scale - 1.0)
+            angle_diff = abs(candidate[1] - calibrated_angle)
+            if scale_diff <= CALIBRATION_SCALE_TOLERANCE and angle_diff <= CALIBRATION_ANGLE_TOLERANCE:
+                return (0, scale_diff, angle_diff)
+            return (1, 0.0, 0.0)  # 近傍外は元の順序を維持
+        
+        candidates.sort(key=calibration_distance)
+    
+    best_score, best_scale, best_angle = 0.0, None, None
+    explored = {}  # スケール -> 最初の回転で探索スコアに届いたか
+    for variant_scale, angle, rotated_template in candidates:
+        if not explored.get(variant_scale, True):
+            continue  # 最初の回転で探索スコアに届かなかったスケールの残りの回転は照合しない
+        # 複数マッチング手法（より柔軟な閾値）で最高スコアを採用
+        score = score_high_quality_methods(processed_image, rotated_template)
+        if variant_scale not in explored:
+            explored[variant_scale] = explore_score is None or score >= explore_score
+        if best_scale is None or score > best_score:
+            best_score, best_scale, best_angle = score, variant_scale, angle
+        if decisive_score is not None and best_score >= decisive_score:
+            break
+    
+    return best_score, best_scale, best_angle
+
+# 高精度モードの3手法で最高スコアを計算
+def score_high_quality_methods(processed_image, template):
+    """TM_CCOEFF_NORMED / TM_CCORR_NORMED / 1 - TM_SQDIFF_NORMED の最高スコアを返す"""
+    method_scores = []
+    
+    # TM_CCOEFF_NORMED（メイン手法）
+    result1 = match_template(processed_image, template, cv2.TM_CCOEFF_NORMED)
+    min_val1, max_val1, min_loc1, max_loc1 = cv2.minMaxLoc(result1)
+    method_scores.append(max_val1)
+    
+    # TM_CCORR_NORMED（補完的手法）
+    try:
+        result2 = match_template(processed_image, template, cv2.TM_CCORR_NORMED)
+        min_val2, max_val2, min_loc2, max_loc2 = cv2.minMaxLoc(result2)
+        method_scores.append(max_val2)
+    except:
+        pass
+    
+    # TM_SQDIFF_NORMED（距離ベース）
+    try:
+        result3 = match_template(processed_image, template, cv2.TM_SQDIFF_NORMED)
+        min_val3, max_val3, min_loc3, max_loc3 = cv2.minMaxLoc(result3)
+        # 距離を類似度に変換
+        method_scores.append(1 - min_val3)
+    except:
+        pass
+    
+    return max(method_scores)
+
+# 共有メモリ上の配列群（プロセスプールのワーカーからゼロコピーで参照）
+class SharedArrayBlock:
+    """複数の配列を1つの共有メモリにまとめて配置する
+
+    descriptor（共有メモリ名と各配列の位置・形・型）だけをワーカーに渡せば、
+    ワーカー側は attach_shared_arrays でコピーせずに NumPy 配列として参照できる。
+    """
+
+    ALIGNMENT = 64
+
+    def __init__(self, arrays):
+        layout = []
+        offset = 0
+        for array in arrays:
+            layout.append((offset, array.shape, array.dtype.str))
+            offset += (array.nbytes + self.ALIGNMENT - 1) // self.ALIGNMENT * self.ALIGNMENT
+        from multiprocessing import shared_memory
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        for array, (array_offset, shape, dtype) in zip(arrays, layout):
+            np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=array_offset)[...] = array
+        self.descriptor = (self.shm.name, layout)
+
+    def close(self):
+        """共有メモリを解放"""
+        self.shm.close()
+        self.shm.unlink()
+
+_worker_shared_blocks = {}
+
+def attach_shared_arrays(descriptor, keep=2):
+    """共有メモリ上の配列群を NumPy 配列として参照（ワーカー内で名前ごとに一度だけ接続）
+
+    テンプレート用とフレーム用の keep 個まで接続を保持し、古いものから閉じる。
+    """
+    name, layout = descriptor
+    block = _worker_shared_blocks.pop(name, None)
+    if block is None:
+        from multiprocessing import shared_memory
+        # 解放（unlink）は作成側のメインプロセスが行う
+        shm = shared_memory.SharedMemory(name=name)
+        arrays = [np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset) for offset, shape, dtype in layout]
+        block = (shm, arrays)
+    _worker_shared_blocks[name] = block
+    while len(_worker_shared_blocks) > keep:
+        old_name = next(iter(_worker_shared_blocks))
+        old_shm, old_arrays = _worker_shared_blocks.pop(old_name)
+        del old_arrays
+        old_shm.close()
+    return block[1]
+
+PROCESS_VARIANT_CACHE_SIZE = 256  # ワーカーごとに保持する (テンプレート, スケール) のバリエーション数（古いものから破棄）
+
+_worker_variants = {}
+
+def _worker_scaled_rotations(template_descriptor, template_index, scale):
+    """共有メモリ上のテンプレートのスケール・回転バリエーション（ワーカー内で (テンプレート, スケール) ごとに一度だけ計算）
+
+    スケール登録ではキャプチャのサイズが同じ間は同じスケールになるため、キャプチャ間で使い回せる。
+    共有メモリが作り直された場合（tag_img の変更時）は名前が変わるため別のキーになる。
+    """
+    key = (template_descriptor[0], template_index, scale)
+    if key in _worker_variants:
+        rotated_templates = _worker_variants.pop(key)
+    else:
+        rotated_templates = _scaled_rotations(attach_shared_arrays(template_descriptor)[template_index], scale)
+    _worker_variants[key] = rotated_templates
+    while len(_worker_variants) > PROCESS_VARIANT_CACHE_SIZE:
+        del _worker_variants[next(iter(_worker_variants))]
+    return rotated_templates
+
+def _init_high_quality_worker():
+    """ワーカープロセスの初期化（OpenCV の内部スレッドはワーカー数と競合させない）"""
+    cv2.setNumThreads(1)
+    configure_worker_process_logging()
+
+def _high_quality_process_task(template_descriptor, frame_descriptor, template_index, scale, frame_indices,
+                               angle_order, decisive_score, explore_score):
+    """(テンプレート, スケール) 1件分の照合（ワーカープロセスで実行）
+
+    戻り値は (template_index, scale, [(frame_index, score, angle), ...])。
+    照合できないフレームのスコアは None。
+    """
+    frames = attach_shared_arrays(frame_descriptor)
+    rotated_templates = _worker_scaled_rotations(template_descriptor, template_index, scale)
+    
+    results = []
+    for frame_index in frame_indices:
+        processed_image = frames[frame_index]
+        if rotated_templates is None or \
+           rotated_templates.shape[1] > processed_image.shape[0] or \
+           rotated_templates.shape[2] > processed_image.shape[1]:
+            results.append((frame_index, None, None))
+            continue
+        best_score, best_angle = 0.0, None
+        for angle_index in angle_order:
+            score = score_high_quality_methods(processed_image, rotated_templates[angle_index])
+            if best_angle is None or score > best_score:
+                best_score, best_angle = score, ROTATION_ANGLES[angle_index]
+            if decisive_score is not None and best_score >= decisive_score:
+                break
+            if explore_score is not None and angle_index == angle_order[0] and score < explore_score:
+                break  # 最初の回転で探索スコアに届かなければ残りの回転は照合しない
+        results.append((frame_index, best_score, best_angle))
+    return template_index, scale, results
+
+# プロセスプールによる高精度マッチング
+class HighQualityProcessBackend:
+    """高精度モードの照合を (テンプレート, スケール) 単位でプロセスプールに分散する
+
+    前処理済みテンプレートはテンプレートバンクごとに一度だけ共有メモリに置き、
+    フレームはキャプチャごとに共有メモリに置く。プールはキャプチャ間で使い回す。
+    """
+
+    def __init__(self, workers):
+        from concurrent.futures import ProcessPoolExecutor
+        
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_high_quality_worker)
+        self.template_block = None
+        self.template_fingerprint = None
+
+    def _ensure_templates(self, template_bank):
+        """前処理済みテンプレートを共有メモリに配置（tag_img が変わった場合のみ作り直す）"""
+        fingerprint = template_bank.fingerprint()
+        if self.template_block is None or self.template_fingerprint != fingerprint:
+            if self.template_block is not None:
+                self.template_block.close()
+            entries = [template_bank.get(path, tag_name) for path, tag_name in template_bank.template_files]
+            self.template_block = SharedArrayBlock([entry.high_quality for entry in entries])
+            self.template_fingerprint = fingerprint
+
+    @traced
+    def score_frames(self, frames):
+        """全テンプレートを全フレームで照合し、frame.engine_results["high_quality"] に格納
+
+        結果は {tag_name: (score, scale, angle)}。
+        """
+        template_bank = get_template_bank()
+        self._ensure_templates(template_bank)
+        entries = [template_bank.get(path, tag_name) for path, tag_name in template_bank.template_files]
+        processed_images = [frame.processed("high_quality") for frame in frames]
+        angle_order, decisive_score, explore_score = high_quality_search_order(frames[0])
+        
+        # (テンプレート, スケール) ごとに照合するフレームをまとめる
+        tasks = {}
+        for frame_index, (frame, processed_image) in enumerate(zip(frames, processed_images)):
+            for template_index, entry in enumerate(entries):
+                if USE_SCALE_REGISTRATION:
+                    scales = registered_scales(registered_processed_scale(entry, frame, processed_image))
+                else:
+                    scales = SCALE_RANGE
+                for scale in scales:
+                    tasks.setdefault((template_index, round(scale, 4)), []).append(frame_index)
+        
+        best = {}
+        frame_block = SharedArrayBlock(processed_images)
+        try:
+            futures = [
+                self.executor.submit(_high_quality_process_task, self.template_block.descriptor, frame_block.descriptor,
+                                     template_index, scale, frame_indices, angle_order, decisive_score, explore_score)
+                for (template_index, scale), frame_indices in tasks.items()
+            ]
+            for future in futures:
+                template_index, scale, results = future.result()
+                for frame_index, score, angle in results:
+                    key = (frame_index, template_index)
+                    if score is not None and (key not in best or score > best[key][0]):
+                        best[key] = (score, scale, angle)
+        finally:
+            frame_block.close()
+        
+        for frame_index, frame in enumerate(frames):
+            frame.engine_results["high_quality"] = {
+                entry.tag_name: best[(frame_index, template_index)]
+                for template_index, entry in enumerate(entries)
+                if (frame_index, template_index) in best
+            }
+
+    def shutdown(self):
+        """プールを停止し、共有メモリを解放"""
+        self.executor.shutdown(wait=True)
+        if self.template_block is not None:
+            self.template_block.close()
+            self.template_block = None
+
+_high_quality_process_backend = None
+
+def get_high_quality_process_backend():
+    """プロセスプールを取得（初回のみ起動し、キャプチャ間で使い回す）"""
+    global _high_quality_process_backend
+    if _high_quality_process_backend is None:
+        workers = PROCESS_POOL_WORKERS if PROCESS_POOL_WORKERS > 0 else (os.cpu_count() or 1)
+        _high_quality_process_backend = HighQualityProcessBackend(workers)
+        atexit.register(shutdown_high_quality_process_backend)
+    return _high_quality_process_backend
+
+def shutdown_high_quality_process_backend():
+    """プロセスプールを停止（終了時に自動で呼ばれる）"""
+    global _high_quality_process_backend
+    if _high_quality_process_backend is not None:
+        _high_quality_process_backend.shutdown()
+        _high_quality_process_backend = None
+
+# 粗密ピラミッド探索の探索範囲
+def pyramid_search_space(entry, frame, processed_image):
+    """(バリエーション, 回転角度のインデックス順) を返す（高精度モードと同じスケール・回転を探索する）"""
+    angle_order = high_quality_search_order(frame)[0]
+    if USE_SCALE_REGISTRATION:
+        return entry.registered_variants(registered_processed_scale(entry, frame, processed_image)), angle_order
+    return entry.high_quality_variants(), angle_order
+
+def coarse_peaks(result, count, template_h, template_w):
+    """粗探索のスコアマップから、互いにテンプレートの半分以上離れた上位 count 個のピーク [(score, (x, y)), ...]"""
+    result = result.copy()
+    peaks = []
+    for _ in range(count):
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+        if peaks and max_val <= -1.0:
+            break
+        peaks.append((max_val, max_loc))
+        x, y = max_loc
+        result[max(0, y - template_h // 2):y + template_h // 2 + 1, max(0, x - template_w // 2):x + template_w // 2 + 1] = -1.0
+    return peaks
+
+# 粗密ピラミッド探索による高精度テンプレートマッチング
+@traced(tag_argument=2)
+def find_template_in_image_pyramid(template_path, image, tag_name):
+    """粗密ピラミッド探索による高精度テンプレートマッチング
+
+    前処理・探索するスケールと回転は高精度モードと同じ（pyramid_search_space）。各スケール・回転を
+    1/2**PYRAMID_LEVELS まで縮小したフレーム上で TM_CCOEFF_NORMED のみで照合し、スケールごとに
+    スコアの高い PYRAMID_TOP_K 個のピーク（回転・位置）を、原寸の周辺の小さな窓で3手法により精査する。
+
+    1つのピークだけを精査すると、縮小で文字が潰れて正しい位置が2位以下になった場合に取りこぼすため、
+    スケールごとに複数のピークを残す。画面内に存在するタグの最終スコアが網羅探索
+    （同じバリエーションを原寸で全て照合）から PYRAMID_SCORE_TOLERANCE を超えて下がらないことは
+    benchmark_tag_analysis.py --check-pyramid で正解ラベル付きのキャプチャに対して確認する。
+    """
+    try:
+        entry = get_template_bank().get(template_path, tag_name)
+        if entry is None:
+            return tag_name, 0.0
+        
+        frame = get_frame_context(image)
+        pyramid = frame.pyramid("high_quality", PYRAMID_LEVELS)
+        processed_image = pyramid[0]
+        variants, angle_order = pyramid_search_space(entry, frame, processed_image)
+        image_h, image_w = processed_image.shape[:2]
+        
+        refined_scores = []
+        for scale, rotated_templates in variants:
+            template_h, template_w = rotated_templates.shape[1:3]
+            if template_h > image_h or template_w > image_w:
                 continue
             
-            # 回転不変性（より広い角度範囲）
-            rotation_scores = []
+            # テンプレートが小さくなりすぎない範囲で縮小段数を決定
+            level = PYRAMID_LEVELS
+            while level > 0 and min(template_h, template_w) / (2 ** level) < PYRAMID_MIN_TEMPLATE_SIZE:
+                level -= 1
+            coarse_image = pyramid[level]
+            coarse_templates = entry.coarse_rotations(scale, rotated_templates, level)
+            if coarse_templates.shape[1] > coarse_image.shape[0] or \
+               coarse_templates.shape[2] > coarse_image.shape[1]:
+                continue
             
-            for angle in ROTATION_ANGLES:
-                if angle != 0:
-                    M = cv2.getRotationMatrix2D((scaled_template.shape[1] / 2, scaled_template.shape[0] / 2), angle, 1)
-                    rotated_template = cv2.warpAffine(scaled_template, M, (scaled_template.shape[1], scaled_template.shape[0]))
-                else:
-                    rotated_template = scaled_template
-                
-                # 複数マッチング手法（より柔軟な閾値）
-                method_scores = []
-                
-                # TM_CCOEFF_NORMED（メイン手法）
-                result1 = cv2.matchTemplate(processed_image, rotated_template, cv2.TM_CCOEFF_NORMED)
-                min_val1, max_val1, min_loc1, max_loc1 = cv2.minMaxLoc(result1)
-                method_scores.append(max_val1)
-                
-                # TM_CCORR_NORMED（補完的手法）
-                try:
-                    result2 = cv2.matchTemplate(processed_image, rotated_template, cv2.TM_CCORR_NORMED)
-                    min_val2, max_val2, min_loc2, max_loc2 = cv2.minMaxLoc(result2)
-                    method_scores.append(max_val2)
-                except:
-                    pass
-                
-                # TM_SQDIFF_NORMED（距離ベース）
-                try:
-                    result3 = cv2.matchTemplate(processed_image, rotated_template, cv2.TM_SQDIFF_NORMED)
-                    min_val3, max_val3, min_loc3, max_loc3 = cv2.minMaxLoc(result3)
-                    # 距離を類似度に変換
-                    method_scores.append(1 - min_val3)
-                except:
-                    pass
-                
-                # 最高スコアを採用
-                if method_scores:
-                    rotation_scores.append(max(method_scores))
+            # 粗探索（縮小フレーム上で回転ごとにピークを集め、スケール内の上位だけを残す）
+            hypotheses = []
+            for angle_index in angle_order:
+                coarse_template = coarse_templates[angle_index]
+                result = match_template(coarse_image, coarse_template, cv2.TM_CCOEFF_NORMED)
+                for coarse_score, coarse_loc in coarse_peaks(result, PYRAMID_TOP_K, *coarse_template.shape[:2]):
+                    hypotheses.append((coarse_score, angle_index, coarse_loc))
+            hypotheses.sort(key=lambda hypothesis: hypothesis[0], reverse=True)
             
-            # 回転角度での最高スコアを採用
-            if rotation_scores:
-                scale_scores.append(max(rotation_scores))
+            # 原寸で精査
+            margin = 2 ** level + PYRAMID_REFINE_MARGIN
+            for coarse_score, angle_index, (coarse_x, coarse_y) in hypotheses[:PYRAMID_TOP_K]:
+                x = coarse_x * (2 ** level)
+                y = coarse_y * (2 ** level)
+                x0, y0 = max(0, x - margin), max(0, y - margin)
+                x1, y1 = min(image_w, x + template_w + margin), min(image_h, y + template_h + margin)
+                window = processed_image[y0:y1, x0:x1]
+                if window.shape[0] < template_h or window.shape[1] < template_w:
+                    continue
+                refined_scores.append(score_high_quality_methods(window, rotated_templates[angle_index]))
         
-        if scale_scores:
-            final_score = max(scale_scores)
-            print(f"タグ '{tag_name}' の最終スコア: {final_score:.3f}")
+        if refined_scores:
+            final_score = max(refined_scores)
+            logger.debug("タグ '%s' の最終スコア（ピラミッド探索）: %.3f", tag_name, final_score)
             return tag_name, final_score
         else:
             return tag_name, 0.0
         
     except Exception as e:
-        print(f"改善された高精度テンプレートマッチングでエラー: {e}")
+        logger.error("ピラミッド探索テンプレートマッチングでエラー: %s", e)
+        return tag_name, 0.0
+
+# 固有テンプレート（PCA）分類器の設定
+EIGEN_MODEL_FILE = "tag_img_eigen.npz"  # tag_img の隣に保存する学習済み基底
+EIGEN_SIZE = (96, 24)  # 正規化後のサイズ (幅, 高さ)
+EIGEN_COMPONENTS = 32  # 部分空間の次元数
+EIGEN_AUG_SCALES = (0.6, 0.8, 1.0, 1.25)  # 学習時の拡大縮小
+EIGEN_AUG_BLURS = (0, 3)  # 学習時のぼかし（カーネルサイズ、0 はなし）
+EIGEN_AUG_BRIGHTNESS = ((1.0, 0), (0.8, -20), (1.2, 20))  # 学習時の明るさ (コントラスト倍率, オフセット)
+
+def normalize_tag_image(gray):
+    """タグ文字の外接矩形を切り出し、EIGEN_SIZE の単位ベクトルに正規化する"""
+    text_pixels = np.argwhere(gray > TAG_TEXT_LEVEL)
+    if len(text_pixels):
+        (y0, x0), (y1, x1) = text_pixels.min(axis=0), text_pixels.max(axis=0) + 1
+        gray = gray[y0:y1, x0:x1]
+    
+    # 縦横比を保ったまま背景色で EIGEN_SIZE の比率に余白を追加
+    target_w, target_h = EIGEN_SIZE
+    h, w = gray.shape[:2]
+    canvas_w = max(w, int(np.ceil(h * target_w / target_h)))
+    canvas_h = max(h, int(np.ceil(w * target_h / target_w)))
+    canvas = np.full((canvas_h, canvas_w), int(np.min(gray)) if gray.size else 0, dtype=np.uint8)
+    top, left = (canvas_h - h) // 2, (canvas_w - w) // 2
+    canvas[top:top + h, left:left + w] = gray
+    
+    vector = cv2.resize(canvas, EIGEN_SIZE, interpolation=cv2.INTER_AREA).astype(np.float32).ravel()
+    vector -= vector.mean()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+def augment_tag_template(gray):
+    """学習用に拡大縮小・ぼかし・明るさを変えたテンプレートを生成"""
+    h, w = gray.shape[:2]
+    for scale in EIGEN_AUG_SCALES:
+        # 解像度の違いを再現（縮小してから元のサイズに戻す）
+        scaled = cv2.resize(gray, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+        for blur in EIGEN_AUG_BLURS:
+            blurred = cv2.GaussianBlur(scaled, (blur, blur), 0) if blur else scaled
+            for alpha, beta in EIGEN_AUG_BRIGHTNESS:
+                yield cv2.convertScaleAbs(blurred, alpha=alpha, beta=beta)
+
+class EigenTagClassifier:
+    """tag_img のテンプレートから学習した PCA 部分空間での最近傍分類器"""
+
+    def __init__(self, tag_names, mean, basis, projections, labels, fingerprint):
+        self.tag_names = list(tag_names)
+        self.mean = mean.astype(np.float32)
+        self.basis = basis.astype(np.float32)
+        self.projections = projections.astype(np.float32)
+        self.labels = labels.astype(np.int32)
+        self.fingerprint = str(fingerprint)
+
+    @classmethod
+    def train(cls, bank):
+        """テンプレートバンクから拡張データを作り、PCA 基底を学習する"""
+        tag_names = []
+        samples = []
+        labels = []
+        for path, tag_name in bank.template_files:
+            entry = bank.get(path, tag_name)
+            label = len(tag_names)
+            tag_names.append(tag_name)
+            for augmented in augment_tag_template(entry.gray):
+                samples.append(normalize_tag_image(augmented))
+                labels.append(label)
+        
+        samples = np.array(samples, dtype=np.float32)
+        mean = samples.mean(axis=0)
+        _, _, vt = np.linalg.svd(samples - mean, full_matrices=False)
+        basis = vt[:EIGEN_COMPONENTS]
+        projections = _normalize_rows((samples - mean) @ basis.T)
+        return cls(tag_names, mean, basis, projections, np.array(labels), bank.fingerprint())
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["tag_names"], data["mean"], data["basis"], data["projections"],
+                       data["labels"], data["fingerprint"])
+
+    def save(self, path):
+        # float16 で保存してファイルを小さく保つ
+        np.savez_compressed(
+            path,
+            tag_names=np.array(self.tag_names),
+            mean=self.mean.astype(np.float16),
+            basis=self.basis.astype(np.float16),
+            projections=self.projections.astype(np.float16),
+            labels=self.labels,
+            fingerprint=np.array(self.fingerprint)
+        )
+
+    def classify(self, vectors):
+        """正規化済みベクトル (n, D) を全タグと比較し、(n, タグ数) の類似度を返す
+
+        類似度は部分空間での cos 類似度の、タグごとの学習サンプル中の最大値。
+        """
+        projected = _normalize_rows((np.asarray(vectors, dtype=np.float32) - self.mean) @ self.basis.T)
+        similarities = projected @ self.projections.T
+        scores = np.full((len(projected), len(self.tag_names)), -1.0, dtype=np.float32)
+        for label in range(len(self.tag_names)):
+            scores[:, label] = similarities[:, self.labels == label].max(axis=1)
+        return scores
+
+    @traced
+    def classify_frames(self, frames):
+        """タグ枠のフレームコンテキストをまとめて分類し、結果を各フレームに保持する"""
+        vectors = [normalize_tag_image(_slot_button_gray(frame)) for frame in frames]
+        scores = self.classify(vectors)
+        for frame, row in zip(frames, scores):
+            frame.engine_results["eigen"] = dict(zip(self.tag_names, (float(score) for score in row)))
+        return scores
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+def _slot_button_gray(frame):
+    """タグ枠の切り抜きから、余白を除いたボタン内側のグレースケール画像を取り出す"""
+    gray = frame.gray
+    x, y, w, h = frame.slot
+    inset = max(1, int(h * 0.08))
+    x0 = x - frame.offset[0] + inset
+    y0 = y - frame.offset[1] + inset
+    return gray[max(0, y0):max(0, y0 + h - 2 * inset), max(0, x0):max(0, x0 + w - 2 * inset)]
+
+_eigen_classifier = None
+
+def get_eigen_classifier():
+    """固有テンプレート分類器を取得（初回のみ読み込み、テンプレート変更時は再学習）"""
+    global _eigen_classifier
+    bank = get_template_bank()
+    if _eigen_classifier is None or _eigen_classifier.fingerprint != bank.fingerprint():
+        model_path = os.path.join(get_script_dir(), EIGEN_MODEL_FILE)
+        classifier = None
+        if os.path.exists(model_path):
+            try:
+                classifier = EigenTagClassifier.load(model_path)
+            except Exception as e:
+                logger.warning("固有テンプレートの読み込みでエラー: %s", e)
+        if classifier is None or classifier.fingerprint != bank.fingerprint():
+            logger.info("🔄 固有テンプレートを学習します...")
+            classifier = EigenTagClassifier.train(bank)
+            try:
+                classifier.save(model_path)
+                logger.info("✅ 固有テンプレートを保存しました: %s", model_path)
+            except Exception as e:
+                logger.error("固有テンプレートの保存でエラー: %s", e)
+        _eigen_classifier = classifier
+    return _eigen_classifier
+
+# 固有テンプレート（PCA）によるタグ枠の分類
+@traced(tag_argument=2)
+def find_template_in_image_eigen(template_path, image, tag_name):
+    """固有テンプレート（PCA）によるタグ枠の分類
+
+    タグ枠の切り抜き以外（枠が検出できなかった場合）はシンプルなマッチングで代用する。
+    """
+    try:
+        frame = get_frame_context(image)
+        if frame.slot is None:
+            return find_template_in_image_simple(template_path, frame, tag_name)
+        
+        results = frame.engine_results.get("eigen")
+        if results is None:
+            get_eigen_classifier().classify_frames([frame])
+            results = frame.engine_results["eigen"]
+        return tag_name, results.get(tag_name, 0.0)
+        
+    except Exception as e:
+        logger.error("固有テンプレート分類でエラー: %s", e)
         return tag_name, 0.0
 
 # シンプルな前処理関数（最小限）
@@ -290,7 +1745,7 @@ def preprocess_image_simple(image):
         gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
         return gray
     except Exception as e:
-        print(f"シンプル前処理でエラー: {e}")
+        logger.error("シンプル前処理でエラー: %s", e)
         return image
 
 def preprocess_template_simple(template):
@@ -300,7 +1755,7 @@ def preprocess_template_simple(template):
         gray = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
         return gray
     except Exception as e:
-        print(f"シンプルテンプレート前処理でエラー: {e}")
+        logger.error("シンプルテンプレート前処理でエラー: %s", e)
         return template
 
 # 高精度前処理関数
@@ -324,7 +1779,7 @@ def preprocess_image_high_quality(image):
         return sharpened
         
     except Exception as e:
-        print(f"高精度前処理でエラー: {e}")
+        logger.error("高精度前処理でエラー: %s", e)
         return image
 
 def preprocess_template_high_quality(template):
@@ -345,7 +1800,7 @@ def preprocess_template_high_quality(template):
         return normalized_gradient
         
     except Exception as e:
-        print(f"高精度テンプレート前処理でエラー: {e}")
+        logger.error("高精度テンプレート前処理でエラー: %s", e)
         return template
 
 # 元の高精度前処理関数（完全復元）
@@ -400,7 +1855,7 @@ def preprocess_image_original_high_quality(image):
         return final_image
         
     except Exception as e:
-        print(f"元の高精度前処理でエラー: {e}")
+        logger.error("元の高精度前処理でエラー: %s", e)
         return image
 
 def preprocess_template_original_high_quality(template):
@@ -425,65 +1880,20 @@ def preprocess_template_original_high_quality(template):
         return sharpened
         
     except Exception as e:
-        print(f"元の高精度テンプレート前処理でエラー: {e}")
+        logger.error("元の高精度テンプレート前処理でエラー: %s", e)
         return template
 
-# アダプティブ閾値計算
-def calculate_adaptive_threshold(image, template_path):
-    """アダプティブ閾値計算"""
-    try:
-        # 画像の品質指標を計算
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        
-        # 1. コントラスト指標
-        contrast_score = np.std(gray) / 255.0
-        
-        # 2. シャープネス指標（Laplacian分散）
-        laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-        sharpness_score = np.var(laplacian) / 1000.0
-        sharpness_score = min(1.0, sharpness_score)
-        
-        # 3. エッジ密度指標
-        edges = cv2.Canny(gray, 50, 150)
-        edge_density = np.sum(edges > 0) / (edges.shape[0] * edges.shape[1])
-        
-        # 総合品質スコア
-        quality_score = (
-            contrast_score * 0.4 +
-            sharpness_score * 0.4 +
-            edge_density * 0.2
-        )
-        
-        # ベース閾値（品質に応じて調整）
-        base_threshold = 0.70  # 70%をベース
-        
-        # 品質による調整（±0.15）
-        quality_adjustment = (quality_score - 0.5) * 0.3
-        final_threshold = base_threshold + quality_adjustment
-        
-        # 閾値の範囲を制限（0.55〜0.85）
-        final_threshold = max(0.55, min(0.85, final_threshold))
-        
-        return final_threshold
-        
-    except Exception as e:
-        print(f"アダプティブ閾値計算でエラー: {e}")
-        return 0.70  # デフォルト値
-
 # 元のテンプレート品質計算（完全復元）
 def calculate_template_quality_original(template_path):
-    """元のテンプレート品質計算（完全復元）"""
+    """元のテンプレート品質計算（テンプレートバンクの索引から参照）"""
+    entry = get_template_bank().get(template_path)
+    if entry is None:
+        return 0.5
+    return entry.stats["quality"]
+
+def compute_template_stats(gray):
+    """テンプレートの品質指標を計算（テンプレートごとに一度だけ、TemplateStatsIndex に保存）"""
     try:
-        template = cv2.imread(template_path)
-        if template is None:
-            return 0.5
-        
-        # グレースケール変換
-        if len(template.shape) == 3:
-            gray = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
-        else:
-            gray = template.copy()
-        
         # 1. テンプレートサイズ指標
         h, w = gray.shape
         size_score = min(1.0, (h * w) / (100 * 100))
@@ -506,11 +1916,17 @@ def calculate_template_quality_original(template_path):
             border_diff * 0.2
         )
         
-        return quality_score
+        return {
+            "size": float(size_score),
+            "contrast": float(contrast_score),
+            "edge_clarity": float(edge_clarity),
+            "border_diff": float(border_diff),
+            "quality": float(quality_score)
+        }
         
     except Exception as e:
-        print(f"元のテンプレート品質計算でエラー: {e}")
-        return 0.5
+        logger.error("元のテンプレート品質計算でエラー: %s", e)
+        return {"quality": 0.5}
 
 def calculate_border_difference_original(gray_image):
     """元の境界差分計算（完全復元）"""
@@ -538,30 +1954,27 @@ def calculate_border_difference_original(gray_image):
         return min(1.0, diff * 3)  # 元のスケーリング
         
     except Exception as e:
-        print(f"元の境界差分計算でエラー: {e}")
+        logger.error("元の境界差分計算でエラー: %s", e)
         return 0.5
 
 # 元のアダプティブ閾値計算（完全復元）
 def calculate_adaptive_threshold(image, template_path):
     """元のアダプティブ閾値計算（完全復元）"""
     try:
-        # 画像の品質指標を詳細に計算
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        # 画像の品質指標（フレームコンテキストで一度だけ計算）
+        metrics = get_frame_context(image).quality_metrics()
         
         # 1. コントラスト指標
-        contrast_score = np.std(gray) / 255.0
+        contrast_score = metrics["contrast"]
         
         # 2. シャープネス指標（Laplacian分散）
-        laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-        sharpness_score = np.var(laplacian) / 1000.0
-        sharpness_score = min(1.0, sharpness_score)
+        sharpness_score = metrics["sharpness"]
         
         # 3. エッジ密度指標
-        edges = cv2.Canny(gray, 50, 150)
-        edge_density = np.sum(edges > 0) / (edges.shape[0] * edges.shape[1])
+        edge_density = metrics["edge_density"]
         
         # 4. ノイズ指標
-        noise_score = 1.0 - (np.std(cv2.GaussianBlur(gray, (3, 3), 0)) / np.std(gray))
+        noise_score = metrics["noise"]
         
         # 5. テンプレート品質指標
         template_quality = calculate_template_quality_original(template_path)
@@ -588,263 +2001,876 @@ def calculate_adaptive_threshold(image, template_path):
         return final_threshold
         
     except Exception as e:
-        print(f"元のアダプティブ閾値計算でエラー: {e}")
+        logger.error("元のアダプティブ閾値計算でエラー: %s", e)
         return 0.85  # 元のデフォルト値
 
-# マッチングモード選択（シンプル vs 高精度）
-MATCHING_MODE = "simple"  # "simple" または "high_quality"
+# マッチングモード選択（シンプル vs 高精度 vs FFT一括相関 vs ピラミッド探索 vs 固有テンプレート vs 段階照合）
+MATCHING_MODE = "simple"  # "simple"、"high_quality"、"fft"、"pyramid"、"eigen" または "cascade"
+
+# 段階照合（cascade）の設定：登録スケールのグレースケール照合を全テンプレートに行い、紛らわしいものだけ高精度で照合し直す
+CASCADE_ACCEPT_SCORE = 0.9  # 1位がこのスコア以上で、2位との差が CASCADE_MARGIN 以上なら確定
+CASCADE_MARGIN = 0.1  # 1位との差がこれ未満の候補は高精度で照合し直す
+CASCADE_CONFUSABLE_TAGS = [("近距離", "遠距離")]  # 見た目の近いタグの組（どちらもテンプレートがあるもの）
+CASCADE_CONFUSABLE_MARGIN = 0.2  # 見た目の近いタグの組は、1位との差がこれ未満なら照合し直す
+CASCADE_MAX_CANDIDATES = 3  # タグ枠ごとに高精度で照合し直す候補数の上限（見た目の近いタグは別枠）
+
+# ピラミッド探索（高精度モードの粗密探索）の設定
+PYRAMID_LEVELS = 2  # 粗探索で縮小する段数（1段ごとに1/2）
+PYRAMID_MIN_TEMPLATE_SIZE = 8  # 粗探索でテンプレートがこれより小さくなる場合は段数を減らす
+PYRAMID_TOP_K = 3  # スケールごとに原寸で精査する粗探索のピーク（回転・位置）の数
+PYRAMID_REFINE_MARGIN = 4  # 精査窓の余白（原寸ピクセル、縮小倍率分に加算）
+PYRAMID_SCORE_TOLERANCE = 0.05  # 画面内のタグの最終スコアの網羅探索からの低下の許容値（--check-pyramid で確認）
+
+# FFT一括相関エンジンの設定
+FFT_BATCH_SIZE = 8  # 一度に周波数領域で処理するテンプレート数（メモリ使用量との兼ね合い）
+FFT_SCORE_METHODS = ("ccoeff",)  # スコアに使う手法（"ccoeff", "ccorr", "sqdiff" の最大値を採用）
+
+# 並列処理の設定
+USE_PARALLEL_MATCHING = True  # テンプレートごとの照合をスレッドプールで並列実行する
+MATCHING_WORKERS = 0  # ワーカー数（0 の場合は CPU コア数）
+PARALLEL_MATCHING_MODES = ("simple", "high_quality", "pyramid", "cascade")  # fft / eigen は一括計算のため順次処理
+HIGH_QUALITY_BACKEND = "thread"  # 高精度モードの実行方式: "thread"（スレッドプール）または "process"（プロセスプール）
+PROCESS_POOL_WORKERS = 0  # プロセスプールのワーカー数（0 の場合は CPU コア数）
+
+# 早期終了の設定
+USE_EARLY_EXIT = True  # 全タグ枠が確信度の高い検出で埋まったら残りのテンプレートを省略する
+EARLY_EXIT_SCORE = 0.9  # タグ枠を確定とみなすスコア（誤検出の最高スコアは約 0.85）
 
 # 統合テンプレートマッチング関数
 def find_template_in_image_fast(template_path, image, tag_name):
     """統合テンプレートマッチング（モード選択可能）"""
     if MATCHING_MODE == "high_quality":
         return find_template_in_image_high_quality(template_path, image, tag_name)
+    elif MATCHING_MODE == "fft":
+        return find_template_in_image_fft(template_path, image, tag_name)
+    elif MATCHING_MODE == "pyramid":
+        return find_template_in_image_pyramid(template_path, image, tag_name)
+    elif MATCHING_MODE == "eigen":
+        return find_template_in_image_eigen(template_path, image, tag_name)
+    elif MATCHING_MODE == "cascade":
+        return find_template_in_image_registered(template_path, image, tag_name)
     else:
         return find_template_in_image_simple(template_path, image, tag_name)
 
 # シンプルなテンプレートマッチング（基本版）
+@traced(tag_argument=2)
 def find_template_in_image_simple(template_path, image, tag_name):
     """シンプルなテンプレートマッチング（基本版）"""
     try:
-        template = cv2.imread(template_path)
-        if template is None:
+        entry = get_template_bank().get(template_path, tag_name)
+        if entry is None:
             return tag_name, 0.0
         
-        # 最小限の前処理（グレースケール変換のみ）
-        gray_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        gray_template = cv2.cvtColor(template, cv2.COLOR_BGR2GRAY)
+        # 最小限の前処理（グレースケール変換のみ、画像・テンプレートとも変換済み）
+        gray_image = get_frame_context(image).gray
+        gray_template = entry.gray
+        if gray_template.shape[0] > gray_image.shape[0] or gray_template.shape[1] > gray_image.shape[1]:
+            return tag_name, 0.0  # テンプレートがタグ枠の切り抜きより大きい場合は照合しない
         
         # 基本的なマッチング（単一手法、単一スケール）
-        result = cv2.matchTemplate(gray_image, gray_template, cv2.TM_CCOEFF_NORMED)
+        result = match_template(gray_image, gray_template, cv2.TM_CCOEFF_NORMED)
         min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+        get_frame_context(image).match_locations[tag_name] = (max_loc[0], max_loc[1], gray_template.shape[1], gray_template.shape[0])
+        
+        return tag_name, max_val
+        
+    except Exception as e:
+        logger.error("シンプルテンプレートマッチングでエラー: %s", e)
+        return tag_name, 0.0
+
+# 登録スケールでのグレースケール照合（段階照合の1段目）
+@traced(tag_argument=2)
+def find_template_in_image_registered(template_path, image, tag_name):
+    """テンプレートを登録スケールに合わせてからグレースケールで照合する
+
+    原寸のテンプレートをそのまま照合するシンプルモードと違い、ウィンドウサイズが
+    テンプレートの作成時と異なっても正しいタグが上位になる。登録の誤差を吸収するため、登録スケールと
+    その近傍（REGISTRATION_SCALE_STEPS 倍）を順に1手法で照合し、最高スコアを返す（REGISTRATION_DECISIVE_SCORE に
+    達したら残りの近傍は照合しない）。登録がない場合はシンプルモードと同じ。
+    """
+    frame = get_frame_context(image)
+    if not USE_SCALE_REGISTRATION:
+        return find_template_in_image_simple(template_path, frame, tag_name)
+    try:
+        entry = get_template_bank().get(template_path, tag_name)
+        if entry is None:
+            return tag_name, 0.0
+        
+        gray_image = frame.gray
+        best_score = 0.0
+        for scale in registered_scales(registered_template_scale(entry, get_frame_registration(frame))):
+            gray_template = entry.registered_gray(scale)
+            if gray_template.shape[0] > gray_image.shape[0] or gray_template.shape[1] > gray_image.shape[1]:
+                continue
+            
+            result = match_template(gray_image, gray_template, cv2.TM_CCOEFF_NORMED)
+            min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(result)
+            if max_val > best_score:
+                best_score = max_val
+                frame.match_locations[tag_name] = (max_loc[0], max_loc[1], gray_template.shape[1], gray_template.shape[0])
+            if best_score >= REGISTRATION_DECISIVE_SCORE:
+                break
+        return tag_name, best_score
+        
+    except Exception as e:
+        logger.error("登録スケールのテンプレートマッチングでエラー: %s", e)
+        return tag_name, 0.0
+
+def _window_sums(integral, h, w):
+    """積分画像から h×w 窓内の総和を全位置について求める"""
+    sums = integral[h:, w:] - integral[:-h, w:]
+    sums -= integral[h:, :-w]
+    sums += integral[:-h, :-w]
+    return sums
+
+# FFT一括相関エンジン
+class FFTCorrelationEngine:
+    """フレームを一度だけ周波数領域に変換し、全テンプレートとの正規化相関をまとめて計算する
+
+    テンプレートごとの相関 C = Σ I·T を周波数領域の積から求め、積分画像による
+    窓内の ΣI・ΣI² と組み合わせて TM_CCOEFF_NORMED / TM_CCORR_NORMED /
+    TM_SQDIFF_NORMED 相当のスコアを同じ相関から導出する。
+    テンプレートのスペクトルは FFT サイズごとにキャッシュされる。
+    """
+
+    METHODS = ("ccoeff", "ccorr", "sqdiff")
+
+    def __init__(self, tag_names, gray_templates, batch_size=None):
+        self.tag_names = list(tag_names)
+        self.templates = [np.asarray(t, dtype=np.float64) for t in gray_templates]
+        self.batch_size = max(1, batch_size or FFT_BATCH_SIZE)
+        self.sizes = [t.shape[:2] for t in self.templates]
+        self.sums = np.array([t.sum() for t in self.templates])
+        self.sq_sums = np.array([(t * t).sum() for t in self.templates])
+        self._spectra = {}
+
+    def _fft_shape(self, height, width):
+        return cv2.getOptimalDFTSize(height), cv2.getOptimalDFTSize(width)
+
+    def _batches(self):
+        for start in range(0, len(self.templates), self.batch_size):
+            yield start, min(start + self.batch_size, len(self.templates))
+
+    def _template_spectra(self, fft_shape):
+        """テンプレートのスペクトル（FFTサイズごとに一度だけ計算）"""
+        spectra = self._spectra.get(fft_shape)
+        if spectra is None:
+            spectra = []
+            for start, stop in self._batches():
+                padded = np.zeros((stop - start,) + fft_shape, dtype=np.float64)
+                for i, template in enumerate(self.templates[start:stop]):
+                    h, w = template.shape
+                    padded[i, :h, :w] = template
+                spectra.append(np.conj(np.fft.rfft2(padded)))
+            # フレームサイズの種類は少ないので直近のものだけ保持
+            if len(self._spectra) >= 4:
+                self._spectra.pop(next(iter(self._spectra)))
+            self._spectra[fft_shape] = spectra
+        return spectra
+
+    def _iter_scores(self, gray_image, methods):
+        """テンプレートのバッチごとに (index, {method: スコアマップ}) を順に返す"""
+        image = np.asarray(gray_image, dtype=np.float64)
+        height, width = image.shape[:2]
+        fft_shape = self._fft_shape(height, width)
+
+        # フレームは一度だけ周波数領域へ変換
+        image_spectrum = np.fft.rfft2(image, s=fft_shape)
+        integral, sq_integral = cv2.integral2(image, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+
+        for (start, stop), spectra in zip(self._batches(), self._template_spectra(fft_shape)):
+            # バッチ内の全テンプレートとの相関を一括で計算
+            correlations = np.fft.irfft2(image_spectrum[None, :, :] * spectra, s=fft_shape)
+
+            for offset in range(stop - start):
+                index = start + offset
+                h, w = self.sizes[index]
+                if h > height or w > width:
+                    yield index, None
+                    continue
+
+                n = float(h * w)
+                rows, cols = height - h + 1, width - w + 1
+                correlation = correlations[offset, :rows, :cols]
+                window_sum = _window_sums(integral, h, w)
+                window_sq_sum = _window_sums(sq_integral, h, w)
+                template_sum = self.sums[index]
+                template_sq_sum = self.sq_sums[index]
+
+                scores = {}
+                if "ccoeff" in methods:
+                    template_var = max(template_sq_sum - template_sum * template_sum / n, 0.0)
+                    # 分母 = sqrt(窓内分散 × テンプレート分散)
+                    denominator = window_sum * window_sum
+                    denominator *= -1.0 / n
+                    denominator += window_sq_sum
+                    np.maximum(denominator, 0.0, out=denominator)
+                    denominator *= template_var
+                    np.sqrt(denominator, out=denominator)
+                    # 分子 = Σ I·T - ΣI · mean(T)
+                    ccoeff = window_sum * (-template_sum / n)
+                    ccoeff += correlation
+                    valid = denominator > 1e-6 * max(template_sq_sum, 1.0)
+                    np.divide(ccoeff, denominator, out=ccoeff, where=valid)
+                    ccoeff[~valid] = 0.0
+                    scores["ccoeff"] = np.clip(ccoeff, -1.0, 1.0, out=ccoeff)
+                if "ccorr" in methods or "sqdiff" in methods:
+                    norm = window_sq_sum * template_sq_sum
+                    np.sqrt(norm, out=norm)
+                    valid_norm = norm > 1e-6
+                    if "ccorr" in methods:
+                        ccorr = np.zeros((rows, cols))
+                        np.divide(correlation, norm, out=ccorr, where=valid_norm)
+                        scores["ccorr"] = np.clip(ccorr, 0.0, 1.0, out=ccorr)
+                    if "sqdiff" in methods:
+                        # 距離を類似度に変換（高精度モードと同じ 1 - TM_SQDIFF_NORMED）
+                        sqdiff = correlation * -2.0
+                        sqdiff += window_sq_sum
+                        sqdiff += template_sq_sum
+                        np.divide(sqdiff, norm, out=sqdiff, where=valid_norm)
+                        sqdiff[~valid_norm] = 1.0
+                        np.clip(sqdiff, 0.0, 1.0, out=sqdiff)
+                        scores["sqdiff"] = np.subtract(1.0, sqdiff, out=sqdiff)
+                yield index, scores
+
+    def best_matches(self, gray_image, methods=None):
+        """テンプレートごとの最高スコアと位置を返す（スコアマップはバッチごとに破棄し、全体は保持しない）
+
+        戻り値は {tag_name: (score, (x, y))}。複数手法を指定した場合は
+        高精度モードと同様に手法間の最大値を採用する。
+        """
+        methods = tuple(methods or FFT_SCORE_METHODS)
+        results = {}
+        for index, scores in self._iter_scores(gray_image, methods):
+            best_score, best_loc = 0.0, None
+            if scores is not None:
+                for score_map in scores.values():
+                    y, x = np.unravel_index(np.argmax(score_map), score_map.shape)
+                    if best_loc is None or score_map[y, x] > best_score:
+                        best_score, best_loc = float(score_map[y, x]), (int(x), int(y))
+            results[self.tag_names[index]] = (best_score, best_loc)
+        return results
+
+# FFT一括相関によるテンプレートマッチング
+@traced(tag_argument=2)
+def find_template_in_image_fft(template_path, image, tag_name):
+    """FFT一括相関によるテンプレートマッチング
+
+    最初の呼び出しで全テンプレートのスコアをまとめて計算してフレームコンテキストに保持し、
+    以降のテンプレートはその結果を参照するだけになる。
+    """
+    try:
+        frame = get_frame_context(image)
+        methods = tuple(FFT_SCORE_METHODS)
+        results = frame.engine_results.get(("fft", methods))
+        if results is None:
+            engine = get_template_bank().fft_engine()
+            results = engine.best_matches(frame.gray, methods)
+            frame.engine_results[("fft", methods)] = results
+        
+        score, loc = results.get(tag_name, (0.0, None))
+        entry = get_template_bank().get(template_path, tag_name)
+        if loc is not None and entry is not None:
+            frame.match_locations[tag_name] = (loc[0], loc[1], entry.gray.shape[1], entry.gray.shape[0])
+        return tag_name, score
+        
+    except Exception as e:
+        logger.error("FFTテンプレートマッチングでエラー: %s", e)
+        return tag_name, 0.0
+
+# 1テンプレート分の照合
+def match_template_on_frames(template_path, tag_name, frame, slot_frames):
+    """1テンプレートを照合する（タグ枠があれば枠ごと）
+
+    戻り値は (tag_name, score, slot_results, error)。slot_results は枠ごとの
+    (tag_name, score) のリストで、例外が発生した場合は error に格納して返す。
+    """
+    try:
+        if slot_frames:
+            # タグ枠ごとにテンプレートマッチングを実行
+            slot_results = []
+            for slot_frame in slot_frames:
+                tag_name, slot_score = find_template_in_image_fast(template_path, slot_frame, tag_name)
+                slot_results.append((tag_name, slot_score))
+            return tag_name, max(slot_score for _, slot_score in slot_results), slot_results, None
         
-        return tag_name, max_val
+        tag_name, score = find_template_in_image_fast(template_path, frame, tag_name)
+        return tag_name, score, [], None
         
     except Exception as e:
-        print(f"シンプルテンプレートマッチングでエラー: {e}")
-        return tag_name, 0.0
+        return tag_name, 0.0, [], e
+
+# 並列照合の準備
+def prepare_frames_for_matching(frames):
+    """ワーカー間で共有する遅延計算を事前に済ませる（スレッドごとの重複計算を防ぐ）"""
+    for frame in frames:
+        frame.gray
+        if MATCHING_MODE == "high_quality":
+            frame.processed("high_quality")
+        elif MATCHING_MODE == "pyramid":
+            frame.pyramid("high_quality", PYRAMID_LEVELS)
+
+def get_matching_workers():
+    """並列照合のワーカー数（MATCHING_WORKERS が 0 の場合は CPU コア数）"""
+    return MATCHING_WORKERS if MATCHING_WORKERS > 0 else (os.cpu_count() or 1)
+
+# タグ枠の確定状況（早期終了の判定）
+def _boxes_overlap(box_a, box_b):
+    """2つの矩形 (x, y, w, h) が重なるかどうか"""
+    return box_a[0] < box_b[0] + box_b[2] and box_b[0] < box_a[0] + box_a[2] and \
+           box_a[1] < box_b[1] + box_b[3] and box_b[1] < box_a[1] + box_a[3]
+
+class SlotClaimTracker:
+    """確信度の高い検出で埋まったタグ枠を追跡し、全枠が埋まったかを判定する
+
+    タグ枠を検出した場合は枠ごとに、検出できなかった場合は max_loc の位置（重ならない矩形）ごとに、
+    EARLY_EXIT_SCORE 以上の検出を1タグにつき1枠だけ確定させる。
+    """
+
+    def __init__(self, slot_count):
+        self.slot_count = slot_count
+        self.claims = {}  # タグ枠の番号 -> (tag_name, score)
+        self.boxes = []  # タグ枠なしの場合の確定位置 [(box, tag_name, score), ...]
+
+    def update(self, tag_name, score, slot_results, location=None):
+        """1テンプレート分の照合結果を反映"""
+        if slot_results:
+            best_index = max(range(len(slot_results)), key=lambda i: slot_results[i][1])
+            best_score = slot_results[best_index][1]
+            if best_score >= EARLY_EXIT_SCORE and best_index not in self.claims:
+                self.claims[best_index] = (tag_name, best_score)
+        elif location is not None and score >= EARLY_EXIT_SCORE:
+            if not any(_boxes_overlap(location, box) for box, _, _ in self.boxes):
+                self.boxes.append((location, tag_name, score))
+
+    def all_claimed(self):
+        """全てのタグ枠が確定したかどうか"""
+        return len(self.claims) + len(self.boxes) >= self.slot_count
+
+# テンプレートマッチングの一括実行
+@traced
+def match_templates(template_files, frame, slot_frames, tracker=None):
+    """テンプレートを順に照合し、template_files と同じ順序で結果を返す
+
+    tracker を渡した場合、全てのタグ枠が確定した時点で残りのテンプレートを省略する
+    （戻り値はそこまでの結果のみ）。並列実行時はワーカー数 × OpenCV の内部スレッド数が
+    CPU コア数を超えないように cv2.setNumThreads を調整し、終了後に元の値に戻す。
+    """
+    def finished(result):
+        if tracker is None or result[3] is not None:
+            return False
+        tracker.update(result[0], result[1], result[2], frame.match_locations.get(result[0]))
+        return tracker.all_claimed()
+    
+    results = []
+    workers = min(get_matching_workers(), len(template_files))
+    if not USE_PARALLEL_MATCHING or MATCHING_MODE not in PARALLEL_MATCHING_MODES or workers <= 1:
+        logger.debug("🔄 順次処理でテンプレートマッチングを実行...")
+        for template_path, tag_name in template_files:
+            results.append(match_template_on_frames(template_path, tag_name, frame, slot_frames))
+            if finished(results[-1]):
+                break
+        return results
+    
+    opencv_threads = max(1, (os.cpu_count() or 1) // workers)
+    logger.debug("🔄 並列処理でテンプレートマッチングを実行... (ワーカー: %s, OpenCVスレッド: %s)", workers, opencv_threads)
+    prepare_frames_for_matching(slot_frames or [frame])
+    
+    from concurrent.futures import ThreadPoolExecutor
+    
+    previous_threads = cv2.getNumThreads()
+    cv2.setNumThreads(opencv_threads)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(match_template_on_frames, template_path, tag_name, frame, slot_frames)
+                       for template_path, tag_name in template_files]
+            # 結果は投入順に確認するため、打ち切り位置は実行順序に依存しない
+            for index, future in enumerate(futures):
+                results.append(future.result())
+                if finished(results[-1]):
+                    for pending in futures[index + 1:]:
+                        pending.cancel()
+                    break
+        return results
+    finally:
+        cv2.setNumThreads(previous_threads)
+
+# 段階照合（紛らわしい候補だけ高精度で照合し直す）
+def confusable_partners(tag_name):
+    """見た目の近いタグ（CASCADE_CONFUSABLE_TAGS で同じ組のタグ）"""
+    return [other for pair in CASCADE_CONFUSABLE_TAGS if tag_name in pair for other in pair if other != tag_name]
+
+def select_cascade_candidates(scores, threshold):
+    """1段目のスコア [(tag_name, score), ...] から、高精度で照合し直すタグを選ぶ
+
+    1位が CASCADE_ACCEPT_SCORE 以上で2位との差が十分にあれば確定、1位でも閾値を大きく下回れば
+    棄却とし、どちらでもなければ1位との差が小さい候補（見た目の近いタグは広めの差まで）を返す。
+    照合し直すのは候補どうしの順位だけなので、候補が1位だけなら照合し直さない。
+    """
+    ranked = sorted(scores, key=lambda x: x[1], reverse=True)
+    if not ranked:
+        return []
+    best_tag, best_score = ranked[0]
+    if best_score < threshold - CASCADE_MARGIN:
+        return []
+    partners = [(tag_name, score) for tag_name, score in ranked[1:]
+                if tag_name in confusable_partners(best_tag) and best_score - score < CASCADE_CONFUSABLE_MARGIN]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+    if best_score >= CASCADE_ACCEPT_SCORE and best_score - runner_up >= CASCADE_MARGIN and not partners:
+        return []
+    candidates = [tag_name for tag_name, score in ranked[:CASCADE_MAX_CANDIDATES] if best_score - score < CASCADE_MARGIN]
+    candidates += [tag_name for tag_name, score in partners if tag_name not in candidates]
+    return candidates if len(candidates) > 1 else []
+
+@traced
+def refine_cascade(template_files, match_results, frame, slot_frames, threshold):
+    """段階照合の2段目：紛らわしい (タグ枠, タグ) だけを高精度モードで照合し直す
+
+    match_results は match_templates の結果で、照合し直したスコアで置き換えたものと、
+    照合し直した (タグ枠の番号, タグ名) の集合を返す（タグ枠がない場合の番号は None）。
+    高精度モードのスコアは候補どうしの順位だけに使い、1段目のスコアを高精度モードの順に割り当て直す
+    （タグ枠をまたいで比べるスコアの尺度を混ぜない）。タグ枠がない場合は上位のスコアを比べるため、
+    見た目の近いタグの組だけを照合し直す。
+    """
+    template_paths = {tag_name: template_path for template_path, tag_name in template_files}
+    results = {result[0]: result for result in match_results if result[3] is None}
+    
+    if not slot_frames:
+        selected = sorted((result for result in results.values() if result[1] > threshold),
+                          key=lambda result: result[1], reverse=True)[:TAG_SLOT_COUNT]
+        pairs = []
+        for tag_name, score, _, _ in selected:
+            for partner in confusable_partners(tag_name):
+                if partner in results and score - results[partner][1] < CASCADE_CONFUSABLE_MARGIN and \
+                   not any(tag_name in pair and partner in pair for pair in pairs):
+                    pairs.append((tag_name, partner))
+        swapped = {}
+        for pair in pairs:
+            refined_scores = {tag_name: find_template_in_image_high_quality(template_paths[tag_name], frame, tag_name)[1]
+                              for tag_name in pair}
+            by_refined = sorted(pair, key=lambda tag_name: refined_scores[tag_name], reverse=True)
+            by_score = sorted((results[tag_name][1] for tag_name in pair), reverse=True)
+            swapped.update(zip(by_refined, by_score))
+            logger.debug("🔁 高精度で照合し直し: %s", {tag_name: round(score, 3) for tag_name, score in refined_scores.items()})
+        count("cascade_refined", len(swapped))
+        return [(tag_name, swapped.get(tag_name, score), slot_results, error)
+                for tag_name, score, slot_results, error in match_results], {(None, tag_name) for tag_name in swapped}
+    
+    refined = {}  # (タグ枠の番号, タグ名) → 高精度モードの順に割り当て直した1段目のスコア
+    for slot_index, slot_frame in enumerate(slot_frames):
+        scores = {tag_name: result[2][slot_index][1] for tag_name, result in results.items()}
+        candidates = select_cascade_candidates(scores.items(), threshold)
+        if not candidates:
+            continue
+        refined_scores = {tag_name: find_template_in_image_high_quality(template_paths[tag_name], slot_frame, tag_name)[1]
+                          for tag_name in candidates}
+        by_refined = sorted(candidates, key=lambda tag_name: refined_scores[tag_name], reverse=True)
+        by_score = sorted((scores[tag_name] for tag_name in candidates), reverse=True)
+        refined.update(((slot_index, tag_name), score) for tag_name, score in zip(by_refined, by_score))
+        logger.debug("🔁 高精度で照合し直し: タグ枠 %d %s", slot_index + 1,
+                     {tag_name: (round(scores[tag_name], 3), round(refined_scores[tag_name], 3)) for tag_name in by_refined})
+    count("cascade_refined", len(refined))
+    
+    refined_results = []
+    for tag_name, score, slot_results, error in match_results:
+        if error is None and any(key[1] == tag_name for key in refined):
+            slot_results = [(tag_name, refined.get((slot_index, tag_name), slot_score))
+                            for slot_index, (_, slot_score) in enumerate(slot_results)]
+            score = max(slot_score for _, slot_score in slot_results)
+        refined_results.append((tag_name, score, slot_results, error))
+    return refined_results, set(refined)
 
 # 閾値取得関数（モード選択可能）
 def get_threshold(image, template_path):
-    """閾値を取得（モード選択可能）"""
-    if MATCHING_MODE == "high_quality":
-        return calculate_adaptive_threshold(image, template_path)
+    """閾値を取得（モード選択可能）
+
+    image には画像またはフレームコンテキストを渡せる。
+    """
+    if MATCHING_MODE in ("high_quality", "pyramid"):
+        return calculate_adaptive_threshold(get_frame_context(image), template_path)
     else:
         return 0.75  # 固定閾値
 
-# 画像前処理関数
-def find_template_image(image_path):
-    img = cv2.imread(image_path)
-    img = crop_recruitment_area(img)
 
-    cv2.imwrite("processed_image.png", img)
-    return img  # NumPy配列の形式で返す
+# キャプチャソース（キャプチャ結果は BGR の NumPy 配列で返す）
+class CaptureSource:
+    """キャプチャ元の共通インターフェース
 
+    capture() は BGR の NumPy 配列（取得できない場合は None）を返す。
+    """
 
-# Arknightsウィンドウキャプチャ（改善版）
-def capture_arknights_window():
-    """Arknightsウィンドウを検出してキャプチャ（改善版）"""
-    global screenshot
-    
-    print("🔍 capture_arknights_window() 開始（改善版）")
-    
-    try:
-        print("📸 Arknightsウィンドウを検出中...")
+    name = "base"
+
+    def capture(self):
+        raise NotImplementedError
+
+    def close(self):
+        """リソースを解放（必要なソースのみ）"""
+        pass
+
+class WindowCaptureSource(CaptureSource):
+    """Arknights（エミュレータ）のウィンドウを検出し、クライアント領域をキャプチャ"""
+
+    name = "window"
+
+    @traced
+    def find_window(self):
+        """候補ウィンドウから最適なものを選択（見つからない場合は None）"""
+        import win32gui
         
-        # 方法1: Arknightsウィンドウを直接検出
-        try:
-            import win32gui
-            import win32ui
-            import win32con
-            
-            # Arknightsウィンドウを検索
-            arknights_hwnd = None
-            def enum_windows_callback(hwnd, windows):
-                if win32gui.IsWindowVisible(hwnd):
-                    window_text = win32gui.GetWindowText(hwnd)
-                    if window_text:  # 空のタイトルは除外
-                        # より柔軟な検索パターン
-                        search_patterns = [
-                            'arknights', 'アークナイツ', '明日方舟',  # 完全一致
-                            'ark', 'arknight',  # 部分一致
-                            '明日', '方舟',  # 日本語部分一致
-                            'mobile', 'mob',  # モバイル版
-                            'emulator', 'bluestacks', 'nox', 'ldplayer'  # エミュレータ
-                        ]
-                        
-                        window_text_lower = window_text.lower()
-                        for pattern in search_patterns:
-                            if pattern in window_text_lower:
-                                windows.append((hwnd, window_text))
-                                print(f"🔍 候補ウィンドウ発見: '{window_text}' (パターン: {pattern})")
-                                break
-                return True
-            
-            windows = []
-            win32gui.EnumWindows(enum_windows_callback, windows)
-            
-            if windows:
-                print(f"🔍 検出されたウィンドウ: {windows}")
-                
-                # 最適なウィンドウを選択（サイズと状態を考慮）
-                best_window = None
-                best_score = -1
-                
-                for hwnd, window_title in windows:
-                    try:
-                        rect = win32gui.GetWindowRect(hwnd)
-                        x, y, right, bottom = rect
-                        width = right - x
-                        height = bottom - y
-                        
-                        # ウィンドウの状態をチェック
-                        is_iconic = win32gui.IsIconic(hwnd)
-                        is_minimized = win32gui.IsIconic(hwnd)
-                        
-                        # スコアリング（大きいウィンドウ、非最小化状態を優先）
-                        score = 0
-                        if width >= 800 and height >= 600:  # 最小サイズ要件
-                            score += 10
-                        if width >= 1024 and height >= 768:  # 推奨サイズ
-                            score += 20
-                        if width >= 1920 and height >= 1080:  # フルHD
-                            score += 30
-                        
-                        if not is_iconic and not is_minimized:
-                            score += 50  # 非最小化状態を大幅に加算
-                        
-                        # タイトルの完全性も考慮
-                        if any(exact in window_title.lower() for exact in ['arknights', 'アークナイツ', '明日方舟']):
-                            score += 25
-                        
-                        print(f"📊 ウィンドウ '{window_title}': サイズ={width}x{height}, 最小化={is_iconic}, スコア={score}")
-                        
-                        if score > best_score:
-                            best_score = score
-                            best_window = (hwnd, window_title)
-                            
-                    except Exception as e:
-                        print(f"⚠️ ウィンドウ '{window_title}' の評価でエラー: {e}")
-                        continue
-                
-                if best_window:
-                    arknights_hwnd, window_title = best_window
-                    print(f"✅ 最適なウィンドウを選択: {window_title} (スコア: {best_score})")
-                else:
-                    # フォールバック: 最初のウィンドウを使用
-                    arknights_hwnd, window_title = windows[0]
-                    print(f"⚠️ フォールバック: 最初のウィンドウを使用: {window_title}")
-                
-                # ウィンドウの位置とサイズを取得
-                rect = win32gui.GetWindowRect(arknights_hwnd)
-                x, y, right, bottom = rect
-                width = right - x
-                height = bottom - y
-                
-                print(f"📐 ウィンドウ位置: x={x}, y={y}, width={width}, height={height}")
-                
-                # ウィンドウが最小化されている場合は復元
-                if win32gui.IsIconic(arknights_hwnd):
-                    print("🔄 最小化されたウィンドウを復元中...")
-                    win32gui.ShowWindow(arknights_hwnd, win32con.SW_RESTORE)
-                    time.sleep(0.5)  # 復元完了を待つ
-                    rect = win32gui.GetWindowRect(arknights_hwnd)
+        # Arknightsウィンドウを検索
+        arknights_hwnd = None
+        def enum_windows_callback(hwnd, windows):
+            if win32gui.IsWindowVisible(hwnd):
+                window_text = win32gui.GetWindowText(hwnd)
+                if window_text:  # 空のタイトルは除外
+                    # より柔軟な検索パターン
+                    search_patterns = [
+                        'arknights', 'アークナイツ', '明日方舟',  # 完全一致
+                        'ark', 'arknight',  # 部分一致
+                        '明日', '方舟',  # 日本語部分一致
+                        'mobile', 'mob',  # モバイル版
+                        'emulator', 'bluestacks', 'nox', 'ldplayer'  # エミュレータ
+                    ]
+
+                    window_text_lower = window_text.lower()
+                    for pattern in search_patterns:
+                        if pattern in window_text_lower:
+                            windows.append((hwnd, window_text))
+                            logger.debug("🔍 候補ウィンドウ発見: '%s' (パターン: %s)", window_text, pattern)
+                            break
+            return True
+
+        windows = []
+        win32gui.EnumWindows(enum_windows_callback, windows)
+
+        if windows:
+            logger.debug("🔍 検出されたウィンドウ: %s", windows)
+
+            # 最適なウィンドウを選択（サイズと状態を考慮）
+            best_window = None
+            best_score = -1
+
+            for hwnd, window_title in windows:
+                try:
+                    rect = win32gui.GetWindowRect(hwnd)
                     x, y, right, bottom = rect
                     width = right - x
                     height = bottom - y
-                    print(f"📐 復元後の位置: x={x}, y={y}, width={width}, height={height}")
-                
-                # ウィンドウを前面に表示
-                win32gui.SetForegroundWindow(arknights_hwnd)
-                time.sleep(0.3)  # 前面表示完了を待つ
-                
-                # ウィンドウ領域をキャプチャ
-                try:
-                    # ウィンドウのクライアント領域を取得
-                    client_rect = win32gui.GetClientRect(arknights_hwnd)
-                    client_x, client_y, client_right, client_bottom = client_rect
-                    client_width = client_right - client_x
-                    client_height = client_bottom - client_y
-                    
-                    print(f"📐 クライアント領域: width={client_width}, height={client_height}")
-                    
-                    # クライアント領域が小さすぎる場合は警告
-                    if client_width < 400 or client_height < 300:
-                        print(f"⚠️ クライアント領域が小さすぎます: {client_width}x{client_height}")
-                        print("🔄 全画面キャプチャにフォールバックします")
-                        raise Exception("クライアント領域が小さすぎます")
-                    
-                    # ウィンドウのクライアント領域をキャプチャ
-                    screenshot = capture_window_region(arknights_hwnd, client_rect)
-                    if screenshot:
-                        print(f"✅ ウィンドウキャプチャ完了: {screenshot.size}")
-                        
-                        # キャプチャされた画像の品質チェック
-                        if screenshot.size[0] < 400 or screenshot.size[1] < 300:
-                            print(f"⚠️ キャプチャされた画像が小さすぎます: {screenshot.size}")
-                            print("🔄 全画面キャプチャにフォールバックします")
-                            raise Exception("キャプチャされた画像が小さすぎます")
-                        
-                        start_analysis()
-                        return
-                    else:
-                        print("⚠️ ウィンドウキャプチャが失敗しました")
-                        raise Exception("ウィンドウキャプチャが失敗しました")
-                        
+
+                    # ウィンドウの状態をチェック
+                    is_iconic = win32gui.IsIconic(hwnd)
+                    is_minimized = win32gui.IsIconic(hwnd)
+
+                    # スコアリング（大きいウィンドウ、非最小化状態を優先）
+                    score = 0
+                    if width >= 800 and height >= 600:  # 最小サイズ要件
+                        score += 10
+                    if width >= 1024 and height >= 768:  # 推奨サイズ
+                        score += 20
+                    if width >= 1920 and height >= 1080:  # フルHD
+                        score += 30
+
+                    if not is_iconic and not is_minimized:
+                        score += 50  # 非最小化状態を大幅に加算
+
+                    # タイトルの完全性も考慮
+                    if any(exact in window_title.lower() for exact in ['arknights', 'アークナイツ', '明日方舟']):
+                        score += 25
+
+                    logger.debug("📊 ウィンドウ '%s': サイズ=%sx%s, 最小化=%s, スコア=%s", window_title, width, height, is_iconic, score)
+
+                    if score > best_score:
+                        best_score = score
+                        best_window = (hwnd, window_title)
+
                 except Exception as e:
-                    print(f"⚠️ ウィンドウキャプチャでエラー: {e}")
-                    print("🔄 全画面キャプチャにフォールバックします")
-            
+                    logger.warning("⚠️ ウィンドウ '%s' の評価でエラー: %s", window_title, e)
+                    continue
+
+            if best_window:
+                arknights_hwnd, window_title = best_window
+                logger.info("✅ 最適なウィンドウを選択: %s (スコア: %s)", window_title, best_score)
+            else:
+                # フォールバック: 最初のウィンドウを使用
+                arknights_hwnd, window_title = windows[0]
+                logger.warning("⚠️ フォールバック: 最初のウィンドウを使用: %s", window_title)
+
+        return arknights_hwnd
+
+    @traced
+    def capture(self):
+        try:
+            import win32gui
+            import win32con
         except ImportError:
-            print("⚠️ win32guiが利用できません。全画面キャプチャを使用します")
-        except Exception as e:
-            print(f"⚠️ ウィンドウ検出でエラー: {e}")
-            print("🔄 全画面キャプチャにフォールバックします")
+            logger.warning("⚠️ win32guiが利用できません。全画面キャプチャを使用します")
+            return None
         
-        # 方法2: 全画面キャプチャ（フォールバック）
-        print("📸 全画面キャプチャを実行します...")
-        screenshot = ImageGrab.grab()
-        print(f"✅ 全画面キャプチャ完了: {screenshot.size}")
+        logger.debug("📸 Arknightsウィンドウを検出中...")
+        arknights_hwnd = self.find_window()
+        if arknights_hwnd is None:
+            return None
         
-        # 解析を開始
-        print("🔍 キャプチャ完了、解析を開始します...")
-        start_analysis()
-        print("✅ start_analysis() 完了")
+        # ウィンドウの位置とサイズを取得
+        rect = win32gui.GetWindowRect(arknights_hwnd)
+        x, y, right, bottom = rect
+        width = right - x
+        height = bottom - y
         
-    except Exception as e:
-        print(f"❌ ウィンドウキャプチャでエラー: {e}")
-        import traceback
-        traceback.print_exc()
-        print("🔄 エラーが発生しましたが、全画面キャプチャを試行します")
+        logger.debug("📐 ウィンドウ位置: x=%s, y=%s, width=%s, height=%s", x, y, width, height)
+        
+        # ウィンドウが最小化されている場合は復元
+        if win32gui.IsIconic(arknights_hwnd):
+            logger.debug("🔄 最小化されたウィンドウを復元中...")
+            win32gui.ShowWindow(arknights_hwnd, win32con.SW_RESTORE)
+            time.sleep(0.5)  # 復元完了を待つ
+            rect = win32gui.GetWindowRect(arknights_hwnd)
+            x, y, right, bottom = rect
+            width = right - x
+            height = bottom - y
+            logger.debug("📐 復元後の位置: x=%s, y=%s, width=%s, height=%s", x, y, width, height)
+        
+        # ウィンドウを前面に表示
+        win32gui.SetForegroundWindow(arknights_hwnd)
+        time.sleep(0.3)  # 前面表示完了を待つ
+        
+        # ウィンドウのクライアント領域を取得
+        client_rect = win32gui.GetClientRect(arknights_hwnd)
+        client_x, client_y, client_right, client_bottom = client_rect
+        client_width = client_right - client_x
+        client_height = client_bottom - client_y
+        
+        logger.debug("📐 クライアント領域: width=%s, height=%s", client_width, client_height)
+        
+        # クライアント領域が小さすぎる場合は全画面キャプチャに任せる
+        if client_width < 400 or client_height < 300:
+            logger.warning("⚠️ クライアント領域が小さすぎます: %sx%s", client_width, client_height)
+            return None
         
-        try:
-            # 全画面キャプチャ
-            screenshot = ImageGrab.grab()
-            print(f"✅ 全画面キャプチャ完了: {screenshot.size}")
+        # ウィンドウのクライアント領域をキャプチャ
+        frame = capture_window_region(arknights_hwnd, client_rect)
+        if frame is None:
+            logger.warning("⚠️ ウィンドウキャプチャが失敗しました")
+            return None
+        
+        # キャプチャされた画像の品質チェック
+        if frame.shape[1] < 400 or frame.shape[0] < 300:
+            logger.warning("⚠️ キャプチャされた画像が小さすぎます: %sx%s", frame.shape[1], frame.shape[0])
+            return None
+        
+        logger.info("✅ ウィンドウキャプチャ完了: %sx%s", frame.shape[1], frame.shape[0])
+        return frame
+
+class ScreenCaptureSource(CaptureSource):
+    """全画面キャプチャ（ImageGrab）"""
+
+    name = "screen"
+
+    @traced
+    def capture(self):
+        from PIL import ImageGrab
+        
+        logger.debug("📸 全画面キャプチャを実行します...")
+        frame = image_to_bgr(ImageGrab.grab())
+        logger.info("✅ 全画面キャプチャ完了: %sx%s", frame.shape[1], frame.shape[0])
+        return frame
+
+class FileCaptureSource(CaptureSource):
+    """保存済みの画像ファイル（またはディレクトリ内の画像）を順に再生する"""
+
+    name = "file"
+    IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+    def __init__(self, path, loop=False):
+        if os.path.isdir(path):
+            self.paths = sorted(
+                os.path.join(path, file_name) for file_name in os.listdir(path)
+                if file_name.lower().endswith(self.IMAGE_EXTENSIONS)
+            )
+        else:
+            self.paths = [path]
+        self.loop = loop
+        self.index = 0
+        self.current_path = None
+
+    def __len__(self):
+        return len(self.paths)
+
+    @traced
+    def capture(self):
+        """次の画像を読み込む（最後まで再生した場合は None、loop の場合は先頭に戻る）"""
+        if self.index >= len(self.paths):
+            if not self.loop or not self.paths:
+                return None
+            self.index = 0
+        self.current_path = self.paths[self.index]
+        self.index += 1
+        return read_image(self.current_path)
+
+class SyntheticCaptureSource(CaptureSource):
+    """募集画面を模した合成画像を生成する（ゲームウィンドウなしでの動作確認・計測用）
+
+    背景の上にタグ枠（3個 + 2個）を描き、テンプレートバンクからランダムに選んだ5タグを
+    タグ枠の高さに合わせた縮尺で貼り付ける。縮尺はタグごとに ±scale_jitter の範囲でランダムにずらし、
+    スケール登録の誤差を含む画面にする（登録と同じ式の縮尺だけでは登録の誤りを検出できないため）。
+    直前に貼り付けたタグは last_tags、縮尺のずれ（倍率）は last_jitters に保持する。
+    """
+
+    name = "synthetic"
+    SLOT_LAYOUT = {
+        "x": 0.198,  # 1つ目のタグ枠の左端（幅比）
+        "pitch": 0.149,  # タグ枠の横方向の間隔（幅比）
+        "w": 0.128,  # タグ枠の幅（幅比）
+        "h": 0.065,  # タグ枠の高さ（高さ比）
+        "rows": (0.36, 0.462)  # 1段目・2段目の上端（高さ比）
+    }
+
+    def __init__(self, size=(1280, 720), seed=0, noise=4.0, scale_jitter=0.08):
+        self.size = size
+        self.random = np.random.RandomState(seed)
+        self.noise = noise
+        self.scale_jitter = scale_jitter
+        self.last_tags = []
+        self.last_jitters = []
+
+    @traced
+    def capture(self):
+        width, height = self.size
+        layout = self.SLOT_LAYOUT
+        
+        # 背景（縦方向のグラデーション + ノイズ）
+        gradient = np.linspace(170, 110, height, dtype=np.float32)[:, None, None]
+        frame = np.repeat(np.repeat(gradient, width, axis=1), 3, axis=2)
+        frame += self.random.normal(0, self.noise, frame.shape).astype(np.float32)
+        
+        entries = list(get_template_bank().entries.values())
+        chosen = [entries[i] for i in self.random.choice(len(entries), TAG_SLOT_COUNT, replace=False)]
+        self.last_tags = [entry.tag_name for entry in chosen]
+        self.last_jitters = list(self.random.uniform(1 - self.scale_jitter, 1 + self.scale_jitter, len(chosen)))
+        
+        slot_w = int(width * layout["w"])
+        slot_h = int(height * layout["h"])
+        for slot_index, entry in enumerate(chosen):
+            row, column = divmod(slot_index, 3)
+            x = int(width * (layout["x"] + column * layout["pitch"]))
+            y = int(height * layout["rows"][row])
+            frame[y:y + slot_h, x:x + slot_w] = 49  # タグボタン（暗色）
             
+            # テンプレートを切り出した画面とタグ枠の高さの比で縮尺を決め、ランダムにずらす
+            scale = slot_h / entry.slot_height * self.last_jitters[slot_index]
+            template = cv2.resize(entry.bgr, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            th, tw = min(template.shape[0], slot_h), min(template.shape[1], slot_w)
+            ty, tx = y + (slot_h - th) // 2, x + (slot_w - tw) // 2
+            frame[ty:ty + th, tx:tx + tw] = template[:th, :tw]
+        
+        return np.clip(frame, 0, 255).astype(np.uint8)
+
+def create_capture_source(spec):
+    """指定文字列からキャプチャソースを作成
+
+    "window" / "screen" / "file:<画像またはディレクトリ>" / "synthetic[:<幅>x<高さ>]"
+    """
+    kind, _, argument = spec.partition(":")
+    if kind == "window":
+        return WindowCaptureSource()
+    if kind == "screen":
+        return ScreenCaptureSource()
+    if kind == "file":
+        return FileCaptureSource(argument)
+    if kind == "synthetic":
+        if argument:
+            width, height = (int(value) for value in argument.lower().split("x"))
+            return SyntheticCaptureSource((width, height))
+        return SyntheticCaptureSource()
+    raise ValueError(f"不明なキャプチャソース: {spec}")
+
+# 画像ファイルの読み書き（日本語を含むパスでも動作するようにバイト列経由で扱う）
+def read_image(path):
+    """画像ファイルを BGR 配列として読み込む（失敗時は None）"""
+    try:
+        return cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+    except Exception as e:
+        logger.warning("⚠️ 画像の読み込みに失敗しました: %s (%s)", path, e)
+        return None
+
+def write_image(path, image):
+    """BGR 配列を画像ファイルとして保存"""
+    ok, encoded = cv2.imencode(os.path.splitext(path)[1] or ".png", image)
+    if ok:
+        encoded.tofile(path)
+    return ok
+
+# ウィンドウ → 全画面の順にキャプチャ
+def capture_screenshot():
+    """Arknightsウィンドウをキャプチャし、失敗した場合は全画面をキャプチャする（BGR 配列、失敗時は None）"""
+    frame = None
+    for source in (WindowCaptureSource(), ScreenCaptureSource()):
+        try:
+            frame = source.capture()
+        except Exception as e:
+            logger.warning("⚠️ キャプチャでエラー (%s): %s", source.name, e, exc_info=True)
+        if frame is not None:
+            return frame
+        logger.warning("🔄 全画面キャプチャにフォールバックします")
+    
+    logger.error("❌ キャプチャに失敗しました")
+    # エラーログに記録
+    try:
+        error_log_path = os.path.join(get_script_dir(), "error_log.txt")
+        with open(error_log_path, "a", encoding="utf-8") as error_file:
+            error_file.write(f"{datetime.datetime.now()}: 全画面キャプチャエラー\n")
+    except:
+        logger.error("❌ エラーログの書き込みに失敗しました")
+    return None
+
+# Arknightsウィンドウキャプチャ（改善版）
+def capture_arknights_window():
+    """Arknightsウィンドウを検出してキャプチャし、解析する（改善版）"""
+    global screenshot
+    
+    logger.debug("🔍 capture_arknights_window() 開始（改善版）")
+    
+    with analysis_trace("window"):
+        screenshot = capture_screenshot()
+        if screenshot is not None:
             # 解析を開始
+            logger.debug("🔍 キャプチャ完了、解析を開始します...")
             start_analysis()
-            print("✅ start_analysis() 完了（エラー後の再試行）")
-        except Exception as e2:
-            print(f"❌ 全画面キャプチャでもエラー: {e2}")
-            import traceback
-            traceback.print_exc()
-            # エラーログに記録
-            try:
-                script_dir = os.environ.get('SCRIPT_DIR')
-                if not script_dir:
-                    script_dir = os.path.dirname(os.path.abspath(__file__))
-                error_log_path = os.path.join(script_dir, "error_log.txt")
-                with open(error_log_path, "a", encoding="utf-8") as error_file:
-                    error_file.write(f"{datetime.datetime.now()}: 全画面キャプチャエラー - {e2}\n")
-                    error_file.write(f"詳細: {traceback.format_exc()}\n")
-            except:
-                print("❌ エラーログの書き込みに失敗しました")
-    
-    print("🔍 capture_arknights_window() 終了")
+            logger.debug("✅ start_analysis() 完了")
+    
+    logger.debug("🔍 capture_arknights_window() 終了")
+
+# キャプチャソースを順に解析（再生・合成画像用）
+def run_capture_source(source, max_frames=None):
+    """ソースの画像を順に解析し、スループットを表示する"""
+    global screenshot
+    
+    frame_count = 0
+    start_time = time.time()
+    while max_frames is None or frame_count < max_frames:
+        trace_scope = analysis_trace(source.name)
+        with trace_scope:
+            screenshot = source.capture()
+            if screenshot is None:
+                trace_scope.discard()  # 再生の終端（解析していないため記録しない）
+                break
+            frame_count += 1
+            start_analysis()
+    elapsed = time.time() - start_time
+    
+    if frame_count:
+        logger.info("📊 %s フレームを %.2f秒で解析しました (%.2f フレーム/秒)", frame_count, elapsed, frame_count / elapsed)
+    source.close()
+
+@traced
+def bgrx_buffer_to_bgr(buffer, width, height):
+    """ビットマップ（BGRX）のバッファを np.frombuffer でそのまま参照し、X を落とすだけの1回の変換で BGR にする"""
+    bgrx = np.frombuffer(buffer, dtype=np.uint8).reshape(height, width, 4)
+    return cv2.cvtColor(bgrx, cv2.COLOR_BGRA2BGR)
 
 def capture_window_region(hwnd, rect):
-    """指定されたウィンドウの特定領域をキャプチャ"""
+    """指定されたウィンドウの特定領域をキャプチャ（BGR の NumPy 配列を返す）"""
     try:
         import win32gui
         import win32ui
@@ -868,14 +2894,9 @@ def capture_window_region(hwnd, rect):
         result = saveDC.BitBlt((0, 0), (width, height), mfcDC, (x, y), win32con.SRCCOPY)
         
         if result:
-            # ビットマップをPIL Imageに変換
             bmpinfo = saveBitMap.GetInfo()
             bmpstr = saveBitMap.GetBitmapBits(True)
-            img = Image.frombuffer(
-                'RGB',
-                (bmpinfo['bmWidth'], bmpinfo['bmHeight']),
-                bmpstr, 'raw', 'BGRX', 0, 1
-            )
+            img = bgrx_buffer_to_bgr(bmpstr, bmpinfo['bmWidth'], bmpinfo['bmHeight'])
             
             # リソースを解放
             win32gui.DeleteObject(saveBitMap.GetHandle())
@@ -885,319 +2906,850 @@ def capture_window_region(hwnd, rect):
             
             return img
         else:
-            print("⚠️ ビットマップのコピーに失敗しました")
+            logger.warning("⚠️ ビットマップのコピーに失敗しました")
             return None
             
     except Exception as e:
-        print(f"❌ ウィンドウ領域キャプチャでエラー: {e}")
+        logger.error("❌ ウィンドウ領域キャプチャでエラー: %s", e)
         return None
 
 # 手動領域選択機能（無効化）
 def capture_screen_area():
     """手動で画面の領域を選択してキャプチャ（無効化）"""
-    print("手動領域選択は無効化されています")
-    print("ウィンドウ指定によるキャプチャを使用してください")
+    logger.warning("手動領域選択は無効化されています")
+    logger.info("ウィンドウ指定によるキャプチャを使用してください")
     
     # 代わりにウィンドウキャプチャを試行
     capture_arknights_window()
 
+# 解析結果（タグ名だけの report.txt に加え、スコア・位置・閾値・処理時間を report.json に書き出す）
+REPORT_JSON_FILE = "report.json"
+RESULT_FORMAT_VERSION = 1  # report.json の形式のバージョン（項目の意味を変えたときに上げる）
+RESULT_CANDIDATE_COUNT = 3  # タグ枠ごとに記録する候補数（1位と2位の差から再解析の要否を判断できるように）
+
+class AnalysisResult:
+    """1回の解析結果
+
+    matched_tags はタグリストと照合済みのタグ名、text は report.txt に書き出すテキスト。
+    detections は検出したタグごとの {"tag", "slot", "box", "score", "threshold", "engine"}
+    （box は画面上の (x, y, w, h)、タグ枠なしで位置が記録されていない場合は None）。
+    slots はタグ枠ごとの {"slot", "box", "tag", "score", "candidates"}、timings は工程ごとの処理時間（ミリ秒）。
+    """
+
+    def __init__(self, matched_tags=None, text="", detections=None, slots=None, threshold=None, engine=None,
+                 image_size=None, size_status=None, image_hash=None, fingerprint=None, skipped_templates=0,
+                 timings=None, error=None):
+        self.matched_tags = matched_tags or []
+        self.text = text
+        self.detections = detections or []
+        self.slots = slots or []
+        self.threshold = threshold
+        self.engine = engine or MATCHING_MODE
+        self.image_size = image_size  # (幅, 高さ)
+        self.size_status = size_status
+        self.image_hash = image_hash  # キャプチャ画像の内容のハッシュ（同じ画面の再解析を省略する場合のキー）
+        self.fingerprint = fingerprint  # tag_img のフィンガープリント
+        self.skipped_templates = skipped_templates
+        self.timings = timings or {}
+        self.error = error
+        self.created = datetime.datetime.now().isoformat(timespec="milliseconds")
+
+    def to_dict(self):
+        """JSON に書き出す形式に変換"""
+        return {
+            "version": RESULT_FORMAT_VERSION,
+            "created": self.created,
+            "engine": self.engine,
+            "threshold": None if self.threshold is None else round(float(self.threshold), 4),
+            "image": {
+                "width": self.image_size[0] if self.image_size else None,
+                "height": self.image_size[1] if self.image_size else None,
+                "size_status": self.size_status,
+                "hash": self.image_hash,
+            },
+            "fingerprint": self.fingerprint,
+            "tags": [
+                dict(detection, box=list(detection["box"]) if detection["box"] else None,
+                     score=round(detection["score"], 4), threshold=round(detection["threshold"], 4))
+                for detection in self.detections
+            ],
+            "matched_tags": self.matched_tags,
+            "slots": [
+                dict(slot, box=list(slot["box"]), score=round(slot["score"], 4),
+                     candidates=[[tag_name, round(score, 4)] for tag_name, score in slot["candidates"]])
+                for slot in self.slots
+            ],
+            "skipped_templates": self.skipped_templates,
+            "timings_ms": {stage: round(elapsed, 3) for stage, elapsed in self.timings.items()},
+            "error": self.error,
+        }
+
+    def write(self, path):
+        """一時ファイルに書き出してから置き換える（読み込み側が書きかけの JSON を読まないように）"""
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as result_file:
+            json.dump(self.to_dict(), result_file, ensure_ascii=False, indent=2)
+        os.replace(temp_path, path)
+
+# 画像の保存（report.png などは結果の公開後にバックグラウンドで書き出す）
+ARTIFACT_POLICY = os.environ.get("TAG_ANALYSIS_ARTIFACTS", "full")  # none / thumbnail（縮小した JPEG）/ full（原寸の PNG）
+ARTIFACT_QUEUE_SIZE = 2  # 書き出し待ちの画像数の上限（超えた場合は古いものを破棄）
+ARTIFACT_THUMBNAIL_WIDTH = 640  # サムネイルの幅（これより小さい画像は縮小しない）
+ARTIFACT_THUMBNAIL_QUALITY = 80  # サムネイルの JPEG 品質
+
+class ArtifactWriter:
+    """画像のエンコードと保存を専用スレッドで行う
+
+    キューが一杯の場合は最も古い書き出し待ちを破棄する（解析側を待たせない）。
+    ファイルは一時ファイルに書き出してから置き換える。未保存の画像は終了時に書き出す。
+    """
+
+    def __init__(self, queue_size=ARTIFACT_QUEUE_SIZE):
+        import queue
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._run, name="artifact-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, path, image):
+        """保存を予約（image は保存が終わるまで書き換えないこと）"""
+        import queue
+        while True:
+            try:
+                self.queue.put_nowait((path, image))
+                return
+            except queue.Full:
+                try:
+                    dropped_path, _ = self.queue.get_nowait()
+                    self.queue.task_done()
+                    logger.debug("🖼️ 書き出し待ちの画像を破棄しました: %s", dropped_path)
+                except queue.Empty:
+                    pass
+
+    def flush(self):
+        """予約済みの画像を全て書き出すまで待つ"""
+        self.queue.join()
+
+    def _run(self):
+        while True:
+            path, image = self.queue.get()
+            try:
+                temp_path = path + ".tmp"
+                if os.path.splitext(path)[1].lower() in (".jpg", ".jpeg"):
+                    ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, ARTIFACT_THUMBNAIL_QUALITY])
+                else:
+                    ok, encoded = cv2.imencode(os.path.splitext(path)[1] or ".png", image)
+                if ok:
+                    encoded.tofile(temp_path)
+                    os.replace(temp_path, path)
+                else:
+                    logger.warning("⚠️ 画像のエンコードに失敗しました: %s", path)
+            except Exception as e:
+                logger.warning("⚠️ 画像の保存に失敗しました: %s (%s)", path, e)
+            finally:
+                self.queue.task_done()
+
+_artifact_writer = None
+
+def get_artifact_writer():
+    """画像の書き出しスレッドを取得（初回のみ起動し、終了時に残りを書き出す）"""
+    global _artifact_writer
+    if _artifact_writer is None:
+        _artifact_writer = ArtifactWriter()
+        atexit.register(flush_artifacts)
+    return _artifact_writer
+
+def flush_artifacts():
+    """書き出し待ちの画像を保存し終えるまで待つ（終了時に自動で呼ばれる）"""
+    if _artifact_writer is not None:
+        _artifact_writer.flush()
+
+def save_artifact(script_dir, base_name, image, policy=None):
+    """ポリシーに従って画像の保存を予約し、保存先のパスを返す（保存しない場合は None）"""
+    policy = policy or ARTIFACT_POLICY
+    if policy == "none" or image is None:
+        return None
+    if policy == "thumbnail":
+        height, width = image.shape[:2]
+        if width > ARTIFACT_THUMBNAIL_WIDTH:
+            scale = ARTIFACT_THUMBNAIL_WIDTH / width
+            image = cv2.resize(image, (ARTIFACT_THUMBNAIL_WIDTH, max(1, int(round(height * scale)))),
+                               interpolation=cv2.INTER_AREA)
+        path = os.path.join(script_dir, base_name + ".jpg")
+    else:
+        path = os.path.join(script_dir, base_name + ".png")
+    get_artifact_writer().submit(path, image)
+    return path
+
+def image_content_hash(image):
+    """画像の内容（サイズ・画素）のハッシュ"""
+    digest = hashlib.sha1(f"{image.shape}".encode("ascii"))
+    digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
 # テキストレポートと画像の保存
-def save_results(tags, text, df=None):
-    """結果をファイルに保存"""
+@traced
+def save_results(result):
+    """結果をファイルに保存
+
+    report.txt・report.json を先に書き出して結果を公開し、report.png（ARTIFACT_POLICY に従う）は
+    バックグラウンドで保存する（キャプチャから結果までの時間が PNG の圧縮に左右されないように）。
+    """
     try:
         # スクリプトのディレクトリを取得（環境変数から優先）
         script_dir = os.environ.get('SCRIPT_DIR')
         if not script_dir:
             script_dir = os.path.dirname(os.path.abspath(__file__))
         
-        print(f"スクリプトディレクトリ: {script_dir}")
+        logger.debug("スクリプトディレクトリ: %s", script_dir)
+        started = time.perf_counter()
         
         # テキストレポートを保存（絶対パス）
         report_path = os.path.join(script_dir, "report.txt")
         with open(report_path, "w", encoding="utf-8") as report_file:
-            report_file.write(text)
+            report_file.write(result.text)
         
-        # 画像ファイルに保存（絶対パス）
-        if screenshot:
-            image_path = os.path.join(script_dir, "report.png")
-            screenshot.save(image_path)
+        # 構造化された結果を保存
+        result.timings["writing"] = (time.perf_counter() - started) * 1000
+        result.write(os.path.join(script_dir, REPORT_JSON_FILE))
         
-        print(f"結果を保存しました: {report_path}")
+        logger.info("結果を保存しました: %s", report_path)
+        
+        # 画像ファイルは結果の公開後に保存（キャプチャ画像は解析後に書き換えないため、そのまま渡す）
+        if screenshot is not None:
+            save_artifact(script_dir, "report", image_to_bgr(screenshot))
         
     except Exception as e:
-        print(f"結果の保存でエラー: {e}")
+        logger.error("結果の保存でエラー: %s", e)
         error_log_path = os.path.join(script_dir, "error_log.txt")
         try:
             with open(error_log_path, "a", encoding="utf-8") as error_file:
                 error_file.write(f"{datetime.datetime.now()}: 結果保存エラー - {e}\n")
         except:
-            print("エラーログの書き込みに失敗しました")
+            logger.error("エラーログの書き込みに失敗しました")
+
+# デバッグ用の設定
+SAVE_PROCESSED_IMAGE = False  # 解析対象の画像を processed_image.png として保存する
+
+# キャプチャ画像を照合用の配列に変換
+@traced
+def image_to_bgr(image):
+    """キャプチャ画像（PIL Image または BGR の NumPy 配列）を照合用の BGR 配列に変換
+
+    PIL の raw エンコーダで BGR のバイト列を直接作り、np.frombuffer でコピーせずに参照する。
+    戻り値は読み取り専用の配列（照合処理は入力画像を書き換えない）。
+    """
+    if isinstance(image, np.ndarray):
+        return image
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    width, height = image.size
+    return np.frombuffer(image.tobytes("raw", "BGR"), dtype=np.uint8).reshape(height, width, 3)
 
 # OCR解析処理（最適化版）
+@traced
 def analyze_image():
+    """screenshot を解析し、AnalysisResult を返す"""
     global screenshot
     if screenshot is None:
-        print("キャプチャされた画像がありません。")
-        return [], ""
+        logger.warning("キャプチャされた画像がありません。")
+        return AnalysisResult(error="キャプチャされた画像がありません")
     
     start_time = time.time()
-    print("高速テンプレートマッチングによる解析を開始します")
+    timings = {}  # 工程ごとの処理時間（ミリ秒）
+    checkpoint = time.perf_counter()
+    
+    def end_stage(stage):
+        nonlocal checkpoint
+        now = time.perf_counter()
+        timings[stage] = (now - checkpoint) * 1000
+        checkpoint = now
+    
+    logger.debug("高速テンプレートマッチングによる解析を開始します")
     
-    # 処理済み画像を作成
     script_dir = os.environ.get('SCRIPT_DIR')
     if not script_dir:
         script_dir = os.path.dirname(os.path.abspath(__file__))
     
-    processed_img_path = os.path.join(script_dir, "processed_image.png")
-    
-    if screenshot:
-        screenshot.save(processed_img_path)
-        print(f"処理済み画像を保存しました: {processed_img_path}")
+    # キャプチャ画像をメモリ上で BGR 配列に変換（PNG への保存・読み込みは行わない）
+    try:
+        captured_img = image_to_bgr(screenshot)
+    except Exception as e:
+        logger.error("画像の変換に失敗しました: %s", e)
+        return AnalysisResult(error=f"画像の変換に失敗しました: {e}")
+    end_stage("conversion")
     
-    # 画像を読み込み
-    captured_img = cv2.imread(processed_img_path)
-    if captured_img is None:
-        print("画像の読み込みに失敗しました")
-        return [], ""
+    if SAVE_PROCESSED_IMAGE:
+        # デバッグ用に解析対象の画像を保存
+        processed_img_path = save_artifact(script_dir, "processed_image", captured_img, policy="full")
+        logger.debug("処理済み画像の保存を予約しました: %s", processed_img_path)
     
     # ウィンドウサイズチェック
-    print("🔍 ウィンドウサイズをチェック中...")
+    logger.debug("🔍 ウィンドウサイズをチェック中...")
     is_appropriate, size_status = check_window_size(captured_img)
     
+    # フレームコンテキストを作成（グレースケール・前処理・品質指標を全テンプレートで共有）
+    # 照合対象は募集条件の ROI だけにする（NumPy のビューのため複製しない）
+    roi_image, roi_offset = crop_recruitment_area(captured_img)
+    frame = FrameContext(roi_image, offset=roi_offset, window_shape=captured_img.shape)
+    
     if not is_appropriate:
-        print("⚠️  警告: ウィンドウサイズが小さすぎるため、パターンマッチングの精度が低下する可能性があります")
-        print("   推奨: アークナイツのウィンドウサイズを800x600以上に設定してください")
+        logger.debug("⚠️  警告: ウィンドウサイズが小さすぎるため、パターンマッチングの精度が低下する可能性があります")
+        logger.debug("   推奨: アークナイツのウィンドウサイズを800x600以上に設定してください")
     elif size_status == "medium":
-        print("📱 注意: より良い結果を得るために、ウィンドウサイズを1024x768以上に設定することを推奨します")
-    
-    # テンプレートファイルの定義（高頻度順）
-    template_files = []
+        logger.debug("📱 注意: より良い結果を得るために、ウィンドウサイズを1024x768以上に設定することを推奨します")
     
-    print("🔍 テンプレートファイルの照合を開始...")
+    logger.debug("🔍 テンプレートファイルの照合を開始...")
     
     # 利用可能なファイル名を表示
     tag_img_dir = os.path.join(script_dir, "tag_img")
     available_files = os.listdir(tag_img_dir)
-    print(f"📁 利用可能なファイル: {len(available_files)} 個")
+    logger.debug("📁 利用可能なファイル: %s 個", len(available_files))
     for i, file_name in enumerate(available_files[:10]):  # 最初の10個を表示
-        print(f"  {i+1}. {file_name}")
+        logger.debug("  %s. %s", i + 1, file_name)
     if len(available_files) > 10:
-        print(f"  ... 他 {len(available_files) - 10} 個")
-    
-    # 手動でファイル名とタグ名の対応を定義
-    manual_mapping = {
-        "zenei.png": "前衛タイプ",
-        "jyusou.png": "重装タイプ", 
-        "hojyo.png": "補助タイプ",
-        "sogeki.png": "狙撃タイプ",
-        "senpou.png": "先鋒タイプ",
-        "iryo.png": "医療タイプ",
-        "jyutushi.png": "術師タイプ",
-        "enkyori.png": "遠距離",
-        "kinkyori.png": "近距離",
-        "cost.png": "COST回復",
-        "bougyo.png": "防御",
-        "shoki.png": "初期",
-        "karyoku.png": "火力",
-        "seizon.png": "生存",
-        "hani.png": "範囲攻撃",
-        "gensoku.png": "減速",
-        "kyousei.png": "強制移動",
-        "kensei.png": "牽制",
-        "shoukan.png": "召喚",
-        "kousoku.png": "高速再配置",
-        "robot.png": "ロボット",
-        "elite.png": "エリート",
-        "tokusyu.png": "特殊タイプ",
-        "chiryou.png": "治療",
-        "shien.png": "支援",
-        "bakuhatsu.png": "爆発力",
-        "jyakuka.png": "弱化"
-    }
-    
-    print("🔍 手動マッピングを使用してテンプレートを検索...")
-    
-    # 手動マッピングを使用してテンプレートを追加
-    for file_name, tag_name in manual_mapping.items():
-        file_path = os.path.join(tag_img_dir, file_name)
-        if os.path.exists(file_path):
-            template_files.append((file_path, tag_name))
-            print(f"✅ マッピング追加: '{file_name}' -> '{tag_name}'")
-        else:
-            print(f"❌ ファイル不存在: {file_path}")
+        logger.debug("  ... 他 %s 個", len(available_files) - 10)
     
-    print(f"🔍 照合完了: {len(template_files)} 個のテンプレートが見つかりました")
+    # テンプレートバンクから参照（読み込みはプロセス内で一度だけ）
+    template_bank = get_template_bank()
+    template_files = order_templates_by_frequency(template_bank.template_files)
     
     # テンプレートファイルが見つからない場合のフォールバック
     if not template_files:
-        print("⚠️ テンプレートファイルが見つからないため、デフォルトリストを使用します")
-        template_files = [
-            ("tag_img/zenei.png", "前衛タイプ"),
-            ("tag_img/jyusou.png", "重装タイプ"),
-            ("tag_img/hojyo.png", "補助タイプ"),
-            ("tag_img/sogeki.png", "狙撃タイプ"),
-            ("tag_img/senpou.png", "先鋒タイプ"),
-            ("tag_img/iryo.png", "医療タイプ"),
-            ("tag_img/jyutushi.png", "術師タイプ"),
-            ("tag_img/enkyori.png", "遠距離"),
-            ("tag_img/kinkyori.png", "近距離"),
-            ("tag_img/cost.png", "COST回復"),
-            ("tag_img/bougyo.png", "防御"),
-            ("tag_img/shoki.png", "初期"),
-            ("tag_img/karyoku.png", "火力"),
-            ("tag_img/seizon.png", "生存"),
-            ("tag_img/hani.png", "範囲攻撃"),
-            ("tag_img/gensoku.png", "減速"),
-            ("tag_img/kyousei.png", "強制移動"),
-            ("tag_img/kensei.png", "牽制"),
-            ("tag_img/shoukan.png", "召喚"),
-            ("tag_img/kousoku.png", "高速再配置"),
-            ("tag_img/robot.png", "ロボット"),
-            ("tag_img/elite.png", "エリート"),
-            ("tag_img/tokusyu.png", "特殊タイプ")
-        ]
-        print(f"🔄 フォールバック: {len(template_files)} 個のテンプレートを設定")
+        logger.warning("⚠️ テンプレートファイルが見つからないため、デフォルトリストを使用します")
+        template_files = list(DEFAULT_TEMPLATE_FILES)
+        logger.info("🔄 フォールバック: %s 個のテンプレートを設定", len(template_files))
+    
+    logger.debug("処理対象テンプレート数: %s", len(template_files))
+    
+    # 小さいウィンドウ対応の閾値を設定
+    if size_status == "small":
+        # 小さいウィンドウの場合は閾値を下げる
+        threshold = MATCHING_THRESHOLD * SMALL_WINDOW_THRESHOLD_FACTOR
+        logger.debug("小さいウィンドウ対応: 閾値を %.3f に調整", threshold)
+    elif size_status == "medium":
+        # 中程度のウィンドウの場合は閾値を少し下げる
+        threshold = MATCHING_THRESHOLD * MEDIUM_WINDOW_THRESHOLD_FACTOR
+        logger.debug("中程度ウィンドウ対応: 閾値を %.3f に調整", threshold)
+    else:
+        # 適切なサイズの場合は標準閾値
+        threshold = MATCHING_THRESHOLD
+        logger.debug("標準閾値: %.3f", threshold)
+    
+    # タグ枠を検出（見つかった場合は枠の切り抜きだけを照合）
+    slots = detect_tag_slots(captured_img) if USE_SLOT_DETECTION else []
+    if slots:
+        logger.debug("🔍 タグ枠を検出: %s 個 %s", len(slots), slots)
+        slot_frames = []
+        for slot in slots:
+            slot_image, slot_offset = crop_tag_slot(captured_img, slot)
+            slot_frames.append(FrameContext(slot_image, offset=slot_offset, slot=slot, window_shape=captured_img.shape))
+    else:
+        logger.debug("🔍 タグ枠が見つからないため、画像全体を照合します")
+        slot_frames = []
+    slot_scores = [[] for _ in slot_frames]
+    end_stage("slot_detection")
+    
+    # スケール登録（タグ枠をアンカーに縮尺を1つに決め、全タグ枠で共有）
+    if USE_SCALE_REGISTRATION:
+        frame.registration = register_frame(captured_img, slots)
+        for slot_frame in slot_frames:
+            slot_frame.registration = frame.registration
+        logger.debug("📐 スケール登録: タグ枠の高さ %.1fpx (基準: %s, 位置: %s)",
+                     frame.registration["slot_height"], frame.registration["source"], frame.registration["offset"])
     
-    print(f"処理対象テンプレート数: {len(template_files)}")
+    # キャリブレーション（前回の最適スケール・回転の近傍から照合）
+    calibration_store = None
+    if USE_CALIBRATION_CACHE and MATCHING_MODE == "high_quality":
+        calibration_store = get_calibration_store()
+        frame.calibration = calibration_store.section(captured_img.shape, MATCHING_MODE)
+        for slot_frame in slot_frames:
+            slot_frame.calibration = frame.calibration
+    end_stage("registration")
     
-    # 並列処理でテンプレートマッチング（修正版）
+    if MATCHING_MODE == "high_quality" and HIGH_QUALITY_BACKEND == "process":
+        # 全テンプレート×全タグ枠を (テンプレート, スケール) 単位でプロセスプールに分散
+        get_high_quality_process_backend().score_frames(slot_frames or [frame])
+    
+    if MATCHING_MODE == "eigen" and slot_frames:
+        # 全タグ枠を1回の行列積でまとめて分類
+        get_eigen_classifier().classify_frames(slot_frames)
+    
+    # 並列処理でテンプレートマッチング
     template_scores = []
     
-    print("🔍 テンプレートマッチングを開始...")
+    logger.debug("🔍 テンプレートマッチングを開始...")
     
     try:
-        # 並列処理を無効化し、順次処理に変更
-        print("🔄 順次処理でテンプレートマッチングを実行...")
-        
-        # 全てのテンプレートファイルを処理してスコアを取得
-        print(f"🔍 全{len(template_files)}個のテンプレートを処理中...")
-        
-        for i, (template_path, tag_name) in enumerate(template_files):
-            print(f"🔍 処理中 ({i+1}/{len(template_files)}): {tag_name}")
+        # 全てのテンプレートファイルを処理してスコアを取得（結果は template_files の順序）
+        logger.debug("🔍 全%s個のテンプレートを処理中...", len(template_files))
+        tracker = SlotClaimTracker(len(slot_frames) or TAG_SLOT_COUNT) if USE_EARLY_EXIT else None
+        match_results = match_templates(template_files, frame, slot_frames, tracker)
+        
+        global last_skipped_templates
+        last_skipped_templates = len(template_files) - len(match_results)
+        count("templates_matched", len(match_results))
+        count("templates_skipped", last_skipped_templates)
+        if last_skipped_templates:
+            logger.debug("⏩ 全タグ枠が確定したため %s 個のテンプレートを省略しました", last_skipped_templates)
+        
+        refined = set()
+        if MATCHING_MODE == "cascade":
+            # 紛らわしい候補だけを高精度モードで照合し直す
+            match_results, refined = refine_cascade(template_files, match_results, frame, slot_frames, threshold)
+            logger.debug("🔁 段階照合: %s 件を高精度で照合し直しました", len(refined))
+        
+        for i, (tag_name, score, slot_results, error) in enumerate(match_results):
+            logger.debug("🔍 処理結果 (%d/%d): %s", i + 1, len(template_files), tag_name)
             
-            try:
-                # テンプレートマッチングを実行
-                tag_name, score = find_template_in_image_fast(template_path, captured_img, tag_name)
-                
-                # 小さいウィンドウ対応の閾値を設定
-                if size_status == "small":
-                    # 小さいウィンドウの場合は閾値を下げる
-                    threshold = MATCHING_THRESHOLD * 0.7  # 0.3 * 0.7 = 0.21
-                    print(f"小さいウィンドウ対応: 閾値を {threshold:.3f} に調整")
-                elif size_status == "medium":
-                    # 中程度のウィンドウの場合は閾値を少し下げる
-                    threshold = MATCHING_THRESHOLD * 0.85  # 0.3 * 0.85 = 0.255
-                    print(f"中程度ウィンドウ対応: 閾値を {threshold:.3f} に調整")
-                else:
-                    # 適切なサイズの場合は標準閾値
-                    threshold = MATCHING_THRESHOLD
-                    print(f"標準閾値: {threshold:.3f}")
-                
-                if score > threshold:  # 調整された閾値を使用
-                    template_scores.append((tag_name, score))
-                    print(f"✅ タグ検出: {tag_name} (スコア: {score:.3f}, 閾値: {threshold:.3f})")
-                else:
-                    print(f"❌ 閾値未満: {tag_name} (スコア: {score:.3f}, 閾値: {threshold:.3f})")
-                    
-            except Exception as e:
-                print(f"❌ テンプレート処理エラー {tag_name}: {e}")
+            if error is not None:
+                logger.warning("❌ テンプレート処理エラー %s: %s", tag_name, error)
                 continue
+            
+            # タグ枠ごとのスコアを記録
+            for slot_index, slot_result in enumerate(slot_results):
+                slot_scores[slot_index].append(slot_result)
+            
+            if score > threshold:  # 調整された閾値を使用
+                template_scores.append((tag_name, score))
+                logger.debug("✅ タグ検出: %s (スコア: %.3f, 閾値: %.3f)", tag_name, score, threshold)
+            else:
+                logger.debug("❌ 閾値未満: %s (スコア: %.3f, 閾値: %.3f)", tag_name, score, threshold)
         
-        print(f"🔍 全テンプレート処理完了: {len(template_scores)}個のタグが検出されました")
+        logger.debug("🔍 全テンプレート処理完了: %s個のタグが検出されました", len(template_scores))
                     
     except Exception as e:
-        print(f"❌ テンプレートマッチングでエラーが発生: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ テンプレートマッチングでエラーが発生: %s", e)
         # エラーが発生した場合は空の結果を返す
         template_scores = []
+        refined = set()
+    end_stage("matching")
     
-    # スコアでソート（高い順）
-    template_scores.sort(key=lambda x: x[1], reverse=True)
-    print(f"スコア順ソート結果: {template_scores}")
-    
-    # 上位5個のタグを選択（スコアベース）
-    limited_tags = [tag for tag, score in template_scores[:5]]
-    limited_text = "\n".join(limited_tags)
-    
-    print(f"制限後のタグ（上位5個、スコアベース）: {limited_tags}")
-    print(f"制限後のテキスト: {limited_text}")
+    global last_slot_matches, last_template_scores
+    last_template_scores = sorted(template_scores, key=lambda x: x[1], reverse=True)
+    if slot_frames:
+        # タグ枠ごとに割り当て（画面上の並び順を維持）
+        last_slot_matches = assign_tags_to_slots(slots, slot_scores, threshold)
+        for match in last_slot_matches:
+            logger.debug("🔲 タグ枠 %d %s: %s (スコア: %.3f)", match["slot"] + 1, match["box"], match["tag"], match["score"])
+        
+        limited_tags = [match["tag"] for match in last_slot_matches if match["tag"]]
+        limited_text = "\n".join(limited_tags)
+        detections = [
+            {"tag": match["tag"], "slot": match["slot"], "box": match["box"], "score": match["score"], "threshold": threshold,
+             "engine": "high_quality" if (match["slot"], match["tag"]) in refined else MATCHING_MODE}
+            for match in last_slot_matches if match["tag"]
+        ]
+        slot_results = [
+            dict(match, candidates=sorted(scores, key=lambda x: x[1], reverse=True)[:RESULT_CANDIDATE_COUNT])
+            for match, scores in zip(last_slot_matches, slot_scores)
+        ]
+        
+        logger.debug("制限後のタグ（タグ枠の並び順）: %s", limited_tags)
+        logger.debug("制限後のテキスト: %s", limited_text)
+        
+        # タグリストとの照合（画面上の並び順を維持）
+        matched_tags = [tag for tag in limited_tags if tag in tags]
+        logger.info("マッチしたタグ: %s", matched_tags)
+    else:
+        last_slot_matches = []
+        
+        # スコアでソート（高い順）
+        template_scores.sort(key=lambda x: x[1], reverse=True)
+        logger.debug("スコア順ソート結果: %s", template_scores)
+        
+        # 上位5個のタグを選択（スコアベース）
+        limited_tags = [tag for tag, score in template_scores[:5]]
+        limited_text = "\n".join(limited_tags)
+        detections = []
+        for tag_name, score in template_scores[:5]:
+            box = frame.match_locations.get(tag_name)
+            if box is not None:
+                box = (box[0] + frame.offset[0], box[1] + frame.offset[1], box[2], box[3])  # ROI 内の位置を画面上の位置に変換
+            detections.append({"tag": tag_name, "slot": None, "box": box, "score": score, "threshold": threshold,
+                               "engine": "high_quality" if (None, tag_name) in refined else MATCHING_MODE})
+        slot_results = []
+        
+        logger.debug("制限後のタグ（上位5個、スコアベース）: %s", limited_tags)
+        logger.debug("制限後のテキスト: %s", limited_text)
+        
+        # タグリストとの照合
+        matched_tags = [tag for tag in tags if tag in limited_text]
+        logger.info("マッチしたタグ: %s", matched_tags)
     
-    # タグリストとの照合
-    matched_tags = [tag for tag in tags if tag in limited_text]
-    print(f"マッチしたタグ: {matched_tags}")
+    if calibration_store is not None:
+        calibration_store.save()
+    end_stage("assignment")
     
     end_time = time.time()
     processing_time = end_time - start_time
-    print(f"処理時間: {processing_time:.2f}秒")
+    logger.info("処理時間: %.2f秒", processing_time)
+    timings["total"] = sum(timings.values())
     
-    return matched_tags, limited_text
+    return AnalysisResult(
+        matched_tags=matched_tags,
+        text=limited_text,
+        detections=detections,
+        slots=slot_results,
+        threshold=threshold,
+        engine=MATCHING_MODE,
+        image_size=(captured_img.shape[1], captured_img.shape[0]),
+        size_status=size_status,
+        image_hash=image_content_hash(captured_img),
+        fingerprint=template_bank.fingerprint(),
+        skipped_templates=last_skipped_templates,
+        timings=timings
+    )
 
 # 解析開始処理
 def start_analysis():
     try:
-        print(f"start_analysis関数が呼ばれました")
-        print(f"screenshotの状態: {screenshot is not None}")
+        logger.debug("start_analysis関数が呼ばれました")
+        logger.debug("screenshotの状態: %s", screenshot is not None)
         
         if screenshot is None:
-            print("screenshotがNoneのため、messageboxを表示します")
+            logger.debug("screenshotがNoneのため、messageboxを表示します")
             # messagebox.showerror("エラー", "キャプチャされた画像がありません。") # tkinterを削除
-            print("キャプチャされた画像がありません。")
+            logger.warning("キャプチャされた画像がありません。")
             return
         
-        print("analyze_image関数を呼び出します")
-        extracted_tags, extracted_text = analyze_image()
-        print(f"analyze_imageの結果: tags={extracted_tags}, text={extracted_text}")
+        logger.debug("analyze_image関数を呼び出します")
+        result = analyze_image()
+        logger.debug("analyze_imageの結果: tags=%s, text=%s", result.matched_tags, result.text)
         
         # 結果を保存
-        save_results(extracted_tags, extracted_text)
+        save_results(result)
         
-        print("start_analysis関数が完了しました")
+        logger.debug("start_analysis関数が完了しました")
         
     except Exception as e:
-        print(f"start_analysisでエラーが発生: {e}")
+        logger.error("start_analysisでエラーが発生: %s", e)
         # messagebox.showerror("エラー", str(e)) # tkinterを削除
-        print(str(e))
 
 # テスト用の関数
 def test_capture():
     """テスト用のキャプチャ関数"""
     global screenshot
     try:
-        print("テスト用キャプチャを実行します")
+        logger.debug("テスト用キャプチャを実行します")
         
         # ダミー画像を作成（テスト用）
-        dummy_img = Image.new('RGB', (800, 600), color='white')
+        dummy_img = np.full((600, 800, 3), 255, dtype=np.uint8)
         screenshot = dummy_img
         
-        print("ダミー画像を作成しました")
+        logger.debug("ダミー画像を作成しました")
         
         # 解析を開始
         start_analysis()
         
     except Exception as e:
-        print(f"テスト用キャプチャでエラー: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("テスト用キャプチャでエラー: %s", e)
+
+# 常駐ワーカーモード（1行1件の JSON で要求・応答をやり取りする）
+def warm_up_worker():
+    """テンプレートの読み込みと OpenCV の初期化を起動時に済ませる"""
+    template_bank = get_template_bank()
+    get_tag_frequencies()
+    sample = np.zeros((64, 64), dtype=np.uint8)
+    cv2.matchTemplate(sample, sample[:16, :16], cv2.TM_CCOEFF_NORMED)
+    if MATCHING_MODE == "fft":
+        template_bank.fft_engine()
+    elif MATCHING_MODE == "eigen":
+        get_eigen_classifier()
+    elif MATCHING_MODE == "high_quality" and HIGH_QUALITY_BACKEND == "process":
+        get_high_quality_process_backend()
+    template_bank.warm_up()
+    return template_bank
+
+def handle_worker_request(request, state):
+    """1件の要求を処理し、応答を返す
+
+    {"type": "ping"} には稼働状況を、{"type": "analyze", "source": "window"} には
+    キャプチャ・解析・report.txt / report.json の保存を行って検出タグと解析結果を返す。
+    """
+    global screenshot
+    request_type = request.get("type")
+    
+    if request_type == "ping":
+        return {
+            "type": "pong",
+            "pid": os.getpid(),
+            "uptime": round(time.time() - state["started"], 3),
+            "analyses": state["analyses"],
+            "mode": MATCHING_MODE,
+            "templates": len(get_template_bank().template_files)
+        }
+    
+    if request_type == "analyze":
+        start_time = time.time()
+        source_spec = request.get("source", "window")
+        with analysis_trace(source_spec) as trace:
+            screenshot = capture_screenshot() if source_spec == "window" else create_capture_source(source_spec).capture()
+            if screenshot is None:
+                raise RuntimeError("キャプチャに失敗しました")
+            result = analyze_image()
+            save_results(result)
+        state["analyses"] += 1
+        response = {
+            "type": "result",
+            "tags": result.matched_tags,
+            "text": result.text,
+            "report": os.path.join(get_script_dir(), "report.txt"),
+            "result": result.to_dict(),
+            "elapsed": round(time.time() - start_time, 3)
+        }
+        if trace is not None:
+            response["trace"] = trace.record
+        return response
+    
+    if request_type == "shutdown":
+        return {"type": "shutdown"}
+    
+    raise ValueError(f"不明な要求です: {request_type}")
+
+def run_worker():
+    """標準入力から要求を読み、標準出力に応答を書く（ログは標準エラーに出力）"""
+    protocol_out = sys.stdout
+    sys.stdout = sys.stderr  # ログや print の出力が応答と混ざらないようにする
+    configure_logging(stream=sys.stderr)
+    
+    def respond(message):
+        protocol_out.write(json.dumps(message) + "\n")
+        protocol_out.flush()
+    
+    state = {"started": time.time(), "analyses": 0}
+    template_bank = warm_up_worker()
+    respond({
+        "type": "ready",
+        "pid": os.getpid(),
+        "mode": MATCHING_MODE,
+        "templates": len(template_bank.template_files),
+        "import_ms": round(IMPORT_TIME * 1000),
+        "startup_ms": round((time.perf_counter() - _IMPORT_STARTED) * 1000)
+    })
+    
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            response = handle_worker_request(request, state)
+            response.update({"id": request_id, "ok": True})
+        except Exception as e:
+            logger.error("❌ 要求の処理でエラー: %s", e)
+            response = {"id": request_id, "ok": False, "error": str(e)}
+        respond(response)
+        if response.get("type") == "shutdown":
+            break
+
+# バッチ解析（保存済みスクリーンショットの一括再解析）
+BATCH_PROGRESS_INTERVAL = 50  # 進捗を表示する間隔（画像数）
+BATCH_QUEUE_FACTOR = 2  # ワーカー1つあたりの投入済み画像数の上限（パス一覧を先読みしすぎない）
+
+def iter_batch_images(pattern):
+    """ディレクトリ（サブディレクトリを含む）またはグロブに一致する画像ファイルを順に返す"""
+    if os.path.isdir(pattern):
+        for root, dirs, files in os.walk(pattern):
+            dirs.sort()
+            for file_name in sorted(files):
+                if file_name.lower().endswith(FileCaptureSource.IMAGE_EXTENSIONS):
+                    yield os.path.abspath(os.path.join(root, file_name))
+    else:
+        import glob
+        for path in sorted(glob.iglob(pattern, recursive=True)):
+            if os.path.isfile(path) and path.lower().endswith(FileCaptureSource.IMAGE_EXTENSIONS):
+                yield os.path.abspath(path)
+
+def load_batch_progress(output_path, fingerprint, mode):
+    """出力済みの JSON Lines から、同じテンプレート・モードで解析済みの画像パスを集める
+
+    エラーになった画像は再実行の対象に残す。中断時に書きかけになった最終行は読み飛ばす。
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, "r", encoding="utf-8") as output_file:
+        for line in output_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("error") is None and record.get("fingerprint") == fingerprint and record.get("mode") == mode:
+                completed.add(record.get("path"))
+    return completed
+
+def current_settings():
+    """モジュールの設定（大文字の定数）の現在値（コマンドライン引数・環境変数で変更したものを含む）
+
+    spawn で起動したワーカーはモジュールを読み込み直して既定値に戻るため、この値を引き継ぐ。
+    """
+    return {name: value for name, value in globals().items()
+            if name.isupper() and name != "IMPORT_TIME" and isinstance(value, (bool, int, float, str, tuple, list, dict))}
+
+def _init_batch_worker(settings):
+    """バッチ用ワーカーの初期化（親プロセスの設定を引き継ぎ、テンプレートはワーカーごとに一度だけ読み込む）"""
+    global USE_PARALLEL_MATCHING, USE_CALIBRATION_CACHE, HIGH_QUALITY_BACKEND
+    globals().update(settings)
+    USE_PARALLEL_MATCHING = False  # 並列化は画像単位で行う
+    USE_CALIBRATION_CACHE = False  # 複数プロセスから tag_calibration.json を書き換えない
+    HIGH_QUALITY_BACKEND = "thread"
+    cv2.setNumThreads(1)
+    configure_worker_process_logging("ERROR")  # 画像ごとの解析ログは出力しない
+    warm_up_worker()
+
+def analyze_batch_image(path):
+    """1枚の画像を解析し、JSON Lines の1行分の結果を返す（report.txt は書き出さない）"""
+    global screenshot
+    start_time = time.time()
+    record = {"path": path, "mode": MATCHING_MODE, "fingerprint": get_template_bank().fingerprint()}
+    trace = None
+    try:
+        with analysis_trace("batch", write=False) as trace:
+            screenshot = read_image(path)
+            if screenshot is None:
+                raise ValueError("画像を読み込めませんでした")
+            result = analyze_image()
+        result_record = result.to_dict()
+        record.update({
+            "tags": result.matched_tags,
+            "text": result.text,
+            "slots": result_record["slots"],
+            "scores": {tag_name: round(score, 4) for tag_name, score in last_template_scores},
+            "skipped_templates": result.skipped_templates,
+            "image_hash": result.image_hash,
+            "timings_ms": result_record["timings_ms"],
+            "error": result.error
+        })
+    except Exception as e:
+        record.update({"tags": [], "error": str(e)})
+    record["elapsed"] = round(time.time() - start_time, 3)
+    if trace is not None:
+        record["trace"] = trace.record
+    return record
+
+def run_batch(pattern, output_path, workers=0):
+    """画像をプロセスプールで解析し、1画像1行の JSON Lines に追記する
+
+    出力ファイルに同じテンプレート・モードの結果がある画像は省略するため、
+    中断した場合も同じコマンドで続きから再開できる。
+    """
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    
+    start_time = time.time()
+    fingerprint = get_template_bank().fingerprint()
+    completed = load_batch_progress(output_path, fingerprint, MATCHING_MODE)
+    if completed:
+        logger.info("♻️ 解析済みの %s 枚を省略して再開します", len(completed))
+    pending_paths = (path for path in iter_batch_images(pattern) if path not in completed)
+    workers = workers if workers > 0 else (os.cpu_count() or 1)
+    logger.info("📦 バッチ解析: %s → %s (モード: %s, ワーカー: %s)", pattern, output_path, MATCHING_MODE, workers)
+    
+    # 中断時の書きかけの行の後ろに続けて書かないよう改行を補う
+    if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+        with open(output_path, "rb") as output_file:
+            output_file.seek(-1, os.SEEK_END)
+            needs_newline = output_file.read(1) != b"\n"
+    else:
+        needs_newline = False
+    
+    counts = {"done": 0, "errors": 0}
+    with open(output_path, "a", encoding="utf-8") as output_file, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker, initargs=(current_settings(),)) as executor:
+        if needs_newline:
+            output_file.write("\n")
+        
+        def write_records(futures):
+            for future in futures:
+                record = future.result()
+                output_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output_file.flush()
+                counts["done"] += 1
+                if record["error"] is not None:
+                    counts["errors"] += 1
+                    logger.error("❌ %s: %s", record['path'], record['error'])
+                if counts["done"] % BATCH_PROGRESS_INTERVAL == 0:
+                    elapsed = time.time() - start_time
+                    logger.info("📦 %s 枚完了 (%.2f 枚/秒)", counts['done'], counts['done'] / elapsed)
+        
+        in_flight = set()
+        for path in pending_paths:
+            in_flight.add(executor.submit(analyze_batch_image, path))
+            if len(in_flight) >= workers * BATCH_QUEUE_FACTOR:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                write_records(finished)
+        write_records(wait(in_flight).done)
+    
+    elapsed = time.time() - start_time
+    logger.info("✅ バッチ解析完了: %s 枚 (エラー %s 枚, %.1f秒)", counts['done'], counts['errors'], elapsed)
+    return counts
+
+# モジュール読み込み時間（cv2 / numpy の読み込みを含む）
+IMPORT_TIME = time.perf_counter() - _IMPORT_STARTED
 
 # メイン実行部分
 if __name__ == "__main__":
-    print("=" * 50)
-    print("tag_analysis.py が実行されました")
-    print("=" * 50)
+    configure_console_encoding()
+    configure_logging(sys.argv[sys.argv.index("--log-level") + 1] if "--log-level" in sys.argv[1:] else None)
+    
+    if "--roi" in sys.argv[1:]:
+        # 照合する領域（左,上,右,下 をウィンドウに対する比率で指定、例: 0,0.3,1,0.75）
+        RECRUITMENT_ROI = tuple(float(value) for value in sys.argv[sys.argv.index("--roi") + 1].split(","))
+    
+    if "--artifacts" in sys.argv[1:]:
+        # report.png などの画像の保存方法（none / thumbnail / full）
+        ARTIFACT_POLICY = sys.argv[sys.argv.index("--artifacts") + 1]
+    
+    if "--trace" in sys.argv[1:]:
+        # 解析ごとの処理時間の内訳を tag_timings.jsonl に記録
+        USE_INSTRUMENTATION = True
+    
+    if "--worker" in sys.argv[1:]:
+        # 常駐ワーカーとして起動（main.js から使用）
+        run_worker()
+        sys.exit(0)
+    
+    if "--batch" in sys.argv[1:]:
+        # 保存済みスクリーンショットを一括解析（--output の JSON Lines に追記、中断しても再開可能）
+        batch_pattern = sys.argv[sys.argv.index("--batch") + 1]
+        batch_output = sys.argv[sys.argv.index("--output") + 1] if "--output" in sys.argv[1:] else "batch_results.jsonl"
+        batch_workers = int(sys.argv[sys.argv.index("--workers") + 1]) if "--workers" in sys.argv[1:] else 0
+        if "--mode" in sys.argv[1:]:
+            MATCHING_MODE = sys.argv[sys.argv.index("--mode") + 1]
+        run_batch(batch_pattern, batch_output, batch_workers)
+        sys.exit(0)
+    
+    if "--train-eigen" in sys.argv[1:]:
+        # 固有テンプレート（PCA）をオフラインで学習して tag_img の隣に保存
+        classifier = EigenTagClassifier.train(get_template_bank())
+        classifier.save(os.path.join(get_script_dir(), EIGEN_MODEL_FILE))
+        logger.info("✅ 固有テンプレートを保存しました: %s タグ, %s サンプル", len(classifier.tag_names), len(classifier.labels))
+        sys.exit(0)
+    
+    logger.info("tag_analysis.py が実行されました (モジュール読み込み時間: %.0fms)", IMPORT_TIME * 1000)
     
     try:
-        print("1. スクリプト開始")
-        
-        # ウィンドウ指定によるキャプチャを実行
-        print("2. capture_arknights_window() を呼び出し")
-        capture_arknights_window()
-        print("3. ウィンドウ指定によるキャプチャが実行されました")
+        logger.debug("1. スクリプト開始")
+        
+        if "--source" in sys.argv[1:]:
+            # 指定したキャプチャソース（file:<パス> / synthetic など）を順に解析
+            source_spec = sys.argv[sys.argv.index("--source") + 1]
+            logger.debug("2. キャプチャソース '%s' を解析", source_spec)
+            max_frames = int(sys.argv[sys.argv.index("--frames") + 1]) if "--frames" in sys.argv[1:] else None
+            if max_frames is None and source_spec.startswith("synthetic"):
+                max_frames = 1
+            run_capture_source(create_capture_source(source_spec), max_frames)
+            logger.debug("3. キャプチャソースの解析が完了しました")
+        else:
+            # ウィンドウ指定によるキャプチャを実行
+            logger.debug("2. capture_arknights_window() を呼び出し")
+            capture_arknights_window()
+            logger.debug("3. ウィンドウ指定によるキャプチャが実行されました")
         
     except Exception as e:
-        print(f"❌ メイン実行でエラーが発生しました: {e}")
+        logger.exception("❌ メイン実行でエラーが発生しました: %s", e)
         import traceback
-        traceback.print_exc()
         
         # エラーログに記録
         try:
@@ -1205,7 +3757,7 @@ if __name__ == "__main__":
                 error_file.write(f"{datetime.datetime.now()}: メイン実行エラー - {e}\n")
                 error_file.write(f"詳細: {traceback.format_exc()}\n")
         except:
-            print("エラーログの書き込みに失敗しました")
+            logger.error("エラーログの書き込みに失敗しました")
     
-    print("4. スクリプト終了")
-    print("=" * 50)
+    logger.info("⏱️ 起動から解析完了まで: %.0fms", (time.perf_counter() - _IMPORT_STARTED) * 1000)
+    logger.debug("4. スクリプト終了")